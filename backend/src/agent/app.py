@@ -3,12 +3,19 @@ import pathlib
 import tempfile
 import os
 import logging
-from fastapi import FastAPI, Response, UploadFile, File, HTTPException
+import queue
+import shutil
+import threading
+from fastapi import FastAPI, Response, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse
 from starlette.staticfiles import StaticFiles
 from typing import List, Dict, Any
 from pydantic import BaseModel
-from agent.kb_manager import kb_manager
+from agent.kb_manager import kb_manager, SCORING_MODES
+from agent.kb_jobs import ingestion_jobs
 from agent.conversation_manager import conversation_manager
 from agent.voice_service import transcribe_audio_async
 import uuid
@@ -68,32 +75,79 @@ def create_frontend_router(build_dir="../frontend/dist"):
 
 
 # Knowledge Base API Endpoints
+@app.on_event("startup")
+async def upgrade_knowledge_bases():
+    """Convert KBs written by older versions before queries are served."""
+    await run_in_threadpool(kb_manager.upgrade_knowledge_bases)
+
+
+@app.on_event("startup")
+async def warm_up_knowledge_bases():
+    """Preload configured hot KBs without delaying startup."""
+    if kb_manager.config.kb_warm_kb_ids:
+        threading.Thread(target=kb_manager.warm_up, name="kb-warm-up", daemon=True).start()
+
+
 @app.post("/api/knowledge-base/upload")
-async def upload_knowledge_base(files: List[UploadFile] = File(...)):
-    """Upload documents to create a new knowledge base."""
+async def upload_knowledge_base(
+    files: List[UploadFile] = File(...), scoring_mode: str = Form("bm25")
+):
+    """Upload documents to create a new knowledge base.
+
+    Files are ingested in the background; poll
+    ``/api/knowledge-base/jobs/{job_id}`` for progress.
+    """
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
+    if scoring_mode not in SCORING_MODES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown scoring mode '{scoring_mode}'"
+        )
 
     # Generate unique KB ID
     kb_id = f"custom_{uuid.uuid4().hex[:12]}"
     kb_name = f"Custom KB {kb_id[-6:]}"
 
+    # Manager calls block on disk I/O and the KB writer lock, so they run in
+    # the thread pool rather than on the event loop
     try:
         # Create KB
-        kb_manager.create_knowledge_base(kb_id, kb_name)
-
-        # Upload and process documents
-        result = kb_manager.upload_documents(kb_id, files)
+        await run_in_threadpool(
+            kb_manager.create_knowledge_base, kb_id, kb_name, scoring_mode=scoring_mode
+        )
 
-        return {
-            "status": "success",
-            "kb_id": kb_id,
-            "kb_name": kb_name,
-            **result,
-        }
+        # Spool uploads now; the request's files are closed once we return
+        spooled, errors = await run_in_threadpool(kb_manager.spool_uploads, files)
+        job = ingestion_jobs.submit(kb_id, spooled, errors)
+    except queue.Full:
+        for doc in spooled:
+            doc["path"].unlink(missing_ok=True)
+        await run_in_threadpool(kb_manager.delete_knowledge_base, kb_id)
+        raise HTTPException(
+            status_code=503, detail="Ingestion queue is full, retry later"
+        )
+    except ValueError as e:
+        # Scoring mode not supported by the configured storage backend
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    return {
+        "status": "accepted",
+        "kb_id": kb_id,
+        "kb_name": kb_name,
+        "job_id": job.id,
+    }
+
+
+@app.get("/api/knowledge-base/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """Report per-file progress, throughput and errors of an upload job."""
+    try:
+        return ingestion_jobs.status(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
 
 @app.get("/api/knowledge-base/list")
 async def list_knowledge_bases():
@@ -105,11 +159,105 @@ async def list_knowledge_bases():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/knowledge-base/query-cache")
+async def get_query_cache_stats():
+    """Report custom KB query cache usage."""
+    return kb_manager.query_cache_stats()
+
+
+@app.delete("/api/knowledge-base/{kb_id}/documents/{doc_id}")
+async def delete_document(kb_id: str, doc_id: str):
+    """Delete one document; it stops appearing in results immediately."""
+    try:
+        await run_in_threadpool(kb_manager.delete_document, kb_id, doc_id)
+        return {"status": "success", "message": f"Document '{doc_id}' deleted"}
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.put("/api/knowledge-base/{kb_id}/documents/{doc_id}")
+async def update_document(kb_id: str, doc_id: str, file: UploadFile = File(...)):
+    """Replace a document's content.
+
+    The new file is ingested in the background and the old document is
+    deleted in the same publish that makes the new one queryable.
+    """
+    kb = kb_manager.published.get(kb_id)
+    if kb is None or doc_id not in kb["documents"]:
+        raise HTTPException(
+            status_code=404, detail=f"Document '{doc_id}' not found in '{kb_id}'"
+        )
+
+    spooled, errors = await run_in_threadpool(kb_manager.spool_uploads, [file])
+    if errors:
+        raise HTTPException(status_code=400, detail=errors[0]["error"])
+
+    try:
+        job = ingestion_jobs.submit(kb_id, spooled, errors, replaces=doc_id)
+    except queue.Full:
+        spooled[0]["path"].unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=503, detail="Ingestion queue is full, retry later"
+        )
+
+    return {
+        "status": "accepted",
+        "kb_id": kb_id,
+        "doc_id": spooled[0]["doc_id"],
+        "job_id": job.id,
+    }
+
+
+@app.get("/api/knowledge-base/{kb_id}/export")
+async def export_knowledge_base(kb_id: str):
+    """Download a KB as one checksummed archive for another node to import."""
+    export_dir = pathlib.Path(tempfile.mkdtemp(prefix="kb-export-"))
+    path = export_dir / f"{kb_id}.kbz"
+    try:
+        stats = await run_in_threadpool(kb_manager.export_knowledge_base, kb_id, path)
+    except ValueError as e:
+        shutil.rmtree(export_dir, ignore_errors=True)
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        shutil.rmtree(export_dir, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        filename=path.name,
+        headers={"X-Content-SHA256": stats["sha256"]},
+        background=BackgroundTask(shutil.rmtree, export_dir, ignore_errors=True),
+    )
+
+
+@app.post("/api/knowledge-base/import")
+async def import_knowledge_base(file: UploadFile = File(...), kb_id: str = Form(None)):
+    """Add a KB from an archive exported by another node, without re-ingesting it."""
+    try:
+        kb_metadata = await run_in_threadpool(
+            kb_manager.import_knowledge_base, file.file, kb_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "status": "success",
+        "kb_id": kb_metadata["id"],
+        "document_count": kb_metadata["document_count"],
+        "chunk_count": kb_metadata.get("chunk_count", 0),
+    }
+
+
 @app.delete("/api/knowledge-base/{kb_id}")
 async def delete_knowledge_base(kb_id: str):
     """Delete a knowledge base."""
     try:
-        kb_manager.delete_knowledge_base(kb_id)
+        await run_in_threadpool(kb_manager.delete_knowledge_base, kb_id)
         return {"status": "success", "message": f"Knowledge base '{kb_id}' deleted"}
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -41,10 +41,12 @@ def query_custom_knowledge_base(
     Returns:
         Dict with 'results' and 'sources'
     """
-    from agent.kb_manager import kb_manager
+    from agent.kb_router import route_knowledge_base_query
 
     try:
-        return kb_manager.query_knowledge_base(kb_id, query, top_k)
+        return route_knowledge_base_query(
+            query, kb_type="custom", custom_kb_id=kb_id, top_k=top_k
+        )
     except Exception as e:
         print(f"Error querying custom KB '{kb_id}': {e}")
         return {"results": [], "sources": []}
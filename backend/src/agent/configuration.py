@@ -62,6 +62,125 @@ class Configuration(BaseModel):
         metadata={"description": "Number of knowledge base results to retrieve."},
     )
 
+    kb_cache_max_mb: int = Field(
+        default=512,
+        metadata={
+            "description": "Memory budget in MB for custom knowledge bases kept loaded in memory. Least recently queried KBs are evicted first."
+        },
+    )
+
+    kb_query_cache_size: int = Field(
+        default=1024,
+        metadata={
+            "description": "Number of custom knowledge base query results cached in memory. Results are dropped when their KB changes. 0 disables the cache."
+        },
+    )
+
+    kb_query_cache_ttl_seconds: int = Field(
+        default=600,
+        metadata={
+            "description": "Seconds a cached custom knowledge base query result is reused. 0 keeps results until evicted or their KB changes."
+        },
+    )
+
+    embedding_model: str = Field(
+        default="nomic-embed-text",
+        metadata={
+            "description": "Ollama embedding model used for custom knowledge bases in vector scoring mode."
+        },
+    )
+
+    embedding_batch_size: int = Field(
+        default=32,
+        metadata={
+            "description": "Number of chunks sent per Ollama embedding request during ingestion."
+        },
+    )
+
+    kb_ivf_nprobe: int = Field(
+        default=8,
+        metadata={
+            "description": "Number of IVF lists scanned per query on custom KBs in ivf scoring mode. Higher values improve recall at the cost of latency."
+        },
+    )
+
+    kb_ivf_nlist: int = Field(
+        default=0,
+        metadata={
+            "description": "Number of IVF lists (k-means clusters) trained for ivf scoring mode. 0 picks about 4 * sqrt(chunk count)."
+        },
+    )
+
+    kb_extract_workers: int = Field(
+        default=0,
+        metadata={
+            "description": "Worker processes for PDF/DOCX text extraction during custom KB uploads. 0 uses one per CPU core."
+        },
+    )
+
+    kb_ingest_queue_size: int = Field(
+        default=16,
+        metadata={
+            "description": "Maximum number of custom KB upload jobs waiting for background ingestion. Further uploads are rejected until the queue drains."
+        },
+    )
+
+    kb_compaction_ratio: float = Field(
+        default=0.2,
+        metadata={
+            "description": "Share of deleted chunks in a custom KB index segment that triggers a background rewrite of the segment."
+        },
+    )
+
+    kb_merge_factor: int = Field(
+        default=4,
+        metadata={
+            "description": "Number of similar-sized custom KB index segments merged into one by the background merger."
+        },
+    )
+
+    kb_chunk_tokens: int = Field(
+        default=512,
+        metadata={
+            "description": "Token budget of a custom KB chunk. Chunks end at sentence boundaries; longer sentences are cut between words."
+        },
+    )
+
+    kb_chunk_overlap_tokens: int = Field(
+        default=64,
+        metadata={
+            "description": "Tokens at the end of a custom KB chunk repeated at the start of the next one."
+        },
+    )
+
+    kb_tokenizer: str = Field(
+        default="estimate",
+        metadata={
+            "description": "Token counter for custom KB chunk sizing: 'estimate' (about four characters per token), 'words', or 'tiktoken:<encoding>' (requires the tiktoken package)."
+        },
+    )
+
+    kb_storage_backend: str = Field(
+        default="native",
+        metadata={
+            "description": "Storage backend for new custom KBs: 'native' (segmented index and chunk stores) or 'sqlite' (one SQLite FTS5 database per KB, BM25 scoring only)."
+        },
+    )
+
+    kb_chunk_compression: bool = Field(
+        default=True,
+        metadata={
+            "description": "Compress custom KB chunk text with zstd and a per-KB trained dictionary. Requires the zstandard package; text is stored uncompressed without it."
+        },
+    )
+
+    kb_warm_kb_ids: str = Field(
+        default="",
+        metadata={
+            "description": "Comma-separated custom KB IDs loaded in the background at startup, so their first queries do not pay the load. Other KBs are loaded on first query."
+        },
+    )
+
     # DeepResearch configuration
     max_research_loops: int = Field(
         default=3,
@@ -94,7 +94,7 @@ def retrieve_knowledge(state: AgentState, config: RunnableConfig) -> AgentState:
     print(f"Custom KB ID: {custom_kb_id}")  # NEW: Log custom KB ID
     print(f"Original Query: {last_message}")
     print(f"Search Keywords: {search_query}")
-    print(f"Top K: 10")
+    print(f"Top K: {configurable.top_k_results}")
 
     # Query the knowledge base using router with optimized keywords
     result = route_knowledge_base_query(
@@ -102,7 +102,7 @@ def retrieve_knowledge(state: AgentState, config: RunnableConfig) -> AgentState:
         kb_type=kb_type,
         repository=repo,
         custom_kb_id=custom_kb_id,  # NEW: Pass custom KB ID
-        top_k=10
+        top_k=configurable.top_k_results
     )
 
     print(f"\n📊 CNB API Results:")
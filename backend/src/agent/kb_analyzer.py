@@ -0,0 +1,52 @@
+"""Text analysis shared by custom KB indexing and querying.
+
+Text is NFKC-normalized and case-folded, then split into terms. Runs of
+Latin, Cyrillic and other space-delimited scripts become one term per word.
+Chinese, Japanese and Korean text has no spaces between words, so CJK runs
+become overlapping character bigrams, which keeps postings selective without
+a dictionary-based segmenter.
+"""
+import re
+import unicodedata
+from typing import List
+
+# Identifies the term rules; indexes built with other rules are rebuilt
+ANALYZER = "nfkc-cjk-bigram-1"
+
+# Hiragana, Katakana, CJK ideographs (incl. extension A and compatibility)
+# and Hangul syllables
+CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+
+_TERM_PATTERN = re.compile(f"([{CJK_RANGES}]+)|((?:(?![{CJK_RANGES}])\\w)+)")
+_CJK_PATTERN = re.compile(f"[{CJK_RANGES}]")
+
+
+def normalize(text: str) -> str:
+    """Apply NFKC normalization and case folding."""
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def analyze(text: str) -> List[str]:
+    """Split text into index terms.
+
+    Args:
+        text: Text to analyze
+
+    Returns:
+        Terms in text order: words, and character bigrams of CJK runs
+        (a single CJK character stands alone)
+    """
+    terms: List[str] = []
+    for cjk, word in _TERM_PATTERN.findall(normalize(text)):
+        if word:
+            terms.append(word)
+        elif len(cjk) == 1:
+            terms.append(cjk)
+        else:
+            terms.extend(cjk[i : i + 2] for i in range(len(cjk) - 1))
+    return terms
+
+
+def count_cjk(text: str) -> int:
+    """Count the CJK characters in a text."""
+    return len(_CJK_PATTERN.findall(text))
@@ -0,0 +1,257 @@
+"""Portable single-file archives of custom knowledge bases.
+
+An archive is a tar stream of a KB's files: the segment manifest, segment
+directories with their memory-mappable postings, vectors and IVF lists,
+chunk stores, the compression dictionary, the ingest manifest and, for
+SQLite KBs, the database. A ``kb_archive.json`` trailer closes the stream
+with the KB metadata and the SHA-256 of every file. The stream is
+compressed with zstd when installed, gzip otherwise.
+
+Import extracts and hashes every file in one streaming pass and rejects the
+archive unless all of them match the trailer. Nothing is re-chunked,
+re-indexed or re-embedded: extracted segments are memory-mapped as they are.
+
+Usage::
+
+    python -m agent.kb_archive export custom_docs custom_docs.kbz
+    python -m agent.kb_archive import custom_docs.kbz
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import tarfile
+import zlib
+from pathlib import Path, PurePosixPath
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+# Bumped when the archive layout changes incompatibly
+ARCHIVE_FORMAT = 1
+
+TRAILER_NAME = "kb_archive.json"
+
+# Chunk stores are compressed already, so a fast level does nearly as well
+COMPRESSION_LEVEL = 3
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_GZIP_MAGIC = b"\x1f\x8b"
+
+# Bytes read and written at a time while extracting
+_COPY_BLOCK_SIZE = 1024 * 1024
+
+# Errors of damaged or truncated compressed tar streams
+_CORRUPTION_ERRORS = (tarfile.TarError, EOFError, gzip.BadGzipFile, zlib.error) + (
+    (zstd.ZstdError,) if zstd is not None else ()
+)
+
+# Archive member name and the file, or the bytes, stored under it
+ArchiveEntry = Tuple[str, Union[Path, bytes]]
+
+
+class _HashingReader:
+    """File wrapper hashing everything read through it."""
+
+    def __init__(self, file: BinaryIO):
+        self._file = file
+        self.digest = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        self.digest.update(data)
+        return data
+
+
+class _HashingWriter:
+    """File wrapper hashing and counting everything written through it."""
+
+    def __init__(self, file: BinaryIO):
+        self._file = file
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+
+def _add_member(tar: tarfile.TarFile, name: str, source: Union[Path, bytes]) -> str:
+    """Append a file or bytes to the archive and return its SHA-256."""
+    info = tarfile.TarInfo(name)
+    if isinstance(source, bytes):
+        info.size = len(source)
+        reader = _HashingReader(io.BytesIO(source))
+        tar.addfile(info, reader)
+        return reader.digest.hexdigest()
+    stat = source.stat()
+    info.size = stat.st_size
+    info.mtime = int(stat.st_mtime)
+    with open(source, "rb") as f:
+        reader = _HashingReader(f)
+        tar.addfile(info, reader)
+    return reader.digest.hexdigest()
+
+
+def write_archive(
+    path: Path, metadata: Dict[str, Any], entries: Iterable[ArchiveEntry]
+) -> Dict[str, Any]:
+    """Write a KB archive, replacing ``path`` only once it is complete.
+
+    Args:
+        path: Archive file to write
+        metadata: KB metadata to restore on import
+        entries: Files to pack, by member name relative to the KB directory
+
+    Returns:
+        Number of files, archive size in bytes and the archive's SHA-256
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    checksums: Dict[str, str] = {}
+    try:
+        with open(tmp_path, "wb") as raw:
+            counted = _HashingWriter(raw)
+            if zstd is not None:
+                stream = zstd.ZstdCompressor(
+                    level=COMPRESSION_LEVEL, write_checksum=True
+                ).stream_writer(counted, closefd=False)
+            else:
+                stream = gzip.GzipFile(fileobj=counted, mode="wb", compresslevel=6)
+            with stream:
+                with tarfile.open(fileobj=stream, mode="w|") as tar:
+                    for name, source in entries:
+                        checksums[name] = _add_member(tar, name, source)
+                    trailer = {
+                        "format": ARCHIVE_FORMAT,
+                        "metadata": metadata,
+                        "files": checksums,
+                    }
+                    _add_member(
+                        tar, TRAILER_NAME, json.dumps(trailer, ensure_ascii=False).encode("utf-8")
+                    )
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return {
+        "files": len(checksums),
+        "bytes": counted.size,
+        "sha256": counted.digest.hexdigest(),
+    }
+
+
+def _member_path(directory: Path, name: str) -> Path:
+    """Resolve an archive member below ``directory``, rejecting escapes."""
+    parts = PurePosixPath(name).parts
+    if not parts or name.startswith("/") or any(part in (".", "..") for part in parts):
+        raise ValueError(f"Unsafe path '{name}' in knowledge base archive")
+    return directory.joinpath(*parts)
+
+
+def _open_stream(file: BinaryIO) -> BinaryIO:
+    """Return a decompressing reader for a zstd or gzip archive."""
+    magic = file.read(4)
+    file.seek(0)
+    if magic.startswith(_ZSTD_MAGIC):
+        if zstd is None:
+            raise ImportError(
+                "zstandard not installed. Install with: pip install zstandard"
+            )
+        return zstd.ZstdDecompressor().stream_reader(file, closefd=False)
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=file, mode="rb")
+    raise ValueError("Not a knowledge base archive")
+
+
+def read_archive(file: BinaryIO, directory: Path) -> Dict[str, Any]:
+    """Extract a KB archive into a directory, verifying every file.
+
+    Args:
+        file: Seekable binary file holding the archive
+        directory: Empty directory to extract into
+
+    Returns:
+        The KB metadata stored in the archive
+
+    Raises:
+        ValueError: If the archive is malformed, truncated, from a newer
+            format, or a file does not match its checksum
+    """
+    checksums: Dict[str, str] = {}
+    trailer: Optional[Dict[str, Any]] = None
+    try:
+        with _open_stream(file) as stream, tarfile.open(fileobj=stream, mode="r|") as tar:
+            for member in tar:
+                if trailer is not None or not member.isfile():
+                    raise ValueError(f"Unexpected entry '{member.name}' in knowledge base archive")
+                if member.name == TRAILER_NAME:
+                    trailer = json.loads(tar.extractfile(member).read())
+                    continue
+                target = _member_path(directory, member.name)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                digest = hashlib.sha256()
+                with tar.extractfile(member) as src, open(target, "wb") as dst:
+                    while block := src.read(_COPY_BLOCK_SIZE):
+                        digest.update(block)
+                        dst.write(block)
+                checksums[member.name] = digest.hexdigest()
+    except _CORRUPTION_ERRORS as e:
+        raise ValueError(f"Corrupt knowledge base archive: {e}")
+
+    if trailer is None:
+        raise ValueError("Knowledge base archive is truncated")
+    if trailer.get("format") != ARCHIVE_FORMAT:
+        raise ValueError(f"Unsupported knowledge base archive format {trailer.get('format')}")
+    if checksums != trailer["files"]:
+        raise ValueError("Knowledge base archive failed checksum verification")
+    return trailer["metadata"]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Export or import a custom knowledge base archive from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Copy custom knowledge bases between nodes as single-file archives"
+    )
+    parser.add_argument(
+        "--storage-dir",
+        default="./knowledge_bases",
+        help="Knowledge base storage directory of the server",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Write a KB to an archive")
+    export_parser.add_argument("kb_id", help="Knowledge base to export")
+    export_parser.add_argument("archive", type=Path, help="Archive file to write")
+    import_parser = commands.add_parser("import", help="Add a KB from an archive")
+    import_parser.add_argument("archive", type=Path, help="Archive file to read")
+    import_parser.add_argument("--kb-id", help="Import under this ID instead of the archived one")
+    args = parser.parse_args(argv)
+
+    # Imported here: the manager itself imports this module
+    from agent.kb_manager import KnowledgeBaseManager
+
+    manager = KnowledgeBaseManager(storage_dir=args.storage_dir)
+    try:
+        if args.command == "export":
+            stats = manager.export_knowledge_base(args.kb_id, args.archive)
+            print(f"📦 Exported {args.kb_id}: {stats['files']} files, {stats['bytes'] / 1e6:.1f} MB")
+            print(f"🔒 sha256 {stats['sha256']}")
+        else:
+            kb_metadata = manager.import_knowledge_base(args.archive, kb_id=args.kb_id)
+            print(f"✅ Imported {kb_metadata['id']} ({kb_metadata['chunk_count']} chunks)")
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""In-memory caching for loaded custom knowledge bases and query results."""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class KBCache:
+    """LRU cache of loaded knowledge bases bounded by a memory budget.
+
+    Entries are keyed by KB ID and tagged with the KB's version stamp, so a
+    lookup with a newer version misses and the stale entry is replaced on the
+    next :meth:`put`. Least recently used KBs are evicted once the summed size
+    estimates exceed ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes: int):
+        """Initialize an empty cache.
+
+        Args:
+            max_bytes: Memory budget for all cached entries, in bytes
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries: OrderedDict[str, Tuple[int, Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, kb_id: str) -> bool:
+        """Check whether any version of a KB is resident."""
+        return kb_id in self._entries
+
+    def get(self, kb_id: str, version: int) -> Optional[Any]:
+        """Return the cached entry for a KB version, or None on a miss."""
+        with self._lock:
+            cached = self._entries.get(kb_id)
+            if cached is None or cached[0] != version:
+                return None
+            self._entries.move_to_end(kb_id)
+            return cached[1]
+
+    def peek(self, kb_id: str) -> Optional[Any]:
+        """Return the cached entry of any version of a KB, or None.
+
+        Does not count as a use, so a stale entry stays first in line for
+        eviction. Lets a reload reuse the parts of the old version that did
+        not change.
+        """
+        with self._lock:
+            cached = self._entries.get(kb_id)
+            return cached[1] if cached is not None else None
+
+    def put(self, kb_id: str, version: int, value: Any, size: int):
+        """Cache an entry and evict cold KBs until within budget.
+
+        Args:
+            kb_id: Knowledge base identifier
+            version: Version stamp the entry was loaded at
+            value: Loaded KB data
+            size: Estimated memory footprint of ``value`` in bytes
+        """
+        with self._lock:
+            cached = self._entries.get(kb_id)
+            if cached is not None and cached[0] > version:
+                # A slow load of an older version must not evict a newer one
+                return
+            self._remove(kb_id)
+            if size > self.max_bytes:
+                return
+
+            self._entries[kb_id] = (version, value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                evicted_id = next(iter(self._entries))
+                self._remove(evicted_id)
+
+    def invalidate(self, kb_id: str):
+        """Drop any cached version of a KB."""
+        with self._lock:
+            self._remove(kb_id)
+
+    def _remove(self, kb_id: str):
+        """Remove an entry and release its budget. Caller holds the lock."""
+        cached = self._entries.pop(kb_id, None)
+        if cached is not None:
+            self.current_bytes -= cached[2]
+
+
+class QueryCache:
+    """LRU cache of query results with a time-to-live.
+
+    Keys start with the KB ID and include the KB's version stamp, so results
+    of an older version are never returned; :meth:`invalidate` also drops
+    them eagerly when a KB changes. Hit and miss counters help size the
+    cache.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        """Initialize an empty cache.
+
+        Args:
+            max_entries: Number of results kept; 0 disables caching
+            ttl_seconds: Seconds a result stays valid; 0 means no expiry
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Tuple[Any, ...], Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of cached results."""
+        return len(self._entries)
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[Any]:
+        """Return the cached result for a key, or None on a miss or expiry."""
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and self.ttl_seconds and time.monotonic() > cached[0]:
+                del self._entries[key]
+                cached = None
+            if cached is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, key: Tuple[Hashable, ...], value: Any):
+        """Cache a result, evicting the least recently used beyond the limit."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kb_id: str):
+        """Drop every cached result of a KB."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == kb_id]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,170 @@
+"""Token-sized, single-pass chunking of document text streams."""
+import re
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from agent.kb_analyzer import count_cjk
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Sentence pieces longer than this are cut at whitespace, or at this length
+# if they have none, while chunking
+MAX_PENDING_SENTENCE_CHARS = 64 * 1024
+
+# Latin sentence ends need following whitespace; CJK ones are not spaced
+_SENTENCE_BOUNDARY = re.compile(r"[.!?]+\s+|[。！？]+\s*")
+
+# Counts the model tokens of a piece of text
+TokenCounter = Callable[[str], int]
+
+
+def count_words(text: str) -> int:
+    """Count whitespace-separated words, the sizing used before token budgets."""
+    return len(text.split())
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate BPE tokens as one per CJK character and one per four other characters."""
+    cjk = count_cjk(text)
+    return max((len(text) - cjk + 3) // 4 + cjk, 1 if text.strip() else 0)
+
+
+def get_token_counter(name: str) -> TokenCounter:
+    """Return the token counter for a tokenizer setting.
+
+    Args:
+        name: "words", "estimate", or "tiktoken:<encoding>" such as
+            "tiktoken:cl100k_base"
+
+    Returns:
+        Function counting the tokens of a text
+    """
+    if name == "words":
+        return count_words
+    if name == "estimate":
+        return estimate_tokens
+    if name.startswith("tiktoken:"):
+        if tiktoken is None:
+            raise ImportError("tiktoken not installed. Install with: pip install tiktoken")
+        encoding = tiktoken.get_encoding(name.split(":", 1)[1])
+        return lambda text: len(encoding.encode_ordinary(text))
+    raise ValueError(f"Unknown tokenizer '{name}'")
+
+
+class TokenChunker:
+    """Packs sentences from a text stream into overlapping, token-sized chunks.
+
+    Text is split into sentences in one pass as pieces arrive; a sentence's
+    tokens are counted once, and words are only counted one by one for the
+    overlap carried into the next chunk and for sentences that alone exceed
+    the budget.
+    """
+
+    def __init__(
+        self,
+        chunk_tokens: int = 512,
+        overlap_tokens: int = 64,
+        count_tokens: TokenCounter = estimate_tokens,
+    ):
+        """Configure chunk sizing.
+
+        Args:
+            chunk_tokens: Token budget of a chunk
+            overlap_tokens: Tokens of the previous chunk repeated at the start
+                of the next one
+            count_tokens: Token counter of the target model
+        """
+        if not 0 <= overlap_tokens < chunk_tokens:
+            raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count_tokens = count_tokens
+
+    def _overlap(self, words: List[str]) -> Tuple[List[str], int]:
+        """Return the trailing words fitting the overlap budget, and their tokens."""
+        kept, tokens = 0, 0
+        for word in reversed(words):
+            word_tokens = self.count_tokens(word)
+            if tokens + word_tokens > self.overlap_tokens:
+                break
+            tokens += word_tokens
+            kept += 1
+        return words[len(words) - kept :], tokens
+
+    def _split_word(self, word: str) -> List[str]:
+        """Cut a word over the chunk budget, such as an unspaced CJK run, into slices."""
+        word_tokens = self.count_tokens(word)
+        if word_tokens <= self.chunk_tokens - self.overlap_tokens:
+            return [word]
+        size = max(1, len(word) * (self.chunk_tokens - self.overlap_tokens) // word_tokens)
+        return [word[i : i + size] for i in range(0, len(word), size)]
+
+    def chunks(self, text_stream: Iterable[str]) -> Iterator[str]:
+        """Chunk text pieces in document order.
+
+        Sentences may span pieces: the trailing, possibly incomplete sentence
+        of each piece is carried over to the next one.
+
+        Args:
+            text_stream: Text pieces in document order
+
+        Yields:
+            Text chunks
+        """
+        budget = self.chunk_tokens
+        words: List[str] = []
+        tokens = 0
+        # Words added since the last chunk was emitted
+        fresh = 0
+
+        def emit() -> str:
+            nonlocal words, tokens, fresh
+            chunk = " ".join(words)
+            words, tokens = self._overlap(words)
+            fresh = 0
+            return chunk
+
+        def add_sentence(sentence: str) -> Iterator[str]:
+            nonlocal tokens, fresh
+            sentence_words = sentence.split()
+            if not sentence_words:
+                return
+            sentence_tokens = self.count_tokens(sentence)
+            if tokens + sentence_tokens > budget and fresh:
+                yield emit()
+            if tokens + sentence_tokens <= budget:
+                words.extend(sentence_words)
+                tokens += sentence_tokens
+                fresh += len(sentence_words)
+                return
+
+            # The sentence alone exceeds the budget; cut it between words
+            for word in sentence_words:
+                for piece in self._split_word(word):
+                    piece_tokens = self.count_tokens(piece)
+                    if tokens + piece_tokens > budget and fresh:
+                        yield emit()
+                    words.append(piece)
+                    tokens += piece_tokens
+                    fresh += 1
+
+        pending = ""
+        for piece in text_stream:
+            sentences = _SENTENCE_BOUNDARY.split(pending + piece)
+            pending = sentences.pop()
+            if len(pending) > MAX_PENDING_SENTENCE_CHARS:
+                # No sentence boundary in sight; cut at the last whitespace
+                head, _, pending = pending.rpartition(" ")
+                sentences.append(head)
+                # Text without whitespace is cut at a fixed length instead
+                while len(pending) > MAX_PENDING_SENTENCE_CHARS:
+                    sentences.append(pending[:MAX_PENDING_SENTENCE_CHARS])
+                    pending = pending[MAX_PENDING_SENTENCE_CHARS:]
+            for sentence in sentences:
+                yield from add_sentence(sentence)
+        yield from add_sentence(pending)
+
+        if fresh:
+            yield " ".join(words)
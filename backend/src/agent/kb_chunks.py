@@ -0,0 +1,298 @@
+"""Compact binary chunk storage for custom knowledge base documents.
+
+Each document's chunks live in one ``<doc_id>.chunks`` file:
+
+    magic | blocks | block table | chunk table | metadata | footer
+
+Chunk texts are UTF-8 encoded and packed into blocks of about
+``BLOCK_SIZE`` bytes, each compressed on its own with zstd, optionally with
+a dictionary trained on the KB. The block table holds ``n_blocks + 1``
+little-endian uint64 file offsets; the chunk table holds one fixed-width
+``(block, start, end)`` entry per chunk, locating its text inside the
+decompressed block. Metadata is one JSON object of document-level columns
+(document ID, filename, upload time, codec, dictionary ID) plus the ``refs``
+column listing deduplicated chunks as ``[chunk_index, chunk_id]``; those
+chunks store no text. The fixed-size footer locates the tables and the
+metadata, so reading one chunk touches the footer, two table entries and a
+single block.
+
+Without zstd installed, blocks are stored uncompressed.
+"""
+import json
+import mmap
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+MAGIC = b"KBC2"
+# Format written before block compression: texts, uint64 offsets, metadata
+MAGIC_V1 = b"KBC1"
+
+# Uncompressed bytes per block; blocks hold whole chunks
+BLOCK_SIZE = 16 * 1024
+
+# zstd compression level for chunk blocks
+COMPRESSION_LEVEL = 9
+
+# Dictionary size and minimum sample count for KB dictionary training
+DICTIONARY_SIZE = 64 * 1024
+DICTIONARY_MIN_SAMPLES = 64
+
+# block table position, block count, chunk table position, chunk count,
+# metadata position, magic
+_FOOTER = struct.Struct("<QQQQQ4s")
+_FOOTER_V1 = struct.Struct("<QQQ4s")
+_BLOCK = struct.Struct("<QQ")
+_CHUNK = struct.Struct("<III")
+
+
+def train_dictionary(samples: List[str]) -> Optional[bytes]:
+    """Train a zstd dictionary on chunk texts.
+
+    Args:
+        samples: Chunk texts representative of the KB
+
+    Returns:
+        The serialized dictionary, or None if zstd is not installed or there
+        is too little text to train on
+    """
+    if zstd is None or len(samples) < DICTIONARY_MIN_SAMPLES:
+        return None
+    try:
+        dictionary = zstd.train_dictionary(
+            DICTIONARY_SIZE, [sample.encode("utf-8") for sample in samples]
+        )
+    except zstd.ZstdError:
+        return None
+    return dictionary.as_bytes()
+
+
+class ChunkStoreWriter:
+    """Streams a document's chunks into a chunk store file."""
+
+    def __init__(
+        self,
+        path: Path,
+        document_id: str,
+        filename: str,
+        uploaded_at: str,
+        compress: bool = True,
+        dictionary: Optional[bytes] = None,
+    ):
+        """Open a chunk store for writing.
+
+        Args:
+            path: File to write; renamed into place by the caller once closed
+            document_id: Document identifier
+            filename: Original filename
+            uploaded_at: ISO upload timestamp
+            compress: Compress blocks with zstd if it is installed
+            dictionary: Serialized zstd dictionary to compress with
+        """
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._compressor = None
+        dict_id = 0
+        if compress and zstd is not None:
+            dict_data = None
+            if dictionary is not None:
+                dict_data = zstd.ZstdCompressionDict(dictionary)
+                dict_id = dict_data.dict_id()
+            self._compressor = zstd.ZstdCompressor(
+                level=COMPRESSION_LEVEL, dict_data=dict_data
+            )
+
+        self._blocks = [len(MAGIC)]
+        self._chunks: List[Tuple[int, int, int]] = []
+        self._block = bytearray()
+        self._refs: List[List[Any]] = []
+        self._metadata = {
+            "document_id": document_id,
+            "filename": filename,
+            "uploaded_at": uploaded_at,
+            "codec": "zstd" if self._compressor is not None else "none",
+            "dict_id": dict_id,
+        }
+
+    def __len__(self) -> int:
+        """Return the number of chunks written so far."""
+        return len(self._chunks)
+
+    def add(self, text: str):
+        """Append a chunk's text."""
+        data = text.encode("utf-8")
+        if self._block and len(self._block) + len(data) > BLOCK_SIZE:
+            self._flush_block()
+        start = len(self._block)
+        self._block += data
+        self._chunks.append((len(self._blocks) - 1, start, len(self._block)))
+
+    def add_reference(self, chunk_id: str):
+        """Append a chunk whose text is stored as ``chunk_id``."""
+        self._refs.append([len(self), chunk_id])
+        self._chunks.append((len(self._blocks) - 1, 0, 0))
+
+    def _flush_block(self):
+        """Compress and write the current block."""
+        data = bytes(self._block)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._file.write(data)
+        self._blocks.append(self._blocks[-1] + len(data))
+        self._block.clear()
+
+    def close(self):
+        """Write the last block, tables, metadata and footer, and close the file."""
+        if self._block:
+            self._flush_block()
+
+        blocks_pos = self._blocks[-1]
+        for offset in self._blocks:
+            self._file.write(struct.pack("<Q", offset))
+        chunks_pos = blocks_pos + 8 * len(self._blocks)
+        for entry in self._chunks:
+            self._file.write(_CHUNK.pack(*entry))
+
+        meta_pos = chunks_pos + _CHUNK.size * len(self._chunks)
+        self._file.write(
+            json.dumps({**self._metadata, "refs": self._refs}, ensure_ascii=False).encode(
+                "utf-8"
+            )
+        )
+        self._file.write(
+            _FOOTER.pack(
+                blocks_pos, len(self._blocks) - 1, chunks_pos, len(self), meta_pos, MAGIC
+            )
+        )
+        self._file.close()
+
+    def abort(self):
+        """Close the file without completing it."""
+        self._file.close()
+
+
+class ChunkStore:
+    """Read-only, memory-mapped view of a chunk store file.
+
+    Only the blocks holding requested chunks are read and decompressed; the
+    most recent block is kept for chunks that share it.
+    """
+
+    SUFFIX = ".chunks"
+
+    def __init__(self, path: Path, dictionary: Optional[bytes] = None):
+        """Map a chunk store file.
+
+        Args:
+            path: Chunk store file
+            dictionary: Serialized zstd dictionary of the KB, if it has one
+
+        Raises:
+            ValueError: If the file is not a chunk store
+        """
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._dictionary = dictionary
+        self._decompressor = None
+        self._block_cache: Tuple[int, bytes] = (-1, b"")
+        self._metadata: Optional[Dict[str, Any]] = None
+
+        magic = self._mm[: len(MAGIC)]
+        size = len(self._mm)
+        if magic == MAGIC and size >= len(MAGIC) + _FOOTER.size:
+            self.version = 2
+            (
+                self._blocks_pos,
+                self._n_blocks,
+                self._chunks_pos,
+                self.n_chunks,
+                self._meta_pos,
+                _,
+            ) = _FOOTER.unpack_from(self._mm, size - _FOOTER.size)
+            self._meta_end = size - _FOOTER.size
+        elif magic == MAGIC_V1 and size >= len(MAGIC_V1) + _FOOTER_V1.size:
+            self.version = 1
+            self._chunks_pos, self.n_chunks, self._meta_pos, _ = _FOOTER_V1.unpack_from(
+                self._mm, size - _FOOTER_V1.size
+            )
+            self._meta_end = size - _FOOTER_V1.size
+        else:
+            self._mm.close()
+            raise ValueError(f"Not a chunk store: {path}")
+
+    def __len__(self) -> int:
+        """Return the number of chunks in the document."""
+        return self.n_chunks
+
+    def __enter__(self) -> "ChunkStore":
+        """Return the store for use in a ``with`` block."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the store when the ``with`` block exits."""
+        self.close()
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """Document-level metadata and the ``refs`` column, parsed on first use."""
+        if self._metadata is None:
+            raw = self._mm[self._meta_pos : self._meta_end]
+            self._metadata = json.loads(raw.decode("utf-8"))
+        return self._metadata
+
+    def _read_block(self, block: int) -> bytes:
+        """Return the decompressed bytes of a block."""
+        if self._block_cache[0] == block:
+            return self._block_cache[1]
+
+        start, end = _BLOCK.unpack_from(self._mm, self._blocks_pos + 8 * block)
+        data = self._mm[start:end]
+        if self.metadata.get("codec") == "zstd":
+            data = self._decompress(data)
+        self._block_cache = (block, data)
+        return data
+
+    def _decompress(self, data: bytes) -> bytes:
+        """Decompress a zstd block, with the KB dictionary if it was used."""
+        if self._decompressor is None:
+            if zstd is None:
+                raise ImportError(
+                    "zstandard not installed. Install with: pip install zstandard"
+                )
+            dict_data = None
+            if self.metadata.get("dict_id"):
+                if self._dictionary is None:
+                    raise ValueError("Chunk store needs the KB's compression dictionary")
+                dict_data = zstd.ZstdCompressionDict(self._dictionary)
+                if dict_data.dict_id() != self.metadata["dict_id"]:
+                    raise ValueError("Chunk store was compressed with another dictionary")
+            self._decompressor = zstd.ZstdDecompressor(dict_data=dict_data)
+        return self._decompressor.decompress(data)
+
+    def text(self, chunk_index: int) -> str:
+        """Return the stored text of a chunk; empty for deduplicated chunks."""
+        if not 0 <= chunk_index < self.n_chunks:
+            raise IndexError(f"Chunk {chunk_index} out of range")
+        if self.version == 1:
+            start, end = _BLOCK.unpack_from(self._mm, self._chunks_pos + 8 * chunk_index)
+            return self._mm[start:end].decode("utf-8")
+
+        block, start, end = _CHUNK.unpack_from(
+            self._mm, self._chunks_pos + _CHUNK.size * chunk_index
+        )
+        if start == end:
+            return ""
+        return self._read_block(block)[start:end].decode("utf-8")
+
+    def references(self) -> Dict[int, str]:
+        """Map the index of every deduplicated chunk to the chunk it repeats."""
+        return {index: chunk_id for index, chunk_id in self.metadata["refs"]}
+
+    def close(self):
+        """Unmap the file."""
+        self._mm.close()
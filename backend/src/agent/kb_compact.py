@@ -0,0 +1,63 @@
+"""Background compaction of custom knowledge bases after document deletes."""
+import threading
+from typing import Callable, List, Optional
+
+
+class BackgroundCompactor:
+    """Runs compaction for scheduled KBs on a daemon thread.
+
+    Scheduling a KB that is already pending is a no-op, so a burst of
+    deletes results in a single compaction pass.
+    """
+
+    def __init__(self, compact: Callable[[str], None]):
+        """Initialize the compactor; the worker starts on first schedule.
+
+        Args:
+            compact: Function compacting one KB, called with its ID
+        """
+        self.compact = compact
+        self._pending: List[str] = []
+        self._condition = threading.Condition()
+        self._running = 0
+        self._worker: Optional[threading.Thread] = None
+
+    def schedule(self, kb_id: str):
+        """Queue a KB for compaction unless it is already pending."""
+        with self._condition:
+            if kb_id not in self._pending:
+                self._pending.append(kb_id)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="kb-compaction", daemon=True
+                )
+                self._worker.start()
+            self._condition.notify_all()
+
+    def _run(self):
+        """Compact pending KBs forever."""
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                kb_id = self._pending.pop(0)
+                self._running += 1
+            try:
+                self.compact(kb_id)
+            except Exception as e:
+                print(f"⚠️ Compaction of {kb_id} failed: {e}")
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    self._condition.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until no compaction is pending or running.
+
+        Returns:
+            True if the compactor went idle before the timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._running, timeout
+            )
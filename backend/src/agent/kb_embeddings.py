@@ -0,0 +1,209 @@
+"""Dense-vector retrieval for custom knowledge bases using Ollama embeddings."""
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from agent.kb_index import load_array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def content_hash(text: str) -> str:
+    """Return the SHA-256 hex digest identifying a chunk's content."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize(matrix: "np.ndarray") -> "np.ndarray":
+    """L2-normalize the rows of a matrix so dot products are cosines."""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+class EmbeddingCache:
+    """SQLite store of embeddings keyed by model and chunk content hash."""
+
+    def __init__(self, db_path: Path):
+        """Open (or create) the cache database.
+
+        Args:
+            db_path: Path of the SQLite file
+        """
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, "np.ndarray"]:
+        """Look up cached vectors for the given content hashes."""
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? "
+                    f"AND hash IN ({placeholders})",
+                    [model, *batch],
+                )
+                for hash_, blob in rows:
+                    found[hash_] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, "np.ndarray"]):
+        """Store vectors under their content hashes."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [
+                    (model, hash_, np.asarray(vector, dtype=np.float32).tobytes())
+                    for hash_, vector in vectors.items()
+                ],
+            )
+            self._conn.commit()
+
+
+class OllamaEmbedder:
+    """Batched embedding client for an Ollama server with a content-hash cache."""
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        cache: EmbeddingCache,
+        batch_size: int = 32,
+        timeout: int = 120,
+    ):
+        """Initialize the embedder.
+
+        Args:
+            base_url: Base URL of the Ollama server
+            model: Ollama embedding model name
+            cache: Cache consulted before calling the server
+            batch_size: Number of texts sent per request
+            timeout: Request timeout in seconds
+        """
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.cache = cache
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def _request_embeddings(self, texts: List[str]) -> "np.ndarray":
+        """Call the Ollama embed API for one batch."""
+        response = requests.post(
+            f"{self.base_url}/api/embed",
+            json={"model": self.model, "input": texts},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return np.asarray(response.json()["embeddings"], dtype=np.float32)
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        """Embed texts, reusing cached vectors for previously seen content.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Float32 matrix of L2-normalized embeddings, one row per text
+        """
+        hashes = [content_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model, list(set(hashes)))
+
+        missing = list({h: t for h, t in zip(hashes, texts) if h not in vectors}.items())
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start : start + self.batch_size]
+            embedded = normalize(self._request_embeddings([t for _, t in batch]))
+            new_vectors = {h: embedded[i] for i, (h, _) in enumerate(batch)}
+            self.cache.put_many(self.model, new_vectors)
+            vectors.update(new_vectors)
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[h] for h in hashes])
+
+    def embed_query(self, query: str) -> "np.ndarray":
+        """Embed a single query without caching it."""
+        return normalize(self._request_embeddings([query]))[0]
+
+
+class VectorStore:
+    """Per-KB float32 embedding matrix stored as ``.npy`` and memory-mapped."""
+
+    FILENAME = "_embeddings.npy"
+
+    @staticmethod
+    def append(path: Path, blocks: List["np.ndarray"]):
+        """Append blocks of rows to the stored matrix, creating it if missing."""
+        if path.exists():
+            blocks = [load_array(path), *blocks]
+        blocks = [block for block in blocks if len(block)]
+        if not blocks:
+            return
+        VectorStore.write(path, np.concatenate(blocks))
+
+    @staticmethod
+    def write(path: Path, vectors: "np.ndarray"):
+        """Replace the stored matrix with ``vectors``."""
+        # Replace rather than overwrite: readers may still have the old file mapped
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: Path) -> "np.ndarray":
+        """Memory-map the stored matrix read-only."""
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+        return load_array(path)
+
+    @staticmethod
+    def search(
+        vectors: "np.ndarray",
+        query_vector: "np.ndarray",
+        top_k: int = 5,
+        exclude: Optional[List[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Rank rows by cosine similarity with one matrix-vector product.
+
+        Args:
+            vectors: Normalized embedding matrix
+            query_vector: Normalized query embedding
+            top_k: Number of results to return
+            exclude: Rows never returned, such as tombstoned chunks
+
+        Returns:
+            List of ``(ordinal, score)`` tuples, best first
+        """
+        if len(vectors) == 0 or top_k <= 0:
+            return []
+
+        scores = vectors @ query_vector
+        k = min(top_k, len(scores))
+        if exclude:
+            scores[exclude] = -np.inf
+            k = min(k, len(scores) - len(exclude))
+            if k <= 0:
+                return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ordinal), float(scores[ordinal])) for ordinal in top]
@@ -0,0 +1,196 @@
+"""Parallel text extraction for custom knowledge base uploads.
+
+PDF and DOCX parsing is CPU-bound pure Python, so extraction runs in a process
+pool. Uploaded files are split into tasks (page ranges for PDFs, one task per
+DOCX) that run concurrently, and their text is handed back strictly in
+document and page order.
+"""
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, Future
+from pathlib import Path
+from typing import Callable, Deque, Iterator, List, Optional, Tuple
+
+# For document processing
+try:
+    from PyPDF2 import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    from docx import Document as DocxDocument
+except ImportError:
+    DocxDocument = None
+
+# Pages extracted per pool task; bounds per-task memory and balances load
+PDF_PAGES_PER_TASK = 16
+
+# Block size used when streaming plain text files
+TEXT_BLOCK_SIZE = 1024 * 1024
+
+
+def pdf_page_count(path: Path) -> int:
+    """Return the number of pages in a PDF file."""
+    if PdfReader is None:
+        raise ImportError("PyPDF2 not installed. Install with: pip install PyPDF2")
+
+    with open(path, "rb") as pdf_file:
+        return len(PdfReader(pdf_file).pages)
+
+
+def extract_pdf_pages(path: Path, start: int, end: int) -> List[str]:
+    """Extract the text of pages ``start`` to ``end`` (exclusive) of a PDF."""
+    if PdfReader is None:
+        raise ImportError("PyPDF2 not installed. Install with: pip install PyPDF2")
+
+    with open(path, "rb") as pdf_file:
+        pdf_reader = PdfReader(pdf_file)
+        return [
+            (pdf_reader.pages[i].extract_text() or "") + "\n\n" for i in range(start, end)
+        ]
+
+
+def extract_docx_paragraphs(path: Path) -> List[str]:
+    """Extract the non-empty paragraphs of a DOCX file."""
+    if DocxDocument is None:
+        raise ImportError(
+            "python-docx not installed. Install with: pip install python-docx"
+        )
+
+    doc = DocxDocument(str(path))
+    return [p.text + "\n\n" for p in doc.paragraphs if p.text.strip()]
+
+
+def iter_text_blocks(path: Path) -> Iterator[str]:
+    """Yield a text file's decoded content block by block."""
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        while True:
+            block = f.read(TEXT_BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def plan_tasks(path: Path, ext: str) -> List[Tuple[Callable[..., List[str]], tuple]]:
+    """Split one document's extraction into pool tasks.
+
+    Args:
+        path: Path of the spooled document
+        ext: Lowercase file extension
+
+    Returns:
+        Ordered ``(function, args)`` tasks; empty for plain text, which is
+        streamed in-process instead
+    """
+    if ext == ".pdf":
+        n_pages = pdf_page_count(path)
+        return [
+            (extract_pdf_pages, (path, start, min(start + PDF_PAGES_PER_TASK, n_pages)))
+            for start in range(0, n_pages, PDF_PAGES_PER_TASK)
+        ]
+    if ext in [".docx", ".doc"]:
+        return [(extract_docx_paragraphs, (path,))]
+    return []
+
+
+def create_extraction_pool(max_workers: int) -> Executor:
+    """Create a process pool for extraction tasks.
+
+    Workers are spawned rather than forked because the API process runs
+    threads, which ``fork`` does not copy safely.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+class ExtractionPipeline:
+    """Ordered, bounded fan-out of extraction tasks for a batch of documents.
+
+    At most ``max_in_flight`` tasks are submitted at once, across document
+    boundaries, so extraction of later files overlaps with chunking of
+    earlier ones while memory stays bounded.
+    """
+
+    def __init__(
+        self,
+        documents: List[Tuple[Path, str]],
+        pool: Optional[Executor],
+        max_in_flight: int,
+    ):
+        """Plan extraction for a batch of documents.
+
+        Args:
+            documents: ``(spooled_path, extension)`` per document, in order
+            pool: Executor to run tasks on; None extracts inline
+            max_in_flight: Maximum number of submitted, unconsumed tasks
+        """
+        self.documents = documents
+        self.pool = pool
+        self.max_in_flight = max(1, max_in_flight)
+        self._pending: Deque[Tuple[int, Callable[..., List[str]], tuple]] = deque()
+        self._in_flight: Deque[Tuple[int, Future]] = deque()
+        self._plan_errors = {}
+
+        for doc_index, (path, ext) in enumerate(documents):
+            try:
+                for fn, args in plan_tasks(path, ext):
+                    self._pending.append((doc_index, fn, args))
+            except Exception as e:
+                self._plan_errors[doc_index] = e
+        self._fill()
+
+    def _fill(self):
+        """Submit pending tasks until the in-flight window is full."""
+        if self.pool is None:
+            return
+        while self._pending and len(self._in_flight) < self.max_in_flight:
+            doc_index, fn, args = self._pending.popleft()
+            self._in_flight.append((doc_index, self.pool.submit(fn, *args)))
+
+    def _next_result(self, doc_index: int) -> Optional[List[str]]:
+        """Return the next task result for a document, or None when done."""
+        if self._in_flight and self._in_flight[0][0] == doc_index:
+            _, future = self._in_flight.popleft()
+            self._fill()
+            return future.result()
+        if not self._in_flight and self._pending and self._pending[0][0] == doc_index:
+            # Inline mode, or the window was drained: run the task here
+            _, fn, args = self._pending.popleft()
+            return fn(*args)
+        return None
+
+    def iter_text(self, doc_index: int) -> Iterator[str]:
+        """Yield a document's text pieces in order.
+
+        Args:
+            doc_index: Position of the document in the batch
+
+        Yields:
+            Pages, paragraphs or text blocks
+        """
+        if doc_index in self._plan_errors:
+            raise self._plan_errors[doc_index]
+
+        path, ext = self.documents[doc_index]
+        if ext not in [".pdf", ".docx", ".doc"]:
+            yield from iter_text_blocks(path)
+            return
+
+        while True:
+            pieces = self._next_result(doc_index)
+            if pieces is None:
+                return
+            yield from pieces
+
+    def discard(self, doc_index: int):
+        """Drop any unconsumed tasks of a document, e.g. after it failed."""
+        while self._in_flight and self._in_flight[0][0] == doc_index:
+            _, future = self._in_flight.popleft()
+            future.cancel()
+        while self._pending and self._pending[0][0] == doc_index:
+            self._pending.popleft()
+        self._fill()
+
@@ -0,0 +1,574 @@
+"""BM25 inverted index for custom knowledge bases."""
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from agent.kb_analyzer import ANALYZER, analyze
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Sealed postings are memory-mapped when numpy is available
+POSTINGS_MAPPABLE = np is not None
+
+# numpy parses .npy headers with ast.literal_eval, which some CPython 3.11
+# releases break when it runs in several threads at once
+_LOAD_LOCK = threading.Lock()
+
+
+def chunk_hash(text: str) -> str:
+    """Return the content address of a chunk's text."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into index terms with the KB analyzer.
+
+    Args:
+        text: Text to tokenize
+
+    Returns:
+        List of terms in document order
+    """
+    return analyze(text)
+
+
+def save_array(path: Path, array: Any):
+    """Write an ``.npy`` file atomically, leaving mappings of the old file valid."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def load_array(path: Path) -> Any:
+    """Memory-map an ``.npy`` file read-only; safe to call from any thread."""
+    with _LOAD_LOCK:
+        return np.load(path, mmap_mode="r")
+
+
+def load_arrays(path: Path) -> Dict[str, Any]:
+    """Read every array of an ``.npz`` file; safe to call from any thread."""
+    with _LOAD_LOCK, np.load(path) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def _save_bytes(path: Path, data: bytes):
+    """Write a file atomically, leaving mappings of the old file valid."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _map_bytes(path: Path) -> Any:
+    """Map a file read-only; empty files, which cannot be mapped, read as b""."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return b""
+
+
+class MappedPostings:
+    """Read-only postings of a sealed index, memory-mapped from prebuilt files.
+
+    Terms are stored sorted as one UTF-8 blob with an offsets table, so a
+    lookup binary-searches the mapped bytes instead of building a dict of
+    the whole vocabulary; only the pages of queried terms are read.
+
+    Files, all in one directory:
+
+    - ``_terms.bin``: sorted terms, UTF-8, concatenated
+    - ``_postings_index.npy``: int64 ``(n_terms + 1, 2)`` of term byte
+      offsets and postings offsets
+    - ``_postings.npy``: int32 ``(n_postings, 2)`` ``[position, tf]`` pairs
+    - ``_chunk_lengths.npy``: int32 term count per chunk
+    """
+
+    TERMS_FILENAME = "_terms.bin"
+    INDEX_FILENAME = "_postings_index.npy"
+    PAIRS_FILENAME = "_postings.npy"
+    LENGTHS_FILENAME = "_chunk_lengths.npy"
+
+    def __init__(self, directory: Path):
+        """Map the postings files of a directory.
+
+        Args:
+            directory: Directory written by :meth:`write`
+        """
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+        self._index = load_array(directory / self.INDEX_FILENAME)
+        self.pairs = load_array(directory / self.PAIRS_FILENAME)
+        self._terms = _map_bytes(directory / self.TERMS_FILENAME)
+
+    @staticmethod
+    def write(directory: Path, postings: Dict[str, List[List[int]]], chunk_lengths: List[int]):
+        """Write postings and chunk lengths as memory-mappable files.
+
+        Args:
+            directory: Destination directory
+            postings: Term to ``[position, tf]`` pairs
+            chunk_lengths: Term count per chunk
+        """
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+        terms = sorted(postings)
+        encoded = [term.encode("utf-8") for term in terms]
+        index = np.zeros((len(terms) + 1, 2), dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=index[1:, 0])
+        np.cumsum([len(postings[term]) for term in terms], out=index[1:, 1])
+        pairs = np.zeros((int(index[-1, 1]), 2), dtype=np.int32)
+        for i, term in enumerate(terms):
+            pairs[index[i, 1] : index[i + 1, 1]] = postings[term]
+
+        _save_bytes(directory / MappedPostings.TERMS_FILENAME, b"".join(encoded))
+        save_array(directory / MappedPostings.INDEX_FILENAME, index)
+        save_array(directory / MappedPostings.PAIRS_FILENAME, pairs)
+        save_array(
+            directory / MappedPostings.LENGTHS_FILENAME, np.asarray(chunk_lengths, dtype=np.int32)
+        )
+
+    def __len__(self) -> int:
+        """Return the number of terms."""
+        return len(self._index) - 1
+
+    @property
+    def offsets(self) -> Any:
+        """Start of each term's pairs in :attr:`pairs`, plus the total count."""
+        return self._index[:, 1]
+
+    def _term(self, i: int) -> bytes:
+        """Return the UTF-8 bytes of the i-th term."""
+        return self._terms[self._index[i, 0] : self._index[i + 1, 0]]
+
+    def _find(self, term: str) -> Optional[int]:
+        """Return the position of a term in the sorted vocabulary, if present."""
+        # Code point order equals UTF-8 byte order, so bytes compare like str
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self._term(lo) == key:
+            return lo
+        return None
+
+    def get(self, term: str, default: Any = None) -> Any:
+        """Return a term's ``(n, 2)`` array of ``[position, tf]`` pairs."""
+        i = self._find(term)
+        if i is None:
+            return default
+        return self.pairs[self._index[i, 1] : self._index[i + 1, 1]]
+
+    def __contains__(self, term: str) -> bool:
+        """Check whether a term has postings."""
+        return self._find(term) is not None
+
+    def __getitem__(self, term: str) -> Any:
+        """Return the postings of a term, raising KeyError if it has none."""
+        postings = self.get(term)
+        if postings is None:
+            raise KeyError(term)
+        return postings
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over terms in sorted order."""
+        for i in range(len(self)):
+            yield self._term(i).decode("utf-8")
+
+    def items(self) -> Iterator[Tuple[str, List[List[int]]]]:
+        """Iterate over terms and their postings as ``[position, tf]`` lists."""
+        for i, term in enumerate(self):
+            yield term, self.pairs[self._index[i, 1] : self._index[i + 1, 1]].tolist()
+
+
+class MappedStrings:
+    """Read-only sequence of strings memory-mapped from a blob and offsets table.
+
+    Holds a sealed index's chunk IDs in the page cache, shared by every
+    process that maps them, instead of as one Python string per chunk.
+
+    Files:
+
+    - ``_chunk_ids.bin``: UTF-8 strings, concatenated in order
+    - ``_chunk_id_offsets.npy``: int64 ``(n + 1,)`` byte offsets
+    """
+
+    BLOB_FILENAME = "_chunk_ids.bin"
+    OFFSETS_FILENAME = "_chunk_id_offsets.npy"
+
+    def __init__(self, directory: Path):
+        """Map the chunk ID files of a directory."""
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+        self._offsets = load_array(directory / self.OFFSETS_FILENAME)
+        self._blob = _map_bytes(directory / self.BLOB_FILENAME)
+
+    @staticmethod
+    def write(directory: Path, strings: List[str]):
+        """Write strings as memory-mappable files."""
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        _save_bytes(directory / MappedStrings.BLOB_FILENAME, b"".join(encoded))
+        save_array(directory / MappedStrings.OFFSETS_FILENAME, offsets)
+
+    def __len__(self) -> int:
+        """Return the number of stored strings."""
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        """Return the string at a position."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._blob[self._offsets[i] : self._offsets[i + 1]].decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the strings in order."""
+        for i in range(len(self)):
+            yield self[i]
+
+
+class MappedHashes:
+    """Read-only content hash to position map of a sealed index.
+
+    Hashes are stored sorted, so a lookup is a ``searchsorted`` over the
+    mapped array rather than a dict entry per chunk in every process.
+
+    Files:
+
+    - ``_hashes.npy``: sorted hex content hashes, ``S32``
+    - ``_hash_positions.npy``: int32 position of each hash's chunk
+    """
+
+    HASHES_FILENAME = "_hashes.npy"
+    POSITIONS_FILENAME = "_hash_positions.npy"
+
+    def __init__(self, directory: Path):
+        """Map the content hash files of a directory."""
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+        self._hashes = load_array(directory / self.HASHES_FILENAME)
+        self._positions = load_array(directory / self.POSITIONS_FILENAME)
+
+    @staticmethod
+    def write(directory: Path, content_hashes: Dict[str, int]):
+        """Write a hash to position map as memory-mappable files."""
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+        ordered = sorted(content_hashes.items())
+        save_array(
+            directory / MappedHashes.HASHES_FILENAME,
+            np.array([h.encode("ascii") for h, _ in ordered], dtype="S32"),
+        )
+        save_array(
+            directory / MappedHashes.POSITIONS_FILENAME,
+            np.array([position for _, position in ordered], dtype=np.int32),
+        )
+
+    def __len__(self) -> int:
+        """Return the number of stored hashes."""
+        return len(self._hashes)
+
+    def get(self, content_hash: str, default: Any = None) -> Any:
+        """Return the position of the chunk with a content hash."""
+        key = content_hash.encode("ascii")
+        i = int(np.searchsorted(self._hashes, key))
+        if i < len(self._hashes) and self._hashes[i] == key:
+            return int(self._positions[i])
+        return default
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        """Iterate over hashes and positions in hash order."""
+        for h, position in zip(self._hashes.tolist(), self._positions.tolist()):
+            yield h.decode("ascii"), position
+
+
+class BM25Index:
+    """Inverted index with BM25 ranking over the chunks of one knowledge base.
+
+    Chunks are addressed by an ordinal assigned in insertion order. Each term
+    maps to a postings list of ``[ordinal, term_frequency]`` pairs, so a query
+    only reads the postings of its own terms.
+
+    Chunks are content-addressed: identical text is indexed once, and every
+    further occurrence is recorded as a reference to the first one.
+
+    Sealed indexes serve postings and chunk lengths from
+    :class:`MappedPostings` files, and chunk IDs and content hashes from
+    :class:`MappedStrings` and :class:`MappedHashes`; those are read-only.
+    """
+
+    FILENAME = "_bm25_index.json"
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """Initialize an empty index.
+
+        Args:
+            k1: Term frequency saturation parameter
+            b: Document length normalization parameter
+        """
+        self.k1 = k1
+        self.b = b
+        # Term rules the postings were built with
+        self.analyzer = ANALYZER
+        self.chunk_ids: List[str] = []
+        self.chunk_lengths: List[int] = []
+        self.total_length = 0
+        self.postings: Dict[str, List[List[int]]] = {}
+        # doc_id -> [first_ordinal, count of chunks first indexed by the document]
+        self.documents: Dict[str, List[int]] = {}
+        # chunk content hash -> ordinal
+        self.content_hashes: Dict[str, int] = {}
+        # [ordinal, chunk_id] for each duplicate occurrence, in insertion order
+        self.references: List[List[Any]] = []
+
+    def __len__(self) -> int:
+        """Return the number of indexed chunks."""
+        return len(self.chunk_ids)
+
+    def has_document(self, doc_id: str) -> bool:
+        """Check whether a document's chunks are already indexed."""
+        return doc_id in self.documents
+
+    def add_chunk(self, chunk_id: str, text: str) -> int:
+        """Index a single chunk and return its ordinal."""
+        ordinal = len(self.chunk_ids)
+        terms = tokenize(text)
+        self.content_hashes[chunk_hash(text)] = ordinal
+
+        self.chunk_ids.append(chunk_id)
+        self.chunk_lengths.append(len(terms))
+        self.total_length += len(terms)
+
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, []).append([ordinal, tf])
+
+        return ordinal
+
+    @property
+    def mapped(self) -> bool:
+        """Whether postings, chunk IDs and hashes are served from memory-mapped files."""
+        return isinstance(self.postings, MappedPostings) and isinstance(
+            self.chunk_ids, MappedStrings
+        )
+
+    def write_postings(self, directory: Path) -> bool:
+        """Write postings, chunk lengths, chunk IDs and content hashes as memory-mappable files.
+
+        Args:
+            directory: Destination directory
+
+        Returns:
+            Whether the files were written; False if numpy is not installed
+        """
+        if np is None:
+            return False
+        MappedPostings.write(directory, self.postings, self.chunk_lengths)
+        MappedStrings.write(directory, list(self.chunk_ids))
+        MappedHashes.write(directory, dict(self.content_hashes.items()))
+        return True
+
+    def map_postings(self, directory: Path):
+        """Serve the files written by :meth:`write_postings` from memory maps.
+
+        Chunk IDs and hashes stay as loaded if the directory predates their
+        files.
+        """
+        self.postings = MappedPostings(directory)
+        self.chunk_lengths = load_array(directory / MappedPostings.LENGTHS_FILENAME)
+        if (directory / MappedStrings.OFFSETS_FILENAME).exists():
+            self.chunk_ids = MappedStrings(directory)
+            self.content_hashes = MappedHashes(directory)
+
+    def find_chunk(self, text: str) -> Optional[int]:
+        """Return the ordinal of an indexed chunk with identical text, if any."""
+        return self.content_hashes.get(chunk_hash(text))
+
+    def add_reference(self, ordinal: int, chunk_id: str):
+        """Record that ``chunk_id`` has the same text as chunk ``ordinal``."""
+        self.references.append([ordinal, chunk_id])
+
+    def truncate(self, n_chunks: int, n_references: Optional[int] = None):
+        """Drop every chunk with an ordinal at or above ``n_chunks``.
+
+        Used to roll back a partially indexed document.
+
+        Args:
+            n_chunks: Number of leading chunks to keep
+            n_references: Number of leading references to keep; references
+                to dropped chunks are always removed
+        """
+        if n_references is not None and n_references < len(self.references):
+            del self.references[n_references:]
+        if n_chunks >= len(self.chunk_ids):
+            return
+
+        self.total_length -= sum(self.chunk_lengths[n_chunks:])
+        del self.chunk_ids[n_chunks:]
+        del self.chunk_lengths[n_chunks:]
+
+        # New chunks are appended, so their postings sit at the tail of each list
+        for term in list(self.postings):
+            postings = self.postings[term]
+            while postings and postings[-1][0] >= n_chunks:
+                postings.pop()
+            if not postings:
+                del self.postings[term]
+
+        self.documents = {
+            doc_id: span
+            for doc_id, span in self.documents.items()
+            if span[0] + span[1] <= n_chunks
+        }
+        self.content_hashes = {
+            h: ordinal for h, ordinal in self.content_hashes.items() if ordinal < n_chunks
+        }
+        self.references = [ref for ref in self.references if ref[0] < n_chunks]
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        stats: Any = None,
+        exclude: Optional[List[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Rank chunks against a query with BM25.
+
+        Args:
+            query: Search query
+            top_k: Number of results to return
+            stats: Collection statistics (``n_chunks``, ``avg_length`` and
+                per-term ``df``) to score with instead of this index's own,
+                used when the index is one segment of a larger KB
+            exclude: Positions never returned, such as tombstoned chunks
+
+        Returns:
+            List of ``(ordinal, score)`` tuples, best first
+        """
+        if len(self.chunk_ids) == 0 or top_k <= 0:
+            return []
+
+        if stats is not None:
+            n_chunks, avg_length = stats.n_chunks, stats.avg_length
+        else:
+            n_chunks = len(self.chunk_ids)
+            avg_length = self.total_length / n_chunks or 1.0
+        if isinstance(self.postings, MappedPostings):
+            return self._search_mapped(query, top_k, n_chunks, avg_length, stats, exclude)
+        scores: Dict[int, float] = {}
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+
+            df = stats.df[term] if stats is not None else len(postings)
+            idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            for ordinal, tf in postings:
+                norm = self.k1 * (
+                    1 - self.b + self.b * self.chunk_lengths[ordinal] / avg_length
+                )
+                scores[ordinal] = scores.get(ordinal, 0.0) + idf * tf * (
+                    self.k1 + 1
+                ) / (tf + norm)
+
+        for position in exclude or ():
+            scores.pop(position, None)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def _search_mapped(
+        self,
+        query: str,
+        top_k: int,
+        n_chunks: int,
+        avg_length: float,
+        stats: Any,
+        exclude: Optional[List[int]],
+    ) -> List[Tuple[int, float]]:
+        """BM25 over mapped postings, scoring each term's pairs as arrays."""
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float64)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if postings is None or not len(postings):
+                continue
+
+            df = stats.df[term] if stats is not None else len(postings)
+            idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            positions = postings[:, 0]
+            tf = postings[:, 1].astype(np.float64)
+            norm = self.k1 * (1 - self.b + self.b * self.chunk_lengths[positions] / avg_length)
+            # A term's postings hold each position once, so plain indexing adds
+            scores[positions] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if exclude:
+            scores[exclude] = 0.0
+        k = min(top_k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(position), float(scores[position])) for position in top]
+
+    def to_dict(self, postings: bool = True) -> Dict[str, Any]:
+        """Serialize the index to a JSON-compatible dict.
+
+        Args:
+            postings: Include postings, chunk lengths, chunk IDs and content
+                hashes; leave them out when they are written with
+                :meth:`write_postings`
+        """
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "analyzer": self.analyzer,
+            "total_length": self.total_length,
+            "documents": self.documents,
+            "references": self.references,
+        }
+        if postings:
+            data["chunk_ids"] = list(self.chunk_ids)
+            data["content_hashes"] = dict(self.content_hashes.items())
+            data["chunk_lengths"] = self.chunk_lengths
+            data["postings"] = self.postings
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BM25Index":
+        """Rebuild an index from :meth:`to_dict` output."""
+        index = cls(k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        # Indexes written before the analyzer used lowercase \w+ words
+        index.analyzer = data.get("analyzer", "legacy")
+        # Left out when postings are mapped; see map_postings
+        index.chunk_ids = data.get("chunk_ids", [])
+        index.chunk_lengths = data.get("chunk_lengths", [])
+        index.total_length = data.get("total_length", sum(index.chunk_lengths))
+        index.postings = data.get("postings", {})
+        index.documents = data["documents"]
+        # Indexes written before chunk deduplication have no content hashes
+        index.content_hashes = data.get("content_hashes", {})
+        index.references = data.get("references", [])
+        return index
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        """Read a single-file JSON index written before segments."""
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
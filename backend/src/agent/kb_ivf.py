@@ -0,0 +1,184 @@
+"""Inverted-file (IVF) approximate nearest-neighbour index for custom KB embeddings."""
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from agent.kb_index import load_array, load_arrays
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Rows scored per matrix product when assigning vectors to centroids
+_ASSIGN_BATCH = 65536
+
+
+def _assign(vectors: "np.ndarray", centroids: "np.ndarray") -> "np.ndarray":
+    """Return the index of the most similar centroid for every vector."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _ASSIGN_BATCH):
+        block = np.asarray(vectors[start : start + _ASSIGN_BATCH])
+        assignments[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(
+    vectors: "np.ndarray", nlist: int, iterations: int = 10, seed: int = 0
+) -> "np.ndarray":
+    """Train spherical k-means centroids on a sample of the vectors.
+
+    Args:
+        vectors: Normalized embedding matrix
+        nlist: Number of clusters (inverted lists)
+        iterations: Number of Lloyd iterations
+        seed: Random seed for sampling and initialization
+
+    Returns:
+        Normalized centroid matrix of shape ``(nlist, dim)``
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample_size = min(n, nlist * 64)
+    sample = np.asarray(vectors[np.sort(rng.choice(n, sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=nlist)
+
+        # Re-seed empty clusters from random sample points
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+class IVFIndex:
+    """Clustered embedding index that scores only the ``nprobe`` closest lists.
+
+    Chunk ordinals are stored grouped by their nearest centroid in one
+    memory-mapped array, with ``offsets[i]:offsets[i + 1]`` delimiting list
+    ``i``.
+    """
+
+    FILENAME = "_ivf.npz"
+    LISTS_FILENAME = "_ivf_lists.npy"
+
+    def __init__(
+        self,
+        centroids: "np.ndarray",
+        lists: "np.ndarray",
+        offsets: "np.ndarray",
+        nprobe: int = 8,
+    ):
+        """Wrap trained centroids and inverted lists.
+
+        Args:
+            centroids: Normalized centroid matrix
+            lists: Chunk ordinals grouped by list
+            offsets: List boundaries into ``lists``
+            nprobe: Number of lists scored per query
+        """
+        self.centroids = centroids
+        self.lists = lists
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, vectors: "np.ndarray", nlist: int = 0) -> "IVFIndex":
+        """Train centroids and group every vector into its nearest list.
+
+        Args:
+            vectors: Normalized embedding matrix of one segment
+            nlist: Number of lists; 0 picks roughly ``4 * sqrt(n)``
+
+        Returns:
+            The IVF index covering every row of ``vectors``
+        """
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+
+        n = len(vectors)
+        nlist = nlist or max(1, int(4 * np.sqrt(n)))
+        centroids = train_centroids(vectors, min(nlist, n))
+        assignments = _assign(vectors, centroids)
+
+        lists = np.argsort(assignments, kind="stable").astype(np.int32)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=len(centroids)), out=offsets[1:])
+        return cls(centroids, lists, offsets)
+
+    def search(
+        self,
+        vectors: "np.ndarray",
+        query_vector: "np.ndarray",
+        top_k: int = 5,
+        exclude: Optional[List[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Rank chunks in the lists closest to the query.
+
+        Args:
+            vectors: Normalized embedding matrix the lists refer to
+            query_vector: Normalized query embedding
+            top_k: Number of results to return
+            exclude: Rows never returned, such as tombstoned chunks
+
+        Returns:
+            List of ``(ordinal, score)`` tuples, best first
+        """
+        if len(self.lists) == 0 or top_k <= 0:
+            return []
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        probed = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+        candidates = np.concatenate(
+            [self.lists[self.offsets[i] : self.offsets[i + 1]] for i in probed]
+        )
+        if exclude:
+            candidates = candidates[~np.isin(candidates, exclude)]
+        if len(candidates) == 0:
+            return []
+
+        # Sorted gathers keep reads on the memory-mapped matrix sequential
+        candidates.sort()
+        scores = vectors[candidates] @ query_vector
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+    def save(self, kb_dir: Path):
+        """Write centroids and inverted lists into a KB directory.
+
+        Both files are written to temporary paths and renamed into place
+        back to back once both are complete, so neither is ever read half
+        written and a failed write leaves the previous pair in place.
+        """
+        lists_path = kb_dir / self.LISTS_FILENAME
+        lists_tmp = lists_path.with_name(lists_path.name + ".tmp")
+        with open(lists_tmp, "wb") as f:
+            np.save(f, self.lists)
+        path = kb_dir / self.FILENAME
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, offsets=self.offsets)
+
+        os.replace(lists_tmp, lists_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, kb_dir: Path, nprobe: int = 8) -> "IVFIndex":
+        """Load an index, memory-mapping its inverted lists."""
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+
+        arrays = load_arrays(kb_dir / cls.FILENAME)
+        lists = load_array(kb_dir / cls.LISTS_FILENAME)
+        return cls(arrays["centroids"], lists, arrays["offsets"], nprobe=nprobe)
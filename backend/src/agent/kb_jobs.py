@@ -0,0 +1,265 @@
+"""Background ingestion jobs for custom knowledge base uploads."""
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from agent.kb_manager import KnowledgeBaseManager, kb_manager
+
+
+class IngestionJob:
+    """Progress of one upload being ingested into a knowledge base."""
+
+    def __init__(
+        self,
+        kb_id: str,
+        spooled: List[Dict[str, Any]],
+        errors: List[Dict[str, Any]],
+        replaces: Optional[str] = None,
+    ):
+        """Create a queued job.
+
+        Args:
+            kb_id: Target knowledge base
+            spooled: Spooled documents to ingest
+            errors: Files that already failed while spooling
+            replaces: Document deleted once the upload is ingested
+        """
+        self.id = uuid.uuid4().hex
+        self.kb_id = kb_id
+        self.spooled = spooled
+        self.replaces = replaces
+        self.status = "queued"
+        self.created_at = datetime.utcnow().isoformat()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.files: List[Dict[str, Any]] = [
+            {"filename": doc["filename"], "bytes": doc["size"], "status": "queued"}
+            for doc in spooled
+        ] + list(errors)
+
+    def update_file(self, doc_index: int, status: Dict[str, Any]):
+        """Merge a per-document status update reported by the KB manager."""
+        self.files[doc_index].update(status)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Summarize the job, including throughput so far."""
+        done = [f for f in self.files if f["status"] in ("success", "skipped", "error")]
+        succeeded = [f for f in done if f["status"] == "success"]
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        processed_bytes = sum(f.get("bytes", 0) for f in done)
+        chunks = sum(f.get("chunks", 0) for f in succeeded)
+
+        return {
+            "job_id": self.id,
+            "kb_id": self.kb_id,
+            "replaces": self.replaces,
+            "status": self.status,
+            "created_at": self.created_at,
+            "error": self.error,
+            "files_total": len(self.files),
+            "files_done": len(done),
+            "files_failed": sum(1 for f in done if f["status"] == "error"),
+            "chunks": chunks,
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput": {
+                "files_per_sec": round(len(done) / elapsed, 3) if elapsed else 0.0,
+                "mb_per_sec": round(processed_bytes / 1e6 / elapsed, 3) if elapsed else 0.0,
+                "chunks_per_sec": round(chunks / elapsed, 3) if elapsed else 0.0,
+            },
+            "files": self.files,
+        }
+
+
+class IngestionJobQueue:
+    """Bounded queue of ingestion jobs processed by a background thread.
+
+    A single worker keeps writes to each KB serialized; extraction inside a
+    job is already parallel. Finished documents are published periodically,
+    so a KB becomes queryable while the rest of its upload is still running.
+
+    Every change to a job is saved as JSON under the storage directory, so
+    any worker process sharing it can report a job another one runs. A job
+    whose process exits before it finishes keeps its last saved state.
+    """
+
+    def __init__(
+        self,
+        manager: KnowledgeBaseManager,
+        max_queued: int = 16,
+        publish_interval: float = 2.0,
+        max_finished: int = 1000,
+        jobs_dir: Optional[Path] = None,
+    ):
+        """Initialize the queue; the worker starts on first submit.
+
+        Args:
+            manager: KB manager that performs ingestion
+            max_queued: Maximum number of jobs waiting to run
+            publish_interval: Seconds between incremental index publishes
+            max_finished: Number of finished jobs kept for status polling
+            jobs_dir: Directory job states are saved in; defaults to
+                ``_jobs`` in the manager's storage directory
+        """
+        self.manager = manager
+        self.publish_interval = publish_interval
+        self.max_finished = max_finished
+        self.jobs_dir = jobs_dir or manager.storage_dir / "_jobs"
+        self._queue: queue.Queue[IngestionJob] = queue.Queue(maxsize=max_queued)
+        self._jobs: OrderedDict[str, IngestionJob] = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def submit(
+        self,
+        kb_id: str,
+        spooled: List[Dict[str, Any]],
+        errors: List[Dict[str, Any]],
+        replaces: Optional[str] = None,
+    ) -> IngestionJob:
+        """Enqueue spooled documents for ingestion.
+
+        Args:
+            kb_id: Target knowledge base
+            spooled: Documents returned by ``KnowledgeBaseManager.spool_uploads``
+            errors: Spooling errors to report alongside the job's files
+            replaces: Document to delete once the upload is ingested
+
+        Returns:
+            The queued job
+
+        Raises:
+            queue.Full: If the queue is at capacity
+        """
+        job = IngestionJob(kb_id, spooled, errors, replaces=replaces)
+        with self._lock:
+            self._jobs[job.id] = job
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                del self._jobs[job.id]
+                raise
+            self._ensure_worker()
+        self._save(job)
+        return job
+
+    def get(self, job_id: str) -> IngestionJob:
+        """Look up a job by ID.
+
+        Raises:
+            ValueError: If the job is unknown or has been pruned
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"Ingestion job '{job_id}' not found")
+        return job
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        """Report a job's progress, including jobs other worker processes run.
+
+        Raises:
+            ValueError: If no worker knows the job or it has been pruned
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        # Job IDs come from request paths; only ever read files we named
+        if re.fullmatch(r"[0-9a-f]{32}", job_id):
+            try:
+                with open(self.jobs_dir / f"{job_id}.json", encoding="utf-8") as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                pass
+        raise ValueError(f"Ingestion job '{job_id}' not found")
+
+    def _save(self, job: IngestionJob):
+        """Save a job's state where every worker process can read it."""
+        path = self.jobs_dir / f"{job.id}.json"
+        tmp_path = path.with_name(path.name + ".tmp")
+        try:
+            self.jobs_dir.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(job.to_dict(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not save ingestion job {job.id}: {e}")
+
+    def _ensure_worker(self):
+        """Start the worker thread if it is not running. Caller holds the lock."""
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(
+                target=self._run, name="kb-ingestion", daemon=True
+            )
+            self._worker.start()
+
+    def _run(self):
+        """Process queued jobs forever."""
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            finally:
+                self._queue.task_done()
+                self._prune()
+
+    def _process(self, job: IngestionJob):
+        """Run one job, recording its progress and outcome."""
+
+        def report(doc_index: int, status: Dict[str, Any]):
+            job.update_file(doc_index, status)
+            self._save(job)
+
+        job.status = "running"
+        job.started_at = time.monotonic()
+        self._save(job)
+        try:
+            self.manager.ingest_spooled(
+                job.kb_id,
+                job.spooled,
+                on_progress=report,
+                publish_interval=self.publish_interval,
+                replaces=job.replaces,
+            )
+            job.status = "completed"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            for doc in job.spooled:
+                doc["path"].unlink(missing_ok=True)
+        finally:
+            job.finished_at = time.monotonic()
+            self._save(job)
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond ``max_finished``."""
+        with self._lock:
+            finished = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job.status in ("completed", "failed")
+            ]
+            for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job_id]
+                (self.jobs_dir / f"{job_id}.json").unlink(missing_ok=True)
+
+    def join(self):
+        """Block until every queued job has been processed."""
+        self._queue.join()
+
+
+# Global instance
+ingestion_jobs = IngestionJobQueue(
+    kb_manager, max_queued=kb_manager.config.kb_ingest_queue_size
+)
@@ -0,0 +1,176 @@
+"""Locks coordinating KB writers and queries across worker processes."""
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock (Windows), locks only coordinate threads of one process
+    fcntl = None
+
+
+class WriterLock:
+    """Reentrant writer lock shared by every process using a storage directory.
+
+    Threads of one process are serialized by an RLock. The first thread to
+    enter also takes an exclusive ``flock`` on the lock file, which is
+    released when the last thread leaves, so writers in other processes wait
+    in between. :meth:`hold` keeps the file lock across several critical
+    sections, for writes whose state outlives one of them.
+    """
+
+    def __init__(self, path: Path, on_acquire: Callable[[], None]):
+        """Initialize the lock; the lock file is created on first use.
+
+        Args:
+            path: Lock file, shared by every process
+            on_acquire: Called whenever this process takes the file lock,
+                to reload state other processes may have written
+        """
+        self.path = path
+        self._on_acquire = on_acquire
+        self._lock = threading.RLock()
+        # Critical sections entered plus holds taken; only changed under _lock
+        self._depth = 0
+        self._file: Optional[BinaryIO] = None
+
+    def __enter__(self) -> "WriterLock":
+        """Acquire the lock, waiting for writers in other processes."""
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                self._lock_file()
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        """Release the lock, and the file lock once nothing holds it."""
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._lock.release()
+
+    def _lock_file(self):
+        """Take the file lock and let the owner reload shared state."""
+        if fcntl is not None:
+            if self._file is None:
+                self._file = open(self.path, "a+b")
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            self._on_acquire()
+        except BaseException:
+            if self._file is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            raise
+
+    @contextmanager
+    def hold(self) -> Iterator[None]:
+        """Keep other processes' writers out until the block exits.
+
+        Threads of this process still take turns between the block's own
+        critical sections.
+        """
+        with self:
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self:
+                self._depth -= 1
+
+
+class PinFiles:
+    """Shared ``flock`` locks telling other processes which versions are read.
+
+    A process holds a shared lock on ``<kb_dir>/_pins/<version>`` while any
+    of its queries pins that version. Writers take an exclusive lock without
+    waiting to learn whether a version is still read anywhere.
+    """
+
+    DIRNAME = "_pins"
+
+    def __init__(self, storage_dir: Path):
+        """Initialize pin locks for KBs under a storage directory."""
+        self.storage_dir = storage_dir
+        # (kb_id, version) -> open lock file of a version this process pins
+        self._files: Dict[Tuple[str, int], BinaryIO] = {}
+
+    def lock(self, kb_id: str, version: int) -> bool:
+        """Take the shared lock of a version. Caller serializes calls.
+
+        Returns:
+            False if the KB's directory is gone
+        """
+        if fcntl is None:
+            return True
+        pins_dir = self.storage_dir / kb_id / self.DIRNAME
+        path = pins_dir / str(version)
+        while True:
+            try:
+                file = open(path, "a+b")
+            except FileNotFoundError:
+                try:
+                    pins_dir.mkdir()
+                except FileNotFoundError:
+                    return False
+                except FileExistsError:
+                    pass
+                continue
+            fcntl.flock(file.fileno(), fcntl.LOCK_SH)
+            # A writer may have removed the file between open and flock
+            try:
+                if os.stat(path).st_ino == os.fstat(file.fileno()).st_ino:
+                    self._files[(kb_id, version)] = file
+                    return True
+            except FileNotFoundError:
+                pass
+            file.close()
+
+    def unlock(self, kb_id: str, version: int):
+        """Release the shared lock of a version. Caller serializes calls."""
+        file = self._files.pop((kb_id, version), None)
+        if file is not None:
+            file.close()
+
+    def oldest(self, kb_id: str, below: int) -> Optional[int]:
+        """Return the oldest version before ``below`` any process pins.
+
+        Lock files of versions nobody pins are removed on the way.
+
+        Args:
+            kb_id: Knowledge base identifier
+            below: Only versions older than this are checked
+
+        Returns:
+            The oldest pinned version, or None
+        """
+        if fcntl is None:
+            return None
+        pins_dir = self.storage_dir / kb_id / self.DIRNAME
+        try:
+            versions = sorted(int(path.name) for path in pins_dir.iterdir() if path.name.isdigit())
+        except FileNotFoundError:
+            return None
+        for version in versions:
+            if version >= below:
+                break
+            if (kb_id, version) in self._files:
+                return version
+            path = pins_dir / str(version)
+            try:
+                file = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            with file:
+                try:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return version
+                path.unlink(missing_ok=True)
+        return None
@@ -1,62 +1,474 @@
 """Knowledge Base Management for custom document uploads."""
-import os
-import json
 import hashlib
-from pathlib import Path
-from typing import List, Dict, Any
+import heapq
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
-import re
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-# For document processing
-try:
-    from PyPDF2 import PdfReader
-except ImportError:
-    PdfReader = None
+from agent.configuration import Configuration
+from agent.kb_analyzer import ANALYZER, normalize
+from agent.kb_archive import read_archive, write_archive
+from agent.kb_cache import KBCache, QueryCache
+from agent.kb_chunker import TokenChunker, get_token_counter
+from agent.kb_chunks import ChunkStore, ChunkStoreWriter, train_dictionary
+from agent.kb_compact import BackgroundCompactor
+from agent.kb_embeddings import EmbeddingCache, OllamaEmbedder, VectorStore
+from agent.kb_extract import ExtractionPipeline, create_extraction_pool
+from agent.kb_index import POSTINGS_MAPPABLE, BM25Index, np
+from agent.kb_ivf import IVFIndex
+from agent.kb_locks import PinFiles, WriterLock
+from agent.kb_segments import Segment, SegmentedIndex, search_segments
+from agent.kb_sqlite import SqliteKnowledgeBase
+from agent.kb_tfidf import TfidfMatrix
 
-try:
-    from docx import Document as DocxDocument
-except ImportError:
-    DocxDocument = None
+# Block size used when spooling uploads to disk and reading text files
+SPOOL_BLOCK_SIZE = 1024 * 1024
 
+# Length prefix of each chunk in a staged document file
+_STAGED_LENGTH = struct.Struct("<I")
 
-class KnowledgeBaseManager:
-    """Manages custom knowledge bases with document upload and indexing."""
+# Extensions whose extraction is CPU-bound and runs in the process pool
+PARALLEL_EXTENSIONS = {".pdf", ".docx", ".doc"}
+
+# Ranking engines a custom KB can be created with
+SCORING_MODES = ("bm25", "tfidf", "vector", "ivf", "hybrid")
+
+# Scoring modes backed by chunk embeddings
+VECTOR_MODES = ("vector", "ivf", "hybrid")
+
+# Search engines a query can run on
+SEARCH_ENGINES = ("lexical", "vector")
+
+# Storage backends a custom KB can be created with
+STORAGE_BACKENDS = ("native", "sqlite")
+
+# On-disk chunk format of KBs whose documents are stored as ChunkStore files
+CHUNK_FORMAT = "binary"
+
+# Trained zstd dictionary shared by a KB's chunk stores
+DICTIONARY_FILENAME = "_chunks.zdict"
+
+# Chunks sampled from a KB to train its compression dictionary
+DICTIONARY_SAMPLE_CHUNKS = 2000
+
+# File types picked up from source directories unless others are given
+SOURCE_EXTENSIONS = (".txt", ".md", ".rst", ".pdf", ".docx")
+
+
+def iter_source_files(root: Path, extensions: Tuple[str, ...] = SOURCE_EXTENSIONS) -> Iterator[Path]:
+    """Yield files under ``root`` with one of ``extensions``, in sorted order.
+
+    Hidden files and directories are skipped.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for filename in sorted(filenames):
+            if not filename.startswith(".") and Path(filename).suffix.lower() in extensions:
+                yield Path(dirpath) / filename
+
+
+def file_source(path: Path, rel_path: str) -> Dict[str, Any]:
+    """Describe a source file for change detection: relative path, size and mtime."""
+    stat = path.stat()
+    return {"path": rel_path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class LoadedSegment:
+    """Search structures of one immutable segment.
 
-    def __init__(self, storage_dir: str = "./knowledge_bases"):
+    Chunk text is not held in memory; results read it from the chunk store.
+    """
+
+    def __init__(
+        self,
+        segment: Segment,
+        tfidf: Optional[TfidfMatrix] = None,
+        vectors: Any = None,
+        ivf: Optional[IVFIndex] = None,
+    ):
+        """Bundle a segment with its loaded data.
+
+        Args:
+            segment: The segment's index and ordinals
+            tfidf: TF-IDF matrix, replaces BM25 for lexical search when given
+            vectors: Memory-mapped embeddings by local position
+            ivf: Clustered index over ``vectors``, replaces brute force when given
+        """
+        self.segment = segment
+        self.tfidf = tfidf
+        self.vectors = vectors
+        self.ivf = ivf
+
+    def vector_search(
+        self, query_vector: Any, top_k: int, exclude: Optional[List[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """Rank the segment's chunks by embedding similarity, by ordinal.
+
+        Args:
+            query_vector: Normalized query embedding
+            top_k: Number of results to return
+            exclude: Local positions never returned
+        """
+        if self.ivf is not None:
+            ranked = self.ivf.search(self.vectors, query_vector, top_k=top_k, exclude=exclude)
+        else:
+            ranked = VectorStore.search(self.vectors, query_vector, top_k=top_k, exclude=exclude)
+        return [(int(self.segment.ordinals[position]), score) for position, score in ranked]
+
+    def estimate_size(self) -> int:
+        """Roughly estimate the resident memory of this segment in bytes."""
+        index = self.segment.index
+        # Mapped tables live in the page cache, shared across processes
+        if self.segment.mapped:
+            return 100 * len(index.documents) + (self.tfidf.nbytes if self.tfidf is not None else 0)
+        posting_count = sum(len(p) for p in index.postings.values())
+        matrix_bytes = self.tfidf.nbytes if self.tfidf is not None else 0
+        # Per-object overheads of dicts, lists and small ints dominate
+        return 200 * len(self.segment) + 120 * posting_count + matrix_bytes
+
+
+class LoadedKnowledgeBase:
+    """Loaded segments and tombstones of one KB version held in memory.
+
+    Searches fan out over the segments and merge their top-k by ordinal.
+    """
+
+    def __init__(
+        self,
+        index: SegmentedIndex,
+        segments: List[LoadedSegment],
+        scoring_mode: str = "bm25",
+    ):
+        """Bundle the loaded segments of a KB.
+
+        Args:
+            index: Segment list and delete bookkeeping of this version
+            segments: Loaded data of every segment, in the same order
+            scoring_mode: Scoring mode the KB was created with
+        """
+        self.index = index
+        self.segments = segments
+        self.scoring_mode = scoring_mode
+        self._by_name = {loaded.segment.name: loaded for loaded in segments}
+        # Tombstoned positions per segment, masked inside the scorers so a
+        # segment's top-k never spends slots on deleted chunks
+        self.excluded = {
+            loaded.segment.name: index.deleted_positions(loaded.segment) for loaded in segments
+        }
+
+    @property
+    def n_chunks(self) -> int:
+        """Return the number of live chunks."""
+        return self.index.live_count
+
+    def lexical_search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """Rank chunk ordinals by keyword relevance."""
+        if self.scoring_mode != "tfidf":
+            return search_segments(
+                [s.segment for s in self.segments], query, top_k, exclude=self.excluded
+            )
+
+        # Each segment's matrix carries its own IDF, so merged scores are
+        # approximate until small segments are merged into large ones
+        ranked = [
+            (int(loaded.segment.ordinals[position]), score)
+            for loaded in self.segments
+            if loaded.tfidf is not None
+            for position, score in loaded.tfidf.search(
+                query, top_k=top_k, exclude=self.excluded[loaded.segment.name]
+            )
+        ]
+        return heapq.nlargest(top_k, ranked, key=lambda item: item[1])
+
+    def vector_search(self, query_vector: Any, top_k: int) -> List[Tuple[int, float]]:
+        """Rank chunk ordinals by embedding similarity."""
+        if self.scoring_mode not in VECTOR_MODES:
+            raise ValueError("Knowledge base has no embeddings")
+        for loaded in self.segments:
+            if loaded.vectors is not None and loaded.vectors.shape[1] != len(query_vector):
+                raise ValueError(
+                    f"Knowledge base embeddings have {loaded.vectors.shape[1]} dimensions, "
+                    f"but the query embedding has {len(query_vector)}"
+                )
+
+        ranked = [
+            hit
+            for loaded in self.segments
+            if loaded.vectors is not None
+            for hit in loaded.vector_search(
+                query_vector, top_k, exclude=self.excluded[loaded.segment.name]
+            )
+        ]
+        return heapq.nlargest(top_k, ranked, key=lambda item: item[1])
+
+    def estimate_size(self) -> int:
+        """Roughly estimate the resident memory of this KB in bytes."""
+        return sum(loaded.estimate_size() for loaded in self.segments)
+
+
+class KBSnapshot:
+    """A published version of a KB, pinned while a query reads it.
+
+    Files that later publishes retire are kept until no query pins an older
+    version, so search and result formatting read the same files however
+    many uploads and merges publish meanwhile. Isolation is partial: an
+    index not cached for the pinned version is loaded from disk, which may
+    already hold a newer version, and deleting a KB removes its files at
+    once, so queries still reading it fail.
+    """
+
+    def __init__(
+        self,
+        kb_id: str,
+        metadata: Dict[str, Any],
+        load: Callable[[], Optional[LoadedKnowledgeBase]],
+    ):
+        """Wrap a published metadata snapshot.
+
+        Args:
+            kb_id: Knowledge base identifier
+            metadata: The KB's published metadata; never mutated
+            load: Loads the KB's index, or returns None for SQLite KBs
+        """
+        self.kb_id = kb_id
+        self.metadata = metadata
+        self.version: int = metadata.get("version", 0)
+        self._load = load
+        self._loaded: Optional[LoadedKnowledgeBase] = None
+
+    @property
+    def loaded(self) -> Optional[LoadedKnowledgeBase]:
+        """The KB's loaded index, read on first use and then kept."""
+        if self._loaded is None:
+            self._loaded = self._load()
+        return self._loaded
+
+
+class KnowledgeBaseManager:
+    """Manages custom knowledge bases with document upload and indexing.
+
+    Writers mutate :attr:`index` under the writer lock and publish it with
+    :meth:`_save_index`, which swaps in a fresh copy for readers. Queries
+    only read published copies and pin the version they read with
+    :meth:`pin`, so they never wait on the writer lock.
+
+    Several worker processes may share a storage directory: :attr:`published`
+    is re-read whenever ``index.json`` is replaced, so queries in every
+    process see the latest publish, and KB files are memory-mapped, so
+    processes share their pages. The writer lock is also a file lock, so
+    writers in different processes take turns, each reloading
+    :attr:`index` when it takes over. An upload keeps other processes'
+    writers out until it finishes. Files a publish retires are deleted only
+    once no process pins an older version.
+    """
+
+    def __init__(
+        self,
+        storage_dir: str = "./knowledge_bases",
+        config: Optional[Configuration] = None,
+        storage_backend: Optional[str] = None,
+    ):
         """Initialize KB manager with storage directory.
 
         Args:
             storage_dir: Directory to store knowledge bases
+            config: Agent configuration; read from the environment if omitted
+            storage_backend: Backend for new KBs - "native" or "sqlite";
+                defaults to ``config.kb_storage_backend``. Existing KBs keep
+                the backend they were created with.
         """
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
         self.index_file = self.storage_dir / "index.json"
+        self.config = config or Configuration.from_runnable_config()
+        self.storage_backend = storage_backend or self.config.kb_storage_backend
+        if self.storage_backend not in STORAGE_BACKENDS:
+            raise ValueError(
+                f"Unknown storage backend '{self.storage_backend}'. "
+                f"Expected one of {STORAGE_BACKENDS}"
+            )
 
-        # Load or create index
-        self.index = self._load_index()
+        # KB metadata from index.json, read on first use so construction
+        # does no I/O beyond creating the storage directory
+        self._index: Optional[Dict[str, Any]] = None
+        # Copy of every KB's metadata as last published; replaced, never mutated
+        self._published: Optional[Dict[str, Dict[str, Any]]] = None
+        # Identity of the index.json _published was read from or written as
+        self._index_stamp: Optional[Tuple[int, int, int]] = None
+        # Identity of the index.json _index was read from or written as
+        self._writer_stamp: Optional[Tuple[int, int, int]] = None
+
+        # Process-wide cache of loaded KBs, keyed by KB ID and version
+        self._kb_cache = KBCache(self.config.kb_cache_max_mb * 1024 * 1024)
+        # Ranked results keyed by KB ID, query, top_k, engine and KB version
+        self._query_cache = QueryCache(
+            self.config.kb_query_cache_size, self.config.kb_query_cache_ttl_seconds
+        )
+        self._embedder: Optional[OllamaEmbedder] = None
+        self._extract_pool = None
+        self._extract_workers = self.config.kb_extract_workers or os.cpu_count() or 1
+
+        # Serializes index writes across threads and processes; held per
+        # document, never for a whole upload
+        self._write_lock = WriterLock(self.storage_dir / "_write.lock", self._reload_index)
+        # kb_id -> (index, unsaved embedding blocks) of uploads in progress
+        self._open_writes: Dict[str, Tuple[SegmentedIndex, List[Any]]] = {}
+        self._compactor: Optional[BackgroundCompactor] = None
+        # kb_id -> serialized zstd dictionary of the KB's chunk stores
+        self._dictionaries: Dict[str, bytes] = {}
+        # kb_id -> open database of KBs on the SQLite backend
+        self._sqlite_kbs: Dict[str, SqliteKnowledgeBase] = {}
+        # Guards opening databases; queries must not wait on the writer lock
+        self._sqlite_lock = threading.Lock()
+        self._count_tokens = get_token_counter(self.config.kb_tokenizer)
+
+        # kb_id -> number of running queries per pinned version
+        self._pins: Dict[str, Counter] = {}
+        # kb_id -> (version, path) of files replaced in that version, deleted
+        # once no query pins an older one
+        self._retired: Dict[str, List[Tuple[int, Path]]] = {}
+        self._pins_lock = threading.Lock()
+        # Tells writers in other processes which versions queries here read
+        self._pin_files = PinFiles(self.storage_dir)
+
+    @property
+    def index(self) -> Dict[str, Any]:
+        """KB metadata, loaded from ``index.json`` on first access.
+
+        Only writers holding the writer lock may use it; readers use
+        :attr:`published`.
+        """
+        if self._index is None:
+            with self._write_lock:
+                if self._index is None:
+                    self._reload_index()
+        return self._index
+
+    def _reload_index(self):
+        """Re-read ``index.json`` if another process replaced it since it was last read.
+
+        Called whenever this process takes the writer lock, so writers start
+        from the latest metadata instead of overwriting other processes'
+        publishes.
+        """
+        # Stamped before reading, so a concurrent replace is picked up by
+        # the next access to published
+        stamp = self._stat_index()
+        if self._index is not None and stamp == self._writer_stamp:
+            return
+        index = self._load_index()
+        self._published = json.loads(json.dumps(index["knowledge_bases"]))
+        self._index_stamp = stamp
+        self._writer_stamp = stamp
+        self._index = index
+
+    @property
+    def published(self) -> Dict[str, Dict[str, Any]]:
+        """Every KB's metadata as of the last publish, keyed by KB ID.
+
+        Each publish replaces the whole mapping, so a reader holding it sees
+        one consistent state. Must not be mutated. If another process has
+        replaced ``index.json`` since it was last read or written here, it is
+        read again; this costs one ``stat`` per access.
+        """
+        stamp = self._stat_index()
+        if self._published is None or (stamp is not None and stamp != self._index_stamp):
+            self._published = self._load_index()["knowledge_bases"]
+            self._index_stamp = stamp
+        return self._published
+
+    def _stat_index(self) -> Optional[Tuple[int, int, int]]:
+        """Return the inode, size and mtime of ``index.json``, or None if missing.
+
+        Each save renames a new file into place, so the inode changes even
+        when two saves fall within the file system's mtime granularity.
+        """
+        try:
+            stat = self.index_file.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    @property
+    def embedder(self) -> OllamaEmbedder:
+        """Ollama embedding client, created on first use."""
+        if self._embedder is None:
+            self._embedder = OllamaEmbedder(
+                self.config.ollama_base_url,
+                self.config.embedding_model,
+                EmbeddingCache(self.storage_dir / "_embedding_cache.sqlite"),
+                batch_size=self.config.embedding_batch_size,
+            )
+        return self._embedder
 
     def _load_index(self) -> Dict[str, Any]:
         """Load knowledge base index from disk."""
         if self.index_file.exists():
-            with open(self.index_file, "r", encoding="utf-8") as f:
+            with open(self.index_file, encoding="utf-8") as f:
                 return json.load(f)
         return {"knowledge_bases": {}}
 
     def _save_index(self):
-        """Save knowledge base index to disk."""
-        with open(self.index_file, "w", encoding="utf-8") as f:
-            json.dump(self.index, f, indent=2, ensure_ascii=False)
+        """Save knowledge base index to disk and publish it to readers.
 
-    def create_knowledge_base(self, kb_id: str, name: str) -> Dict[str, Any]:
+        The file is written to a temporary path and renamed over
+        ``index.json``, so a crash never leaves it truncated. Caller holds
+        the writer lock.
+        """
+        serialized = json.dumps(self.index, indent=2, ensure_ascii=False)
+        tmp_path = self.index_file.with_name(self.index_file.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(serialized)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_file)
+        self._published = json.loads(serialized)["knowledge_bases"]
+        self._index_stamp = self._stat_index()
+        self._writer_stamp = self._index_stamp
+
+    def _get_extract_pool(self):
+        """Return the extraction process pool, or None if it cannot start."""
+        if self._extract_pool is None:
+            try:
+                self._extract_pool = create_extraction_pool(self._extract_workers)
+            except (OSError, NotImplementedError) as e:
+                print(f"⚠️ Extraction pool unavailable, extracting inline: {e}")
+                return None
+        return self._extract_pool
+
+    def create_knowledge_base(
+        self, kb_id: str, name: str, scoring_mode: str = "bm25"
+    ) -> Dict[str, Any]:
         """Create a new knowledge base.
 
         Args:
             kb_id: Unique identifier for the knowledge base
             name: Human-readable name
+            scoring_mode: Ranking engine - "bm25", "tfidf", "vector", "ivf" or
+                "hybrid" (BM25 and embeddings fused by the KB router). The
+                SQLite backend supports "bm25" only.
 
         Returns:
             Knowledge base metadata
         """
+        if scoring_mode not in SCORING_MODES:
+            raise ValueError(
+                f"Unknown scoring mode '{scoring_mode}'. Expected one of {SCORING_MODES}"
+            )
+        if self.storage_backend == "sqlite" and scoring_mode != "bm25":
+            raise ValueError("The sqlite storage backend only supports the bm25 scoring mode")
+
         kb_dir = self.storage_dir / kb_id
         kb_dir.mkdir(parents=True, exist_ok=True)
 
@@ -66,17 +478,35 @@ class KnowledgeBaseManager:
             "created_at": datetime.utcnow().isoformat(),
             "document_count": 0,
             "chunk_count": 0,
+            "version": 0,
+            "scoring_mode": scoring_mode,
+            "storage_backend": self.storage_backend,
+            "chunk_format": CHUNK_FORMAT,
             "documents": {},
         }
+        if scoring_mode in VECTOR_MODES:
+            # Vectors of different models can't be compared; see _check_embedding_model
+            kb_metadata["embedding_model"] = self.config.embedding_model
 
-        self.index["knowledge_bases"][kb_id] = kb_metadata
-        self._save_index()
+        with self._write_lock:
+            self.index["knowledge_bases"][kb_id] = kb_metadata
+            self._save_index()
+        self._sqlite_kb(kb_id)
 
         return kb_metadata
 
     def upload_documents(self, kb_id: str, files: List[Any]) -> Dict[str, Any]:
         """Upload and process documents into a knowledge base.
 
+        Each upload is spooled to disk, extracted page by page and chunked
+        through generators, and chunks are written as they are produced, so
+        peak memory depends on chunk size rather than document size. PDF and
+        DOCX extraction runs in a process pool across files and page ranges,
+        and text is reassembled in document order.
+
+        Uploads whose content hash is already in the KB are skipped without
+        extraction, and chunk text seen before is stored and indexed once.
+
         Args:
             kb_id: Knowledge base identifier
             files: List of file objects to process
@@ -84,219 +514,1530 @@ class KnowledgeBaseManager:
         Returns:
             Upload result with processing status
         """
-        if kb_id not in self.index["knowledge_bases"]:
+        if kb_id not in self.published:
             raise ValueError(f"Knowledge base '{kb_id}' not found")
 
-        kb_dir = self.storage_dir / kb_id
-        kb_metadata = self.index["knowledge_bases"][kb_id]
+        spooled, processed_docs = self.spool_uploads(files)
+        processed_docs += self.ingest_spooled(kb_id, spooled)
 
-        processed_docs = []
-        total_chunks = 0
+        return {
+            "kb_id": kb_id,
+            "processed_documents": processed_docs,
+            "total_chunks": self.published[kb_id]["chunk_count"],
+        }
+
+    def spool_uploads(
+        self, files: List[Any]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Spool uploads to disk so they can be ingested later.
 
+        Args:
+            files: List of file objects to spool
+
+        Returns:
+            Tuple of spooled documents (filename, path, doc_id, size) and
+            error entries for files that could not be read
+        """
+        spooled, errors = [], []
         for file in files:
+            filename = getattr(file, "filename", None) or "document.txt"
             try:
-                # Read file content
-                content_bytes = file.read()
-                filename = getattr(file, "filename", "document.txt")
-
-                # Generate document ID
-                doc_id = hashlib.md5(content_bytes).hexdigest()
-
-                # Process document based on type
-                ext = Path(filename).suffix.lower()
-                if ext == ".pdf":
-                    text = self._extract_pdf_text(content_bytes)
-                elif ext in [".docx", ".doc"]:
-                    text = self._extract_docx_text(content_bytes)
-                elif ext in [".txt", ".md"]:
-                    text = content_bytes.decode("utf-8", errors="ignore")
+                spool_path, doc_id = self._spool_upload(file)
+                spooled.append(
+                    {
+                        "filename": filename,
+                        "path": spool_path,
+                        "doc_id": doc_id,
+                        "size": spool_path.stat().st_size,
+                    }
+                )
+            except Exception as e:
+                errors.append({"filename": filename, "status": "error", "error": str(e)})
+        return spooled, errors
+
+    def ingest_spooled(
+        self,
+        kb_id: str,
+        spooled: List[Dict[str, Any]],
+        on_progress: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+        publish_interval: Optional[float] = None,
+        replaces: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Extract, chunk and index spooled documents, then delete the spool files.
+
+        Args:
+            kb_id: Knowledge base identifier
+            spooled: Documents returned by :meth:`spool_uploads`. A document
+                may also carry ``source`` (see :func:`file_source`), stored
+                with its metadata, and ``replaces``, a document deleted in the
+                final publish if this one is ingested without error
+            on_progress: Called with ``(doc_index, status)`` when a document
+                starts and when it finishes
+            publish_interval: If set, finished documents are made queryable
+                whenever this many seconds have passed since the last publish,
+                instead of only at the end
+            replaces: Document deleted once every spooled document has been
+                ingested without error, for replacing a document's content
+
+        Returns:
+            Per-document processing status
+        """
+        # Writers in other processes wait until the upload is published, as
+        # its index and metadata live in this process until then
+        with self._write_lock.hold():
+            kb_dir = self.storage_dir / kb_id
+            kb_metadata = self.index["knowledge_bases"][kb_id]
+
+            processed_docs = []
+            use_vectors = kb_metadata.get("scoring_mode") in VECTOR_MODES
+            if use_vectors:
+                try:
+                    self._check_embedding_model(kb_id, kb_metadata)
+                except ValueError:
+                    for doc in spooled:
+                        doc["path"].unlink(missing_ok=True)
+                    raise
+            last_publish = time.monotonic()
+
+            # Documents already in the KB (or earlier in this batch) are skipped
+            # before any extraction work is planned for them
+            with self._write_lock:
+                known_files = {
+                    doc_id: doc["filename"] for doc_id, doc in kb_metadata["documents"].items()
+                }
+            duplicate_of: Dict[int, str] = {}
+            pipeline_slots: Dict[int, int] = {}
+            for doc_index, doc in enumerate(spooled):
+                if doc["doc_id"] in known_files:
+                    duplicate_of[doc_index] = known_files[doc["doc_id"]]
                 else:
-                    text = content_bytes.decode("utf-8", errors="ignore")
-
-                # Chunk the text
-                chunks = self._chunk_text(text)
-
-                # Save chunks
-                chunks_file = kb_dir / f"{doc_id}.json"
-                chunk_data = {
-                    "document_id": doc_id,
-                    "filename": filename,
-                    "uploaded_at": datetime.utcnow().isoformat(),
-                    "chunk_count": len(chunks),
-                    "chunks": [
-                        {
-                            "id": f"{doc_id}_{i}",
-                            "content": chunk,
-                            "metadata": {
+                    known_files[doc["doc_id"]] = doc["filename"]
+                    pipeline_slots[doc_index] = len(pipeline_slots)
+
+            exts = [Path(spooled[i]["filename"]).suffix.lower() for i in pipeline_slots]
+            pool = self._get_extract_pool() if set(exts) & PARALLEL_EXTENSIONS else None
+            pipeline = ExtractionPipeline(
+                [(spooled[i]["path"], ext) for i, ext in zip(pipeline_slots, exts)],
+                pool,
+                max_in_flight=2 * self._extract_workers,
+            )
+
+            # Share the in-progress index, so document deletes that arrive
+            # between two documents of this upload land in it
+            sqlite_kb = self._sqlite_kb(kb_id)
+            with self._write_lock:
+                opened = sqlite_kb is None and kb_id not in self._open_writes
+                if opened:
+                    self._open_writes[kb_id] = (self._load_writable_segments(kb_id), [])
+                index, new_vectors = self._open_writes.get(kb_id, (None, []))
+
+            try:
+                for doc_index, doc in enumerate(spooled):
+                    filename, doc_id = doc["filename"], doc["doc_id"]
+                    if doc_index in duplicate_of:
+                        doc["path"].unlink(missing_ok=True)
+                        status = {
+                            "filename": filename,
+                            "doc_id": doc_id,
+                            "status": "skipped",
+                            "duplicate_of": duplicate_of[doc_index],
+                        }
+                        processed_docs.append(status)
+                        if on_progress is not None:
+                            on_progress(doc_index, status)
+                        continue
+
+                    slot = pipeline_slots[doc_index]
+                    if on_progress is not None:
+                        on_progress(doc_index, {"filename": filename, "status": "processing"})
+                    staged = None
+                    try:
+                        # Extraction, chunking and embedding run without the
+                        # writer lock; it is held only to add the staged chunks
+                        staged, vectors = self._stage_document(
+                            self._iter_chunks(pipeline.iter_text(slot)),
+                            embed=use_vectors and sqlite_kb is None,
+                        )
+                        with self._write_lock:
+                            chunks = self._read_staged(staged)
+                            if sqlite_kb is not None:
+                                chunk_count = sqlite_kb.add_document(
+                                    doc_id, filename, datetime.utcnow().isoformat(), chunks
+                                )
+                            else:
+                                chunk_count = self._write_document(
+                                    kb_dir,
+                                    doc_id,
+                                    filename,
+                                    chunks,
+                                    index if not index.has_document(doc_id) else None,
+                                    new_vectors if use_vectors else None,
+                                    vectors,
+                                )
+
+                            # Update metadata
+                            kb_metadata["documents"][doc_id] = {
                                 "filename": filename,
-                                "chunk_index": i,
-                                "total_chunks": len(chunks),
-                            },
+                                "uploaded_at": datetime.utcnow().isoformat(),
+                                "chunk_count": chunk_count,
+                            }
+                            if "source" in doc:
+                                kb_metadata["documents"][doc_id]["source"] = doc["source"]
+
+                        status = {
+                            "filename": filename,
+                            "doc_id": doc_id,
+                            "chunks": chunk_count,
+                            "status": "success",
                         }
-                        for i, chunk in enumerate(chunks)
-                    ],
-                }
 
-                with open(chunks_file, "w", encoding="utf-8") as f:
-                    json.dump(chunk_data, f, indent=2, ensure_ascii=False)
+                    except Exception as e:
+                        if isinstance(e, BrokenProcessPool):
+                            # A crashed worker poisons the pool; start a fresh one next time
+                            self._extract_pool = None
+                        status = {"filename": filename, "status": "error", "error": str(e)}
+                    finally:
+                        pipeline.discard(slot)
+                        doc["path"].unlink(missing_ok=True)
+                        if staged is not None:
+                            staged.unlink(missing_ok=True)
+
+                    processed_docs.append(status)
+                    if (
+                        publish_interval is not None
+                        and time.monotonic() - last_publish >= publish_interval
+                    ):
+                        with self._write_lock:
+                            self._publish(kb_id, index, new_vectors)
+                        last_publish = time.monotonic()
+                    if on_progress is not None:
+                        on_progress(doc_index, status)
+
+                with self._write_lock:
+                    # The replaced document disappears in the same publish that
+                    # makes its successor visible
+                    new_doc_ids = {doc["doc_id"] for doc in spooled}
+                    if (
+                        replaces is not None
+                        and replaces not in new_doc_ids
+                        and replaces in kb_metadata["documents"]
+                        and all(status["status"] != "error" for status in processed_docs)
+                    ):
+                        self._remove_document(kb_id, index, replaces)
+                    for doc, status in zip(spooled, processed_docs):
+                        old_doc_id = doc.get("replaces")
+                        if (
+                            old_doc_id is not None
+                            and status["status"] != "error"
+                            and old_doc_id not in new_doc_ids
+                            and old_doc_id in kb_metadata["documents"]
+                        ):
+                            self._remove_document(kb_id, index, old_doc_id)
+                    self._publish(kb_id, index, new_vectors)
+            finally:
+                if opened:
+                    with self._write_lock:
+                        self._open_writes.pop(kb_id, None)
+
+        if index is not None:
+            self._maybe_merge(kb_id, index)
+            self._maybe_train_dictionary(kb_id, index)
+        return processed_docs
+
+    def _publish(
+        self, kb_id: str, index: Optional[SegmentedIndex], new_vectors: List[Any]
+    ):
+        """Flush new chunks as a segment so queries see newly ingested documents.
 
-                # Update metadata
-                kb_metadata["documents"][doc_id] = {
-                    "filename": filename,
-                    "uploaded_at": chunk_data["uploaded_at"],
-                    "chunk_count": len(chunks),
-                }
-
-                processed_docs.append(
-                    {"filename": filename, "chunks": len(chunks), "status": "success"}
-                )
-                total_chunks += len(chunks)
+        Args:
+            kb_id: Knowledge base identifier
+            index: Segmented index including the new documents; None for KBs
+                on the SQLite backend, whose writes are already committed
+            new_vectors: Embedding blocks of the in-progress segment; cleared
+                once stored
+        """
+        kb_dir = self.storage_dir / kb_id
+        kb_metadata = self.index["knowledge_bases"][kb_id]
 
-            except Exception as e:
-                processed_docs.append(
-                    {"filename": filename, "status": "error", "error": str(e)}
+        if index is not None:
+            segment = index.flush(kb_dir)
+            if segment is not None:
+                vectors = None
+                if kb_metadata.get("scoring_mode") in VECTOR_MODES:
+                    vectors = [block for block in new_vectors if len(block)]
+                    if vectors:
+                        kb_metadata.setdefault("embedding_dim", int(vectors[0].shape[1]))
+                self._write_segment_files(
+                    kb_id, segment, vectors, kb_metadata.get("scoring_mode", "bm25")
                 )
+            new_vectors.clear()
+            index.save(kb_dir)
+            # Duplicates are stored once, so count unique live chunks
+            chunk_count = index.live_count
+        else:
+            chunk_count = self._sqlite_kb(kb_id).chunk_count()
 
         # Update KB metadata
         kb_metadata["document_count"] = len(kb_metadata["documents"])
-        kb_metadata["chunk_count"] = sum(
-            doc["chunk_count"] for doc in kb_metadata["documents"].values()
-        )
+        kb_metadata["chunk_count"] = chunk_count
+        self._bump_version(kb_id)
         self._save_index()
 
-        return {
-            "kb_id": kb_id,
-            "processed_documents": processed_docs,
-            "total_chunks": kb_metadata["chunk_count"],
-        }
+    def _write_segment_files(
+        self,
+        kb_id: str,
+        segment: Segment,
+        vectors: Optional[List[Any]],
+        scoring_mode: str,
+    ):
+        """Write the scoring-mode specific files of a new segment.
+
+        Args:
+            kb_id: Knowledge base identifier
+            segment: Saved segment
+            vectors: Embedding blocks for the segment's chunks in vector modes
+            scoring_mode: Scoring mode of the KB
+        """
+        segment_dir = self.storage_dir / kb_id / segment.name
+        if scoring_mode == "tfidf":
+            TfidfMatrix.from_bm25_index(segment.index).save(segment_dir)
+        if vectors:
+            vectors_path = segment_dir / VectorStore.FILENAME
+            VectorStore.append(vectors_path, vectors)
+            if scoring_mode == "ivf":
+                IVFIndex.build(
+                    VectorStore.load(vectors_path), nlist=self.config.kb_ivf_nlist
+                ).save(segment_dir)
+
+    def delete_document(self, kb_id: str, doc_id: str):
+        """Delete one document from a knowledge base.
+
+        The document's chunks are tombstoned and disappear from results
+        immediately; the background merger drops them from segments and
+        removes the chunk file later.
+
+        Args:
+            kb_id: Knowledge base identifier
+            doc_id: Document identifier
+        """
+        self.delete_documents(kb_id, [doc_id])
+
+    def delete_documents(self, kb_id: str, doc_ids: List[str]):
+        """Delete documents from a knowledge base in one publish.
+
+        Args:
+            kb_id: Knowledge base identifier
+            doc_ids: Document identifiers
+        """
+        with self._write_lock:
+            if kb_id not in self.index["knowledge_bases"]:
+                raise ValueError(f"Knowledge base '{kb_id}' not found")
+            documents = self.index["knowledge_bases"][kb_id]["documents"]
+            for doc_id in doc_ids:
+                if doc_id not in documents:
+                    raise ValueError(f"Document '{doc_id}' not found in '{kb_id}'")
+
+            index, new_vectors = None, []
+            if self._sqlite_kb(kb_id) is None:
+                index, new_vectors = self._open_writes.get(kb_id) or (
+                    self._load_writable_segments(kb_id),
+                    [],
+                )
+            for doc_id in doc_ids:
+                self._remove_document(kb_id, index, doc_id)
+            self._publish(kb_id, index, new_vectors)
 
-    def _extract_pdf_text(self, pdf_bytes: bytes) -> str:
-        """Extract text from PDF bytes."""
-        if PdfReader is None:
-            raise ImportError("PyPDF2 not installed. Install with: pip install PyPDF2")
+        if index is not None:
+            self._maybe_merge(kb_id, index)
 
-        from io import BytesIO
+    def _check_embedding_model(self, kb_id: str, kb_metadata: Dict[str, Any]):
+        """Reject embedding a KB's chunks or queries with a model other than its own.
 
-        pdf_file = BytesIO(pdf_bytes)
-        pdf_reader = PdfReader(pdf_file)
+        KBs created before the model was recorded are checked by vector
+        dimension only, when they are searched.
+
+        Raises:
+            ValueError: If ``embedding_model`` differs from the KB's model
+        """
+        model = kb_metadata.get("embedding_model")
+        if model is not None and model != self.config.embedding_model:
+            raise ValueError(
+                f"Knowledge base '{kb_id}' was embedded with '{model}', but the "
+                f"configured embedding model is '{self.config.embedding_model}'; "
+                f"switch back or re-create the knowledge base"
+            )
+
+    def _remove_document(
+        self, kb_id: str, index: Optional[SegmentedIndex], doc_id: str
+    ):
+        """Drop a document from the KB metadata and tombstone it in the index."""
+        del self.index["knowledge_bases"][kb_id]["documents"][doc_id]
+        if index is None:
+            self._sqlite_kb(kb_id).delete_document(doc_id)
+        elif index.has_document(doc_id):
+            index.delete_document(doc_id)
+
+    @property
+    def compactor(self) -> BackgroundCompactor:
+        """Background segment merger, started on first use."""
+        if self._compactor is None:
+            self._compactor = BackgroundCompactor(self.merge_segments)
+        return self._compactor
+
+    def _maybe_merge(self, kb_id: str, index: SegmentedIndex):
+        """Schedule a background merge if the KB's segments call for one."""
+        if index.plan_merge(self.config.kb_merge_factor, self.config.kb_compaction_ratio):
+            self.compactor.schedule(kb_id)
+
+    def merge_segments(self, kb_id: str):
+        """Merge segments of a KB until its size tiers are balanced.
+
+        Args:
+            kb_id: Knowledge base identifier
+        """
+        while True:
+            with self._write_lock:
+                if kb_id not in self.index["knowledge_bases"]:
+                    return
+                index = self._writable_index(kb_id)
+                names = index.plan_merge(
+                    self.config.kb_merge_factor, self.config.kb_compaction_ratio
+                )
+            if not names or not self._merge(kb_id, names):
+                return
+
+    def compact_knowledge_base(self, kb_id: str):
+        """Merge all of a KB's segments into one without deleted chunks.
+
+        Args:
+            kb_id: Knowledge base identifier
+        """
+        while True:
+            with self._write_lock:
+                if kb_id not in self.index["knowledge_bases"]:
+                    raise ValueError(f"Knowledge base '{kb_id}' not found")
+                sqlite_kb = self._sqlite_kb(kb_id)
+                if sqlite_kb is not None:
+                    sqlite_kb.optimize()
+                    return
+                names = [segment.name for segment in self._writable_index(kb_id).segments]
+            # Retried if a background merge replaced some segments meanwhile
+            if not names or self._merge(kb_id, names):
+                return
+
+    def _sqlite_kb(self, kb_id: str) -> Optional[SqliteKnowledgeBase]:
+        """Return the database of a KB on the SQLite backend, or None."""
+        kb_metadata = self.published.get(kb_id)
+        if kb_metadata is None:
+            # Also reached by queries that were running when the KB was deleted
+            raise ValueError(f"Knowledge base '{kb_id}' not found")
+        if kb_metadata.get("storage_backend", "native") != "sqlite":
+            return None
+        sqlite_kb = self._sqlite_kbs.get(kb_id)
+        if sqlite_kb is None:
+            with self._sqlite_lock:
+                if kb_id not in self._sqlite_kbs:
+                    self._sqlite_kbs[kb_id] = SqliteKnowledgeBase(
+                        self.storage_dir / kb_id / SqliteKnowledgeBase.FILENAME
+                    )
+                sqlite_kb = self._sqlite_kbs[kb_id]
+        return sqlite_kb
+
+    def _writable_index(self, kb_id: str) -> SegmentedIndex:
+        """Return the index an upload holds open, or load the current one."""
+        if kb_id in self._open_writes:
+            return self._open_writes[kb_id][0]
+        return self._load_writable_segments(kb_id)
+
+    def _merge(self, kb_id: str, names: List[str]) -> bool:
+        """Merge adjacent segments and swap the result in.
+
+        The merged segment and its files are built without holding the
+        writer lock; only the manifest swap is serialized with uploads and
+        deletes.
+
+        Args:
+            kb_id: Knowledge base identifier
+            names: Adjacent segments to merge
+
+        Returns:
+            Whether the merge was applied; False if the KB was deleted or a
+            concurrent merge replaced some of the segments first
+        """
+        kb_dir = self.storage_dir / kb_id
+        start = time.monotonic()
+        with self._write_lock:
+            if kb_id not in self.index["knowledge_bases"]:
+                return False
+            scoring_mode = self.index["knowledge_bases"][kb_id].get("scoring_mode", "bm25")
+            index = self._writable_index(kb_id)
+            merge = index.merge(names, index.new_segment_name())
+            # Persist the reserved name so a concurrent flush can't reuse it
+            index.save(kb_dir)
+
+        try:
+            merge.run()
+            merge.segment.save(kb_dir)
+            vectors = None
+            if scoring_mode in VECTOR_MODES:
+                vectors = [
+                    VectorStore.load(kb_dir / source.name / VectorStore.FILENAME)[positions]
+                    for source, positions in merge.selections
+                    if positions
+                ]
+            self._write_segment_files(kb_id, merge.segment, vectors, scoring_mode)
+        except FileNotFoundError:
+            with self._write_lock:
+                if kb_id not in self.index["knowledge_bases"]:
+                    # Deleted meanwhile, and its directory with it
+                    return False
+                if not self._merge_applies(kb_id, names):
+                    # A concurrent merge already retired the source segments
+                    shutil.rmtree(kb_dir / merge.segment.name, ignore_errors=True)
+                    return False
+            raise
+
+        with self._write_lock:
+            if kb_id not in self.index["knowledge_bases"]:
+                return False
+            if not self._merge_applies(kb_id, names):
+                # Another merge of some of these segments finished first;
+                # the result was never published, so nothing reads it
+                shutil.rmtree(kb_dir / merge.segment.name, ignore_errors=True)
+                return False
+            index = self._writable_index(kb_id)
+            index.replace(merge)
+            index.save(kb_dir)
+            self._bump_version(kb_id)
+            self._save_index()
+
+            # Queries pinned to earlier versions may still read these
+            live = index.live_documents()
+            self._retire(
+                kb_id,
+                [kb_dir / name for name in names]
+                + [
+                    kb_dir / f"{doc_id}{ChunkStore.SUFFIX}"
+                    for doc_id in merge.dropped_documents()
+                    if doc_id not in live
+                ],
+            )
+        self._collect(kb_id)
+
+        print(
+            f"🧹 Merged {len(names)} segments of {kb_id} into {merge.segment.name} "
+            f"({len(merge.segment)} chunks) in {time.monotonic() - start:.2f}s"
+        )
+        return True
+
+    def _merge_applies(self, kb_id: str, names: List[str]) -> bool:
+        """Check that every merged segment is still live. Caller holds the lock."""
+        return set(names) <= {segment.name for segment in self._writable_index(kb_id).segments}
+
+    def _chunk_dictionary(self, kb_id: str) -> Optional[bytes]:
+        """Return a KB's chunk compression dictionary, if it has one.
+
+        Only a found dictionary is cached: one may be trained, possibly by
+        another process, after a lookup found none.
+        """
+        dictionary = self._dictionaries.get(kb_id)
+        if dictionary is None:
+            path = self.storage_dir / kb_id / DICTIONARY_FILENAME
+            try:
+                dictionary = path.read_bytes()
+            except FileNotFoundError:
+                return None
+            self._dictionaries[kb_id] = dictionary
+        return dictionary
+
+    def _maybe_train_dictionary(self, kb_id: str, index: SegmentedIndex):
+        """Train a KB's compression dictionary once it holds enough chunks.
+
+        Documents written from then on compress their blocks with it; earlier
+        chunk stores keep their dictionary-less compression.
+
+        Args:
+            kb_id: Knowledge base identifier
+            index: The KB's current segmented index
+        """
+        if not self.config.kb_chunk_compression or self._chunk_dictionary(kb_id) is not None:
+            return
+
+        chunk_ids = [chunk_id for segment in index.segments for chunk_id in segment.index.chunk_ids]
+        step = max(1, len(chunk_ids) // DICTIONARY_SAMPLE_CHUNKS)
+        try:
+            samples = self._load_chunks(kb_id, chunk_ids[::step])
+        except FileNotFoundError:
+            # A merge removed a sampled document; try again after the next upload
+            return
+        dictionary = train_dictionary([chunk["content"] for chunk in samples])
+        if dictionary is None:
+            return
+
+        with self._write_lock:
+            path = self.storage_dir / kb_id / DICTIONARY_FILENAME
+            if kb_id not in self.index["knowledge_bases"] or path.exists():
+                return
+            tmp_path = path.with_name(path.name + ".tmp")
+            tmp_path.write_bytes(dictionary)
+            os.replace(tmp_path, path)
+            self._dictionaries[kb_id] = dictionary
+        print(f"🗜️ Trained a {len(dictionary) // 1024} KiB chunk dictionary for {kb_id}")
+
+    def sync_directory(
+        self,
+        kb_id: str,
+        root: Path,
+        extensions: Tuple[str, ...] = SOURCE_EXTENSIONS,
+    ) -> Dict[str, Any]:
+        """Bring a KB in line with a source directory.
+
+        Files are matched to documents by their path relative to ``root``.
+        A file whose size and mtime equal the recorded ones is unchanged
+        without being read; otherwise its content hash decides. Only new and
+        changed files are extracted and indexed, each changed document is
+        swapped for its new version in one publish, and documents whose
+        files are gone are deleted. Documents not added from a directory,
+        such as API uploads, are left alone. A file whose content another
+        document already holds is recorded in the KB's ``sync_duplicates``
+        with its size and mtime, and is indexed in that document's place if
+        the document's own file is removed.
+
+        Args:
+            kb_id: Knowledge base identifier
+            root: Source directory
+            extensions: Lowercase file extensions to sync
+
+        Returns:
+            Counts of added, updated, removed, unchanged and duplicate files,
+            per-file errors and elapsed seconds
+        """
+        start = time.perf_counter()
+        root = Path(root).resolve()
+        with self._write_lock:
+            if kb_id not in self.index["knowledge_bases"]:
+                raise ValueError(f"Knowledge base '{kb_id}' not found")
+            kb_metadata = self.index["knowledge_bases"][kb_id]
+            sources = {
+                doc_id: doc["source"]
+                for doc_id, doc in kb_metadata["documents"].items()
+                if "source" in doc
+            }
+            duplicates = dict(kb_metadata.get("sync_duplicates", {}))
+        synced = {source["path"]: doc_id for doc_id, source in sources.items()}
+
+        seen = set()
+        pending: List[Dict[str, Any]] = []
+        touched: Dict[str, Dict[str, Any]] = {}
+        # Unchanged duplicate files, by the document holding their content
+        unchanged_duplicates: Dict[str, List[Tuple[Path, str]]] = {}
+        errors: List[Dict[str, Any]] = []
+        unchanged = 0
+        for path in iter_source_files(root, extensions):
+            rel_path = path.relative_to(root).as_posix()
+            seen.add(rel_path)
+            source = file_source(path, rel_path)
+            doc_id = synced.get(rel_path)
+            duplicate = duplicates.get(rel_path) if doc_id is None else None
+            if doc_id is not None:
+                known = sources[doc_id]
+            else:
+                known = duplicate["source"] if duplicate is not None else None
+            if known is not None and (known["size"], known["mtime_ns"]) == (
+                source["size"],
+                source["mtime_ns"],
+            ):
+                if duplicate is not None:
+                    unchanged_duplicates.setdefault(duplicate["doc_id"], []).append(
+                        (path, source)
+                    )
+                unchanged += 1
+                continue
+
+            if doc_id is not None and self._file_hash(path) == doc_id:
+                # Touched, not modified; only remember the new mtime
+                touched[doc_id] = source
+                unchanged += 1
+                continue
+
+            pending += self._spool_source(path, source, doc_id, errors)
+
+        # Deleted first, so a renamed file is indexed again under its new name
+        removed = [doc_id for rel_path, doc_id in synced.items() if rel_path not in seen]
+        if removed:
+            self.delete_documents(kb_id, removed)
+        # A duplicate whose document was removed is indexed in its place
+        for doc_id in removed:
+            for path, source in unchanged_duplicates.get(doc_id, []):
+                unchanged -= 1
+                pending += self._spool_source(path, source, None, errors)
+        statuses = self.ingest_spooled(kb_id, pending) if pending else []
+        errors += [status for status in statuses if status["status"] == "error"]
+
+        # Files whose content another document holds are remembered with
+        # their size and mtime, so later syncs do not read them again
+        for rel_path in list(duplicates):
+            if rel_path not in seen:
+                del duplicates[rel_path]
+        for doc, status in zip(pending, statuses):
+            duplicates.pop(doc["source"]["path"], None)
+            if status["status"] == "skipped":
+                duplicates[doc["source"]["path"]] = {
+                    "doc_id": doc["doc_id"],
+                    "source": doc["source"],
+                }
+        with self._write_lock:
+            kb_metadata = self.index["knowledge_bases"].get(kb_id)
+            if kb_metadata is not None and (
+                touched or duplicates != kb_metadata.get("sync_duplicates", {})
+            ):
+                for doc_id, source in touched.items():
+                    if doc_id in kb_metadata["documents"]:
+                        kb_metadata["documents"][doc_id]["source"] = source
+                kb_metadata["sync_duplicates"] = duplicates
+                self._save_index()
+
+        outcomes = [
+            ("updated" if "replaces" in doc else "added")
+            if status["status"] == "success"
+            else status["status"]
+            for doc, status in zip(pending, statuses)
+        ]
+        result = {
+            "kb_id": kb_id,
+            "added": outcomes.count("added"),
+            "updated": outcomes.count("updated"),
+            "removed": len(removed),
+            "unchanged": unchanged,
+            # New or changed files whose content another document already holds
+            "duplicates": outcomes.count("skipped"),
+            "errors": errors,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        print(
+            f"🔄 Synced {kb_id} with {root}: {result['added']} added, "
+            f"{result['updated']} updated, {result['removed']} removed, "
+            f"{result['unchanged']} unchanged in {result['seconds']:.2f}s"
+        )
+        return result
 
-        text_parts = []
-        for page in pdf_reader.pages:
-            text_parts.append(page.extract_text())
+    def _spool_source(
+        self,
+        path: Path,
+        source: Dict[str, Any],
+        replaces: Optional[str],
+        errors: List[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """Spool a source file for :meth:`sync_directory`.
 
-        return "\n\n".join(text_parts)
+        Args:
+            path: File to read
+            source: The file's :func:`file_source` record
+            replaces: Document the file was last synced as, if any
+            errors: List spooling errors are appended to
 
-    def _extract_docx_text(self, docx_bytes: bytes) -> str:
-        """Extract text from DOCX bytes."""
-        if DocxDocument is None:
-            raise ImportError(
-                "python-docx not installed. Install with: pip install python-docx"
+        Returns:
+            The spooled document, or an empty list if spooling failed
+        """
+        with open(path, "rb") as f:
+            spooled, spool_errors = self.spool_uploads(
+                [SimpleNamespace(filename=source["path"], file=f)]
             )
+        errors += spool_errors
+        for doc in spooled:
+            doc["source"] = source
+            if replaces is not None:
+                doc["replaces"] = replaces
+        return spooled
+
+    @staticmethod
+    def _file_hash(path: Path) -> str:
+        """Return a file's document ID, the MD5 of its content."""
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(SPOOL_BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _spool_upload(self, file: Any) -> Tuple[Path, str]:
+        """Copy an upload to a temporary file in fixed-size blocks.
+
+        Args:
+            file: File object; for FastAPI uploads the underlying sync file is read
 
-        from io import BytesIO
+        Returns:
+            Tuple of the spooled file path and the document ID (MD5 of content)
+        """
+        source = getattr(file, "file", file)
+        spool_dir = self.storage_dir / "_spool"
+        spool_dir.mkdir(exist_ok=True)
+
+        digest = hashlib.md5()
+        with tempfile.NamedTemporaryFile(dir=spool_dir, delete=False) as spool:
+            while True:
+                block = source.read(SPOOL_BLOCK_SIZE)
+                if not block:
+                    break
+                if isinstance(block, str):
+                    block = block.encode("utf-8")
+                digest.update(block)
+                spool.write(block)
+
+        return Path(spool.name), digest.hexdigest()
+
+    def _stage_document(self, chunks: Iterable[str], embed: bool) -> Tuple[Path, Any]:
+        """Spill a document's chunks to a temporary file, embedding them on the way.
+
+        This is the slow part of ingesting a document and runs without the
+        writer lock. Chunk text goes to disk as it is produced, so only the
+        embeddings are held in memory.
 
-        docx_file = BytesIO(docx_bytes)
-        doc = DocxDocument(docx_file)
+        Args:
+            chunks: Chunk texts in order
+            embed: Whether to embed the chunks
 
-        text_parts = []
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                text_parts.append(paragraph.text)
+        Returns:
+            Tuple of the staging file, read back with :meth:`_read_staged`,
+            and the embedding matrix with a row per chunk, or None
+        """
+        spool_dir = self.storage_dir / "_spool"
+        spool_dir.mkdir(exist_ok=True)
+        blocks: List[Any] = []
+        batch: List[str] = []
+        with tempfile.NamedTemporaryFile(dir=spool_dir, suffix=".staged", delete=False) as f:
+            path = Path(f.name)
+            try:
+                for chunk in chunks:
+                    data = chunk.encode("utf-8")
+                    f.write(_STAGED_LENGTH.pack(len(data)))
+                    f.write(data)
+                    if embed:
+                        # Chunks already in the KB come from the embedding cache
+                        batch.append(chunk)
+                        if len(batch) >= self.config.embedding_batch_size:
+                            blocks.append(self.embedder.embed(batch))
+                            batch = []
+                if batch:
+                    blocks.append(self.embedder.embed(batch))
+            except BaseException:
+                f.close()
+                path.unlink(missing_ok=True)
+                raise
+        return path, np.concatenate(blocks) if blocks else None
+
+    @staticmethod
+    def _read_staged(path: Path) -> Iterator[str]:
+        """Yield the chunks of a file written by :meth:`_stage_document`."""
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(_STAGED_LENGTH.size)
+                if not header:
+                    return
+                (length,) = _STAGED_LENGTH.unpack(header)
+                yield f.read(length).decode("utf-8")
+
+    def _write_document(
+        self,
+        kb_dir: Path,
+        doc_id: str,
+        filename: str,
+        chunks: Iterable[str],
+        index: Optional[SegmentedIndex],
+        new_vectors: Optional[List[Any]],
+        vectors: Any = None,
+    ) -> int:
+        """Stream a document's chunks to its chunk store and the search indexes.
+
+        The chunk store is written to a temporary path and renamed once
+        complete. If anything fails, the file is discarded and the index and
+        vector additions for this document are rolled back.
+
+        A chunk whose text is already indexed is neither stored nor indexed
+        again, and its embedding is dropped: the chunk store records a
+        reference to the existing chunk ID and so does the index. Only a
+        chunk still indexed under this document's own chunk ID keeps its
+        text, since the file holding it is replaced.
 
-        return "\n\n".join(text_parts)
+        Args:
+            kb_dir: Knowledge base directory
+            doc_id: Document identifier
+            filename: Original filename
+            chunks: Chunk texts in order
+            index: Segmented index to add chunks to, or None if already indexed
+            new_vectors: List collecting embedding blocks, or None
+            vectors: Embedding matrix with a row per chunk, from
+                :meth:`_stage_document`; required with ``new_vectors``
+
+        Returns:
+            Number of chunks written
+        """
+        chunks_file = kb_dir / f"{doc_id}{ChunkStore.SUFFIX}"
+        tmp_file = kb_dir / f"{doc_id}{ChunkStore.SUFFIX}.tmp"
+        checkpoint = index.checkpoint() if index is not None else None
+        vector_blocks = len(new_vectors) if new_vectors is not None else 0
+        # Positions of the chunks that are indexed, not referenced
+        indexed: List[int] = []
+
+        writer = ChunkStoreWriter(
+            tmp_file,
+            doc_id,
+            filename,
+            datetime.utcnow().isoformat(),
+            compress=self.config.kb_chunk_compression,
+            dictionary=self._chunk_dictionary(kb_dir.name),
+        )
+        try:
+            for i, chunk in enumerate(chunks):
+                chunk_id = f"{doc_id}_{i}"
+                ordinal = index.find_chunk(chunk) if index is not None else None
+                if ordinal is None or index.chunk_id(ordinal) == chunk_id:
+                    # A deleted document uploaded again finds its own chunks
+                    # that others still reference; their only stored copy is
+                    # in the file being replaced, so the text is kept
+                    writer.add(chunk)
+                else:
+                    writer.add_reference(index.chunk_id(ordinal))
+
+                if index is None:
+                    continue
+                if ordinal is not None:
+                    index.add_reference(ordinal, chunk_id)
+                    continue
+                index.add_chunk(chunk_id, chunk)
+                indexed.append(i)
+
+            if new_vectors is not None and index is not None and indexed:
+                new_vectors.append(vectors[indexed])
+            chunk_count = len(writer)
+            writer.close()
+            # A deleted document with the same content may have left this
+            # file retired; the new one must not be collected with it
+            self._unretire(kb_dir.name, chunks_file)
+            os.replace(tmp_file, chunks_file)
+        except Exception:
+            writer.abort()
+            tmp_file.unlink(missing_ok=True)
+            if index is not None:
+                index.rollback(checkpoint)
+            if new_vectors is not None:
+                del new_vectors[vector_blocks:]
+            raise
+
+        if index is not None:
+            index.end_document(doc_id, checkpoint)
+        return chunk_count
 
     def _chunk_text(
-        self, text: str, chunk_size: int = 500, overlap: int = 50
+        self, text: str, chunk_size: Optional[int] = None, overlap: Optional[int] = None
     ) -> List[str]:
         """Chunk text into smaller segments with overlap.
 
         Args:
             text: Text to chunk
-            chunk_size: Target chunk size in words
-            overlap: Number of overlapping words between chunks
+            chunk_size: Target chunk size in tokens
+            overlap: Number of overlapping tokens between chunks
 
         Returns:
             List of text chunks
         """
-        # Split into sentences (simple approach)
-        sentences = re.split(r"[.!?]+\s+", text)
+        return list(self._iter_chunks([text], chunk_size=chunk_size, overlap=overlap))
 
-        chunks = []
-        current_chunk = []
-        current_word_count = 0
+    def _iter_chunks(
+        self,
+        text_stream: Iterable[str],
+        chunk_size: Optional[int] = None,
+        overlap: Optional[int] = None,
+    ) -> Iterator[str]:
+        """Chunk a stream of text pieces into overlapping token windows.
 
-        for sentence in sentences:
-            words = sentence.split()
-            word_count = len(words)
+        Tokens are counted with the configured ``kb_tokenizer``.
 
-            if current_word_count + word_count > chunk_size and current_chunk:
-                # Save current chunk
-                chunks.append(" ".join(current_chunk))
+        Args:
+            text_stream: Text pieces in document order
+            chunk_size: Target chunk size in tokens; defaults to
+                ``kb_chunk_tokens``
+            overlap: Number of overlapping tokens between chunks; defaults to
+                ``kb_chunk_overlap_tokens``
+
+        Yields:
+            Text chunks
+        """
+        chunker = TokenChunker(
+            chunk_size if chunk_size is not None else self.config.kb_chunk_tokens,
+            overlap if overlap is not None else self.config.kb_chunk_overlap_tokens,
+            self._count_tokens,
+        )
+        return chunker.chunks(text_stream)
 
-                # Start new chunk with overlap
-                overlap_words = min(overlap, len(current_chunk))
-                current_chunk = current_chunk[-overlap_words:] if overlap_words > 0 else []
-                current_word_count = len(current_chunk)
+    def _load_legacy_index(self, kb_id: str) -> BM25Index:
+        """Load a pre-segment KB's single BM25 index, rebuilding it if missing.
 
-            current_chunk.extend(words)
-            current_word_count += word_count
+        Args:
+            kb_id: Knowledge base identifier
 
-        # Add final chunk
-        if current_chunk:
-            chunks.append(" ".join(current_chunk))
+        Returns:
+            The knowledge base's inverted index
+        """
+        kb_dir = self.storage_dir / kb_id
+        index_path = kb_dir / BM25Index.FILENAME
+        if index_path.exists():
+            return BM25Index.load(index_path)
+
+        # Knowledge bases created before the index existed, or whose index was lost
+        bm25_index = BM25Index()
+        documents = self.index["knowledge_bases"][kb_id]["documents"]
+        for doc_id in documents:
+            chunks_file = kb_dir / f"{doc_id}{ChunkStore.SUFFIX}"
+            if not chunks_file.exists():
+                continue
+
+            first_ordinal = len(bm25_index)
+            with ChunkStore(chunks_file, self._chunk_dictionary(kb_id)) as store:
+                references = store.references()
+                for i in range(len(store)):
+                    if i in references:
+                        text = self._load_chunks(kb_id, [references[i]])[0]["content"]
+                    else:
+                        text = store.text(i)
+                    ordinal = bm25_index.find_chunk(text)
+                    if ordinal is None:
+                        bm25_index.add_chunk(f"{doc_id}_{i}", text)
+                    else:
+                        bm25_index.add_reference(ordinal, f"{doc_id}_{i}")
+            bm25_index.documents[doc_id] = [first_ordinal, len(bm25_index) - first_ordinal]
+
+        return bm25_index
+
+    def _load_segments(self, kb_id: str) -> SegmentedIndex:
+        """Load a KB's segmented index without taking the writer lock.
+
+        Segments already held by the cached copy of the KB are reused. KBs
+        stored in older formats are upgraded by
+        :meth:`upgrade_knowledge_bases` or by the next writer; until then
+        outdated segments are read as they are.
 
-        return chunks
+        Args:
+            kb_id: Knowledge base identifier
 
-    def query_knowledge_base(
-        self, kb_id: str, query: str, top_k: int = 5
-    ) -> Dict[str, Any]:
-        """Query a knowledge base using simple text matching.
+        Returns:
+            The knowledge base's segmented index
+
+        Raises:
+            ValueError: If the KB still needs an upgrade it can't be read without
+        """
+        kb_dir = self.storage_dir / kb_id
+        kb_metadata = self.published[kb_id]
+        if not SegmentedIndex.exists(kb_dir) and not kb_metadata["documents"]:
+            # Nothing was written to the KB yet
+            return SegmentedIndex()
+        if not SegmentedIndex.exists(kb_dir) or kb_metadata.get("chunk_format") != CHUNK_FORMAT:
+            raise ValueError(f"Knowledge base '{kb_id}' has not been upgraded yet")
+
+        cached = self._kb_cache.peek(kb_id)
+        loaded = {}
+        if cached is not None:
+            loaded = {s.segment.name: s.segment for s in cached.segments}
+        return SegmentedIndex.load(kb_dir, loaded=loaded)
+
+    def _load_writable_segments(self, kb_id: str) -> SegmentedIndex:
+        """Load a KB's segmented index, upgrading older formats first. Caller holds the lock.
 
         Args:
             kb_id: Knowledge base identifier
-            query: Search query
-            top_k: Number of results to return
 
         Returns:
-            Query results with chunks and sources
+            The knowledge base's segmented index in the current format
         """
-        if kb_id not in self.index["knowledge_bases"]:
-            raise ValueError(f"Knowledge base '{kb_id}' not found")
+        self._convert_chunk_files(kb_id)
+        kb_dir = self.storage_dir / kb_id
+        if not SegmentedIndex.exists(kb_dir):
+            return self._migrate_to_segments(kb_id)
+        index = self._load_segments(kb_id)
+        if any(self._segment_outdated(segment) for segment in index.segments):
+            index = self._upgrade_segments(kb_id)
+        return index
+
+    def upgrade_knowledge_bases(self):
+        """Bring every KB written by an older version to the current format.
+
+        Run at startup, before queries are served, so that queries never
+        wait on the writer lock for a conversion. Each KB is upgraded under
+        the writer lock on its own.
+        """
+        for kb_id in list(self.published):
+            with self._write_lock:
+                kb_metadata = self.index["knowledge_bases"].get(kb_id)
+                if kb_metadata is None or kb_metadata.get("storage_backend") == "sqlite":
+                    continue
+                self._load_writable_segments(kb_id)
+
+    @staticmethod
+    def _segment_outdated(segment: Segment) -> bool:
+        """Check whether a segment predates the current analyzer or mapped files."""
+        return segment.index.analyzer != ANALYZER or (POSTINGS_MAPPABLE and not segment.mapped)
+
+    def _upgrade_segments(self, kb_id: str) -> SegmentedIndex:
+        """Rewrite segments written by older versions. Caller holds the lock.
+
+        Segments built with older analyzer rules are rebuilt under a new name
+        from their chunk text, keeping ordinals, references and embeddings.
+        Segments that store postings inline are re-saved in place with
+        memory-mappable postings files.
+
+        Args:
+            kb_id: Knowledge base identifier
 
+        Returns:
+            The KB's segmented index with every segment current
+        """
         kb_dir = self.storage_dir / kb_id
+        index = SegmentedIndex.load(kb_dir)
+        for segment in index.segments:
+            if segment.index.analyzer == ANALYZER and self._segment_outdated(segment):
+                segment.save(kb_dir)
+        stale = [segment for segment in index.segments if segment.index.analyzer != ANALYZER]
+        for segment in stale:
+            rebuilt = BM25Index(k1=segment.index.k1, b=segment.index.b)
+            for chunk in self._load_chunks(kb_id, segment.index.chunk_ids):
+                rebuilt.add_chunk(chunk["id"], chunk["content"])
+            rebuilt.documents = segment.index.documents
+
+            replacement = Segment(
+                index.new_segment_name(), rebuilt, segment.ordinals, segment.references
+            )
+            replacement.save(kb_dir)
+            for filename in (VectorStore.FILENAME, IVFIndex.FILENAME, IVFIndex.LISTS_FILENAME):
+                if (kb_dir / segment.name / filename).exists():
+                    os.replace(kb_dir / segment.name / filename, kb_dir / replacement.name / filename)
+            self._write_segment_files(
+                kb_id,
+                replacement,
+                None,
+                self.index["knowledge_bases"][kb_id].get("scoring_mode", "bm25"),
+            )
+            index.swap(segment.name, replacement)
+
+        if stale:
+            index.save(kb_dir)
+            self._bump_version(kb_id)
+            self._save_index()
+            self._retire(kb_id, [kb_dir / segment.name for segment in stale])
+            print(f"🔤 Re-indexed {len(stale)} segments of {kb_id} with analyzer {ANALYZER}")
+        return index
+
+    def _convert_chunk_files(self, kb_id: str):
+        """Rewrite a KB's JSON chunk files as chunk stores. Caller holds the lock."""
+        kb_metadata = self.index["knowledge_bases"][kb_id]
+        if kb_metadata.get("chunk_format") == CHUNK_FORMAT:
+            return
 
-        # Collect all chunks
-        all_chunks = []
-        for doc_file in kb_dir.glob("*.json"):
-            with open(doc_file, "r", encoding="utf-8") as f:
+        kb_dir = self.storage_dir / kb_id
+        for json_file in kb_dir.glob("*.json"):
+            if json_file.name.startswith("_"):
+                continue
+            with open(json_file, encoding="utf-8") as f:
                 doc_data = json.load(f)
-                all_chunks.extend(doc_data["chunks"])
 
-        # Simple keyword matching (in production, use vector embeddings)
-        query_lower = query.lower()
-        query_words = set(query_lower.split())
+            doc_id = json_file.stem
+            filename = doc_data.get("filename")
+            if filename is None and doc_data["chunks"]:
+                filename = doc_data["chunks"][0]["metadata"]["filename"]
+            tmp_file = kb_dir / f"{doc_id}{ChunkStore.SUFFIX}.tmp"
+            writer = ChunkStoreWriter(
+                tmp_file,
+                doc_id,
+                filename or "",
+                doc_data.get("uploaded_at", ""),
+                compress=self.config.kb_chunk_compression,
+                dictionary=self._chunk_dictionary(kb_id),
+            )
+            for chunk in doc_data["chunks"]:
+                if "ref" in chunk:
+                    writer.add_reference(chunk["ref"])
+                else:
+                    writer.add(chunk["content"])
+            writer.close()
+            os.replace(tmp_file, kb_dir / f"{doc_id}{ChunkStore.SUFFIX}")
+            json_file.unlink()
+
+        kb_metadata["chunk_format"] = CHUNK_FORMAT
+        self._save_index()
+
+    def _migrate_to_segments(self, kb_id: str) -> SegmentedIndex:
+        """Turn a KB's single index and side files into its first segment."""
+        kb_dir = self.storage_dir / kb_id
+        kb_dir.mkdir(parents=True, exist_ok=True)
+        bm25_index = self._load_legacy_index(kb_id)
+        index = SegmentedIndex()
+        if len(bm25_index) or bm25_index.references:
+            segment = Segment(
+                index.new_segment_name(),
+                bm25_index,
+                list(range(len(bm25_index))),
+                bm25_index.references,
+            )
+            bm25_index.references = []
+            segment.save(kb_dir)
+            for filename in (VectorStore.FILENAME, IVFIndex.FILENAME, IVFIndex.LISTS_FILENAME):
+                if (kb_dir / filename).exists():
+                    os.replace(kb_dir / filename, kb_dir / segment.name / filename)
+            (kb_dir / TfidfMatrix.FILENAME).unlink(missing_ok=True)
+            index.segments.append(segment)
+            index.next_ordinal = len(segment)
+        index.save(kb_dir)
+        (kb_dir / BM25Index.FILENAME).unlink(missing_ok=True)
+        return index
+
+    def _bump_version(self, kb_id: str):
+        """Advance a KB's version stamp so cached copies are reloaded.
+
+        The stale cache entry is kept until the reload replaces it, so the
+        reload can reuse its unchanged segments.
+        """
+        kb_metadata = self.index["knowledge_bases"][kb_id]
+        kb_metadata["version"] = kb_metadata.get("version", 0) + 1
+        self._query_cache.invalidate(kb_id)
+
+    def _get_loaded_kb(self, kb_id: str, version: Optional[int] = None) -> LoadedKnowledgeBase:
+        """Return a KB's chunks and index, loading them on a cache miss.
+
+        Only segments that the cached previous version does not hold are
+        read from disk.
+
+        Args:
+            kb_id: Knowledge base identifier
+            version: Published version to return; defaults to the latest.
+                A miss loads what is on disk, which may be newer; the load
+                is cached only while ``version`` is still the latest one.
+
+        Returns:
+            The loaded knowledge base
+        """
+        if version is None:
+            version = self.published[kb_id].get("version", 0)
+        loaded = self._kb_cache.get(kb_id, version)
+        if loaded is not None:
+            return loaded
+
+        try:
+            loaded = self._load_kb(kb_id)
+        except FileNotFoundError:
+            # A merge replaced segments between reading the manifest and them
+            loaded = self._load_kb(kb_id)
+        published = self.published.get(kb_id)
+        if published is not None and published.get("version", 0) == version:
+            self._kb_cache.put(kb_id, version, loaded, loaded.estimate_size())
+        return loaded
+
+    def warm_up(self, kb_ids: Optional[List[str]] = None):
+        """Load KBs ahead of their first query.
+
+        Args:
+            kb_ids: KBs to load; defaults to ``config.kb_warm_kb_ids``.
+                Unknown IDs are skipped.
+        """
+        if kb_ids is None:
+            kb_ids = [kb_id.strip() for kb_id in self.config.kb_warm_kb_ids.split(",")]
+        for kb_id in filter(None, kb_ids):
+            if kb_id not in self.published:
+                print(f"⚠️ Skipping warm-up of unknown knowledge base '{kb_id}'")
+                continue
+            start = time.perf_counter()
+            if self._sqlite_kb(kb_id) is None:
+                self._get_loaded_kb(kb_id)
+            print(f"🔥 Warmed up {kb_id} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def _load_kb(self, kb_id: str) -> LoadedKnowledgeBase:
+        """Load every segment of a KB, reusing cached ones."""
+        scoring_mode = self.published[kb_id].get("scoring_mode", "bm25")
+        index = self._load_segments(kb_id)
+        previous = self._kb_cache.peek(kb_id)
+        segments = []
+        for segment in index.segments:
+            # Segments are immutable and tombstones are filtered at query
+            # time, so a segment loaded for an earlier version is still valid
+            reusable = previous._by_name.get(segment.name) if previous is not None else None
+            if reusable is None:
+                reusable = self._load_segment(kb_id, segment, scoring_mode)
+            segments.append(reusable)
+        return LoadedKnowledgeBase(index, segments, scoring_mode=scoring_mode)
+
+    def _load_segment(
+        self, kb_id: str, segment: Segment, scoring_mode: str
+    ) -> LoadedSegment:
+        """Load one segment's scoring-mode specific structures.
+
+        Args:
+            kb_id: Knowledge base identifier
+            segment: Segment to load
+            scoring_mode: Scoring mode of the KB
+
+        Returns:
+            The loaded segment
+        """
+        segment_dir = self.storage_dir / kb_id / segment.name
+
+        tfidf = None
+        if scoring_mode == "tfidf":
+            if not (segment_dir / TfidfMatrix.FILENAME).exists():
+                # Missing, or in the single-file format of earlier versions
+                TfidfMatrix.from_bm25_index(segment.index).save(segment_dir)
+                (segment_dir / TfidfMatrix.LEGACY_FILENAME).unlink(missing_ok=True)
+            tfidf = TfidfMatrix.load(segment_dir)
+
+        vectors = None
+        if scoring_mode in VECTOR_MODES and len(segment):
+            vectors_path = segment_dir / VectorStore.FILENAME
+            if not vectors_path.exists():
+                self._check_embedding_model(kb_id, self.published[kb_id])
+                chunks = self._load_chunks(kb_id, segment.index.chunk_ids)
+                VectorStore.append(
+                    vectors_path,
+                    [self.embedder.embed([chunk["content"] for chunk in chunks])],
+                )
+            vectors = VectorStore.load(vectors_path)
+
+        ivf = None
+        if scoring_mode == "ivf" and vectors is not None:
+            if not (segment_dir / IVFIndex.FILENAME).exists():
+                IVFIndex.build(vectors, nlist=self.config.kb_ivf_nlist).save(segment_dir)
+            ivf = IVFIndex.load(segment_dir, nprobe=self.config.kb_ivf_nprobe)
+
+        return LoadedSegment(segment, tfidf=tfidf, vectors=vectors, ivf=ivf)
+
+    def _load_chunks(self, kb_id: str, chunk_ids: List[str]) -> List[Dict[str, Any]]:
+        """Read chunks by ID, mapping each document's chunk store at most once.
+
+        Only the requested chunks' bytes are read, so results cost the same
+        no matter how large their documents are.
 
-        # Score chunks by keyword overlap
-        scored_chunks = []
-        for chunk in all_chunks:
-            content_lower = chunk["content"].lower()
-            content_words = set(content_lower.split())
+        Args:
+            kb_id: Knowledge base identifier
+            chunk_ids: Chunk IDs of the form ``<doc_id>_<chunk_index>``
+
+        Returns:
+            Chunks in the same order as ``chunk_ids``
+        """
+        kb_dir = self.storage_dir / kb_id
+        dictionary = self._chunk_dictionary(kb_id)
+        wanted: Dict[str, List[Tuple[int, int]]] = {}
+        for position, chunk_id in enumerate(chunk_ids):
+            doc_id, chunk_index = chunk_id.rsplit("_", 1)
+            wanted.setdefault(doc_id, []).append((position, int(chunk_index)))
+
+        chunks: List[Dict[str, Any]] = [{} for _ in chunk_ids]
+        for doc_id, positions in wanted.items():
+            with ChunkStore(kb_dir / f"{doc_id}{ChunkStore.SUFFIX}", dictionary) as store:
+                filename = store.metadata["filename"]
+                for position, chunk_index in positions:
+                    chunks[position] = {
+                        "id": chunk_ids[position],
+                        "content": store.text(chunk_index),
+                        "metadata": {
+                            "filename": filename,
+                            "chunk_index": chunk_index,
+                            "total_chunks": len(store),
+                        },
+                    }
+
+        return chunks
+
+    def get_scoring_mode(self, kb_id: str) -> str:
+        """Return the scoring mode a knowledge base was created with."""
+        kb_metadata = self.published.get(kb_id)
+        if kb_metadata is None:
+            raise ValueError(f"Knowledge base '{kb_id}' not found")
+        return kb_metadata.get("scoring_mode", "bm25")
+
+    @contextmanager
+    def pin(self, kb_id: str) -> Iterator[KBSnapshot]:
+        """Pin the latest published version of a KB for a query.
+
+        Pinning never waits on writers. Files the pinned version reads stay
+        on disk until the block exits, even if newer versions replace them in
+        this or another process, but not if the KB is deleted (see
+        :class:`KBSnapshot`). SQLite KBs get the same isolation from SQLite's
+        own read snapshots.
+
+        Args:
+            kb_id: Knowledge base identifier
+
+        Yields:
+            The pinned version
+        """
+        with self._pins_lock:
+            while True:
+                kb_metadata = self.published.get(kb_id)
+                if kb_metadata is None:
+                    raise ValueError(f"Knowledge base '{kb_id}' not found")
+                version = kb_metadata.get("version", 0)
+                pins = self._pins.setdefault(kb_id, Counter())
+                if pins[version] or kb_metadata.get("storage_backend") == "sqlite":
+                    break
+                # Other processes' writers see the pin from here on; a
+                # version they published before that may have been collected
+                self._pin_files.lock(kb_id, version)
+                if self.published.get(kb_id, {}).get("version", 0) == version:
+                    break
+                self._pin_files.unlock(kb_id, version)
+            pins[version] += 1
+        try:
+            yield KBSnapshot(
+                kb_id,
+                kb_metadata,
+                lambda: None
+                if self._sqlite_kb(kb_id) is not None
+                else self._get_loaded_kb(kb_id, version),
+            )
+        finally:
+            with self._pins_lock:
+                pins[version] -= 1
+                if not pins[version]:
+                    del pins[version]
+                    self._pin_files.unlock(kb_id, version)
+            self._collect(kb_id)
+
+    def _retire(self, kb_id: str, paths: List[Path]):
+        """Queue files a publish replaced for deletion. Caller holds the lock.
+
+        Args:
+            kb_id: Knowledge base identifier
+            paths: Files and directories only earlier versions read
+        """
+        version = self.published[kb_id].get("version", 0)
+        with self._pins_lock:
+            self._retired.setdefault(kb_id, []).extend((version, path) for path in paths)
+
+    def _unretire(self, kb_id: str, path: Path):
+        """Cancel the pending deletion of a file that is being written again."""
+        with self._pins_lock:
+            retired = self._retired.get(kb_id)
+            if retired:
+                self._retired[kb_id] = [entry for entry in retired if entry[1] != path]
+
+    def _collect(self, kb_id: str):
+        """Delete retired files that no version pinned in any process can read anymore."""
+        with self._pins_lock:
+            retired = self._retired.get(kb_id)
+            if not retired:
+                return
+            pinned = self._pins.get(kb_id)
+            oldest = min(pinned) if pinned else None
+            elsewhere = self._pin_files.oldest(kb_id, below=max(version for version, _ in retired))
+            if elsewhere is not None and (oldest is None or elsewhere < oldest):
+                oldest = elsewhere
+            # A file retired in version v is only read by versions before v
+            expired = [path for version, path in retired if oldest is None or oldest >= version]
+            self._retired[kb_id] = [
+                (version, path) for version, path in retired if oldest is not None and oldest < version
+            ]
+            # Files are unlinked before _unretire can see them rewritten;
+            # directories have unique names and are removed after
+            directories = [path for path in expired if path.is_dir()]
+            for path in expired:
+                if path not in directories:
+                    path.unlink(missing_ok=True)
+        for path in directories:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def search_chunks(
+        self,
+        kb_id: str,
+        query: str,
+        top_k: int = 5,
+        engine: Optional[str] = None,
+        snapshot: Optional[KBSnapshot] = None,
+    ) -> List[Tuple[int, float]]:
+        """Rank a KB's chunks against a query without loading result text.
+
+        Rankings are cached per KB version, so repeated queries skip the
+        search until the KB changes.
+
+        Args:
+            kb_id: Knowledge base identifier
+            query: Search query
+            top_k: Number of results to return
+            engine: "lexical" or "vector"; defaults to the KB's scoring mode
+            snapshot: Version to search, from :meth:`pin`; pins the latest
+                one for the duration of the search if omitted
+
+        Returns:
+            List of ``(ordinal, score)`` tuples, best first
+        """
+        if snapshot is None:
+            with self.pin(kb_id) as snapshot:
+                return self.search_chunks(kb_id, query, top_k, engine, snapshot)
+
+        scoring_mode = snapshot.metadata.get("scoring_mode", "bm25")
+        if engine is None:
+            engine = "vector" if scoring_mode in ("vector", "ivf") else "lexical"
+        if engine not in SEARCH_ENGINES:
+            raise ValueError(f"Unknown search engine '{engine}'")
+
+        key = (kb_id, " ".join(normalize(query).split()), top_k, engine, snapshot.version)
+        ranked = self._query_cache.get(key)
+        if ranked is None:
+            ranked = self._search(snapshot, query, top_k, engine)
+            self._query_cache.put(key, ranked)
+        return list(ranked)
+
+    def _search(
+        self, snapshot: KBSnapshot, query: str, top_k: int, engine: str
+    ) -> List[Tuple[int, float]]:
+        """Run an uncached search of a pinned version with a resolved engine."""
+        sqlite_kb = self._sqlite_kb(snapshot.kb_id)
+        if sqlite_kb is not None:
+            if engine != "lexical":
+                raise ValueError("Knowledge base has no embeddings")
+            return sqlite_kb.search(query, top_k=top_k)
+
+        loaded = snapshot.loaded
+        if engine == "lexical":
+            return loaded.lexical_search(query, top_k=top_k)
+
+        if not loaded.n_chunks:
+            return []
+        self._check_embedding_model(snapshot.kb_id, snapshot.metadata)
+        return loaded.vector_search(self.embedder.embed_query(query), top_k=top_k)
+
+    def query_cache_stats(self) -> Dict[str, Any]:
+        """Return the query result cache's size and hit/miss counters."""
+        return self._query_cache.stats()
+
+    def format_results(
+        self,
+        kb_id: str,
+        ranked: List[Tuple[int, float]],
+        snapshot: Optional[KBSnapshot] = None,
+    ) -> Dict[str, Any]:
+        """Turn ranked chunk ordinals into the standard results/sources shape.
 
-            # Calculate overlap score
-            overlap = len(query_words & content_words)
-            if overlap > 0:
-                scored_chunks.append((chunk, overlap))
+        Args:
+            kb_id: Knowledge base identifier
+            ranked: ``(ordinal, score)`` tuples, best first
+            snapshot: Version the ranking came from, from :meth:`pin`; pins
+                the latest one if omitted
+
+        Returns:
+            Query results with chunks and sources
+        """
+        if snapshot is None:
+            with self.pin(kb_id) as snapshot:
+                return self.format_results(kb_id, ranked, snapshot)
 
-        # Sort by score and take top_k
-        scored_chunks.sort(key=lambda x: x[1], reverse=True)
-        top_chunks = [chunk for chunk, score in scored_chunks[:top_k]]
+        chunks = self.read_chunks(kb_id, ranked, snapshot)
+        top_chunks = [chunks[ordinal] for ordinal, _ in ranked if ordinal in chunks]
 
         # Extract unique sources
         sources = []
         seen_files = set()
         for chunk in top_chunks:
-            filename = chunk["metadata"]["filename"]
-            if filename not in seen_files:
+            for filename in [chunk["metadata"]["filename"], *chunk["metadata"].get("also_in", [])]:
+                if filename in seen_files:
+                    continue
                 sources.append(
                     {
                         "id": len(sources) + 1,
@@ -312,6 +2053,83 @@ class KnowledgeBaseManager:
             "sources": sources,
         }
 
+    def read_chunks(
+        self, kb_id: str, ranked: List[Tuple[int, float]], snapshot: KBSnapshot
+    ) -> Dict[int, Dict[str, Any]]:
+        """Read ranked chunks of a pinned KB version, keyed by ordinal.
+
+        Args:
+            kb_id: Knowledge base identifier
+            ranked: ``(ordinal, score)`` tuples, best first
+            snapshot: Version the ranking came from, from :meth:`pin`
+
+        Returns:
+            Chunks by ordinal; chunks of a SQLite KB deleted since the search
+            have no entry
+        """
+        sqlite_kb = self._sqlite_kb(kb_id)
+        if sqlite_kb is not None:
+            return sqlite_kb.chunks_by_rowid([ordinal for ordinal, _ in ranked])
+        cited = self._cited_chunks(snapshot, ranked)
+        return {ordinal: chunk for (ordinal, _), chunk in zip(ranked, cited)}
+
+    def _cited_chunks(
+        self, snapshot: KBSnapshot, ranked: List[Tuple[int, float]]
+    ) -> List[Dict[str, Any]]:
+        """Read ranked chunks of a native KB, citing every live document with them.
+
+        Args:
+            snapshot: Pinned version the ranking came from
+            ranked: ``(ordinal, score)`` tuples, best first
+
+        Returns:
+            Chunks in ranked order
+        """
+        loaded = snapshot.loaded
+        documents = snapshot.metadata["documents"]
+        # Scoring ran on the index alone; only the top-k texts are read
+        chunks = self._load_chunks(
+            snapshot.kb_id, [loaded.index.chunk_id(o) for o, _ in ranked]
+        )
+        top_chunks = []
+        for (ordinal, _), chunk in zip(ranked, chunks):
+            # A deduplicated chunk cites every live document containing it;
+            # its stored copy may belong to a deleted document
+            filenames = []
+            chunk_ids = [loaded.index.chunk_id(ordinal), *loaded.index.references_of(ordinal)]
+            for chunk_id in chunk_ids:
+                doc = documents.get(chunk_id.rsplit("_", 1)[0])
+                if doc and doc["filename"] not in filenames:
+                    filenames.append(doc["filename"])
+            if filenames and filenames != [chunk["metadata"]["filename"]]:
+                metadata = {**chunk["metadata"], "filename": filenames[0]}
+                if len(filenames) > 1:
+                    metadata["also_in"] = filenames[1:]
+                chunk = {**chunk, "metadata": metadata}
+            top_chunks.append(chunk)
+        return top_chunks
+
+    def query_knowledge_base(
+        self, kb_id: str, query: str, top_k: int = 5, engine: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Query a knowledge base with a single search engine.
+
+        Hybrid KBs are searched lexically here; fusing both engines is done
+        by ``kb_router.route_knowledge_base_query``.
+
+        Args:
+            kb_id: Knowledge base identifier
+            query: Search query
+            top_k: Number of results to return
+            engine: "lexical" or "vector"; defaults to the KB's scoring mode
+
+        Returns:
+            Query results with chunks and sources
+        """
+        with self.pin(kb_id) as snapshot:
+            ranked = self.search_chunks(kb_id, query, top_k, engine, snapshot)
+            return self.format_results(kb_id, ranked, snapshot)
+
     def list_knowledge_bases(self) -> List[Dict[str, Any]]:
         """List all available knowledge bases."""
         return [
@@ -321,25 +2139,139 @@ class KnowledgeBaseManager:
                 "created_at": kb_data["created_at"],
                 "document_count": kb_data["document_count"],
                 "chunk_count": kb_data.get("chunk_count", 0),
+                "scoring_mode": kb_data.get("scoring_mode", "bm25"),
+                "storage_backend": kb_data.get("storage_backend", "native"),
             }
-            for kb_id, kb_data in self.index["knowledge_bases"].items()
+            for kb_id, kb_data in self.published.items()
         ]
 
-    def delete_knowledge_base(self, kb_id: str):
-        """Delete a knowledge base and all its documents."""
-        if kb_id not in self.index["knowledge_bases"]:
-            raise ValueError(f"Knowledge base '{kb_id}' not found")
+    def export_knowledge_base(self, kb_id: str, path: Path) -> Dict[str, Any]:
+        """Pack a KB's files and metadata into one archive for another node.
 
-        # Delete directory
+        The archive holds the published version at the time of the call.
+        Uploads continue meanwhile: the version is pinned, so its files stay
+        on disk until they are packed.
+
+        Args:
+            kb_id: Knowledge base identifier
+            path: Archive file to write
+
+        Returns:
+            Number of files, archive size in bytes and the archive's SHA-256
+        """
+        if kb_id not in self.published:
+            raise ValueError(f"Knowledge base '{kb_id}' not found")
         kb_dir = self.storage_dir / kb_id
-        if kb_dir.exists():
-            import shutil
+        sqlite_kb = self._sqlite_kb(kb_id)
+
+        with ExitStack() as stack:
+            entries: List[Tuple[str, Any]] = []
+            with self._write_lock:
+                if kb_id not in self.index["knowledge_bases"]:
+                    raise ValueError(f"Knowledge base '{kb_id}' not found")
+                if sqlite_kb is None:
+                    # Bring older on-disk formats up to date before copying them
+                    self._load_writable_segments(kb_id)
+                snapshot = stack.enter_context(self.pin(kb_id))
+                if sqlite_kb is not None:
+                    database = Path(
+                        stack.enter_context(
+                            tempfile.TemporaryDirectory(dir=self.storage_dir, prefix=".export-")
+                        )
+                    ) / SqliteKnowledgeBase.FILENAME
+                    sqlite_kb.backup(database)
+                    entries.append((SqliteKnowledgeBase.FILENAME, database))
+                else:
+                    # The manifest on disk matches the published version
+                    # while the writer lock is held
+                    manifest = (kb_dir / SegmentedIndex.MANIFEST_FILENAME).read_bytes()
+                    entries.append((SegmentedIndex.MANIFEST_FILENAME, manifest))
+                    for entry in json.loads(manifest)["segments"]:
+                        for file in sorted((kb_dir / entry["name"]).iterdir()):
+                            if file.suffix != ".tmp":
+                                entries.append((f"{entry['name']}/{file.name}", file))
+                for file in sorted(kb_dir.iterdir()):
+                    if (
+                        file.is_file()
+                        and file.suffix != ".tmp"
+                        and file.name != SegmentedIndex.MANIFEST_FILENAME
+                        and not file.name.startswith(SqliteKnowledgeBase.FILENAME)
+                    ):
+                        entries.append((file.name, file))
+
+            start = time.perf_counter()
+            stats = write_archive(Path(path), snapshot.metadata, entries)
+        print(
+            f"📦 Exported {kb_id} ({stats['files']} files, {stats['bytes'] / 1e6:.1f} MB) "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        return stats
 
-            shutil.rmtree(kb_dir)
+    def import_knowledge_base(self, source: Any, kb_id: Optional[str] = None) -> Dict[str, Any]:
+        """Add a KB from an archive written by :meth:`export_knowledge_base`.
 
-        # Remove from index
-        del self.index["knowledge_bases"][kb_id]
-        self._save_index()
+        Files are extracted and verified next to the KB directories, then
+        renamed into place and published in one step; a damaged archive
+        leaves nothing behind. Indexes and embeddings are used as archived.
+
+        Args:
+            source: Archive path, or a seekable binary file holding it
+            kb_id: ID to import under; defaults to the archived KB's ID
+
+        Returns:
+            Metadata of the imported knowledge base
+        """
+        start = time.perf_counter()
+        staging = Path(tempfile.mkdtemp(dir=self.storage_dir, prefix=".import-"))
+        try:
+            if isinstance(source, (str, Path)):
+                with open(source, "rb") as f:
+                    kb_metadata = read_archive(f, staging)
+            else:
+                kb_metadata = read_archive(source, staging)
+            kb_id = kb_id or kb_metadata["id"]
+            if Path(kb_id).name != kb_id or kb_id.startswith("."):
+                raise ValueError(f"Invalid knowledge base ID '{kb_id}'")
+
+            with self._write_lock:
+                kb_dir = self.storage_dir / kb_id
+                if kb_id in self.index["knowledge_bases"] or kb_dir.exists():
+                    raise ValueError(f"Knowledge base '{kb_id}' already exists")
+                os.replace(staging, kb_dir)
+                self.index["knowledge_bases"][kb_id] = {**kb_metadata, "id": kb_id}
+                self._bump_version(kb_id)
+                self._save_index()
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        print(f"📦 Imported {kb_id} in {time.perf_counter() - start:.2f}s")
+        return self.published[kb_id]
+
+    def delete_knowledge_base(self, kb_id: str):
+        """Delete a knowledge base and all its documents."""
+        with self._write_lock:
+            if kb_id not in self.index["knowledge_bases"]:
+                raise ValueError(f"Knowledge base '{kb_id}' not found")
+
+            self._bump_version(kb_id)
+            self._kb_cache.invalidate(kb_id)
+            self._dictionaries.pop(kb_id, None)
+            with self._sqlite_lock:
+                sqlite_kb = self._sqlite_kbs.pop(kb_id, None)
+            if sqlite_kb is not None:
+                sqlite_kb.close()
+
+            # Delete directory; retired paths in it must not outlive it, or
+            # they would match files of a new KB with this ID
+            kb_dir = self.storage_dir / kb_id
+            with self._pins_lock:
+                self._retired.pop(kb_id, None)
+            if kb_dir.exists():
+                shutil.rmtree(kb_dir)
+
+            # Remove from index
+            del self.index["knowledge_bases"][kb_id]
+            self._save_index()
 
 
 # Global instance
@@ -1,8 +1,192 @@
 """Knowledge Base Router - Routes retrieval to appropriate KB based on type."""
-from typing import Dict, Any, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Dict, List, Optional, Tuple, Union
+
 from agent.cnb_retrieval import query_cnb_knowledge_base
+from agent.kb_manager import KBSnapshot, kb_manager
 from agent.wikipedia_retrieval import query_wikipedia
-from agent.kb_manager import kb_manager
+
+# Constant from the original RRF paper; damps the weight of top ranks
+RRF_K = 60
+
+# Candidates fetched from each engine per requested result in hybrid mode
+HYBRID_CANDIDATE_FACTOR = 4
+
+# Shared pool so hybrid queries don't pay thread start-up per call
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="kb-search")
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Tuple[int, float]]], k: int = RRF_K
+) -> List[Tuple[int, float]]:
+    """Merge ranked lists by summing ``1 / (k + rank)`` per item.
+
+    Args:
+        rankings: Ranked ``(item, score)`` lists, best first
+        k: Rank damping constant
+
+    Returns:
+        Fused ``(item, rrf_score)`` list, best first
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (item, _) in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda entry: entry[1], reverse=True)
+
+
+def _timed_search(
+    snapshot: KBSnapshot, query: str, top_k: int, engine: Optional[str]
+):
+    """Run one engine's search of a pinned KB and return its ranking and latency in ms."""
+    start = time.perf_counter()
+    ranked = kb_manager.search_chunks(snapshot.kb_id, query, top_k, engine, snapshot)
+    return ranked, (time.perf_counter() - start) * 1000
+
+
+def query_custom_kb_hybrid(kb_id: str, query: str, top_k: int = 5) -> Dict[str, Any]:
+    """Query a custom KB with lexical and vector search fused by RRF.
+
+    Both searches run concurrently and each returns a deeper candidate list
+    than ``top_k``, so fusion can recover chunks that only one engine ranks
+    highly. Both searches and formatting read the same pinned KB version.
+
+    Args:
+        kb_id: Custom knowledge base ID
+        query: Search query
+        top_k: Number of results to return
+
+    Returns:
+        Dictionary with results, sources and per-stage timing metadata
+    """
+    start = time.perf_counter()
+    depth = top_k * HYBRID_CANDIDATE_FACTOR
+    with kb_manager.pin(kb_id) as snapshot:
+        lexical = _search_pool.submit(_timed_search, snapshot, query, depth, "lexical")
+        vector = _search_pool.submit(_timed_search, snapshot, query, depth, "vector")
+        lexical_ranked, lexical_ms = lexical.result()
+        vector_ranked, vector_ms = vector.result()
+
+        fusion_start = time.perf_counter()
+        fused = reciprocal_rank_fusion([lexical_ranked, vector_ranked])[:top_k]
+        result = kb_manager.format_results(kb_id, fused, snapshot)
+        fusion_ms = (time.perf_counter() - fusion_start) * 1000
+
+    result["metadata"] = {
+        "retrieval_mode": "hybrid",
+        "lexical_hits": len(lexical_ranked),
+        "vector_hits": len(vector_ranked),
+        "timings_ms": {
+            "lexical": round(lexical_ms, 3),
+            "vector": round(vector_ms, 3),
+            "fusion": round(fusion_ms, 3),
+            "total": round((time.perf_counter() - start) * 1000, 3),
+        },
+    }
+    return result
+
+
+def _normalize_scores(ranked: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+    """Scale a KB's scores so its best hit scores 1.0.
+
+    BM25 scores depend on each KB's collection statistics and RRF scores on
+    list depth, so raw scores from different KBs are not comparable.
+    """
+    best = ranked[0][1] if ranked else 0.0
+    if best <= 0:
+        return [(item, 0.0) for item, _ in ranked]
+    return [(item, score / best) for item, score in ranked]
+
+
+def query_custom_kbs_federated(
+    kb_ids: List[str], query: str, top_k: int = 5
+) -> Dict[str, Any]:
+    """Query several custom KBs at once and merge their top results.
+
+    Every KB (both engines of hybrid KBs) is searched concurrently for
+    ``top_k`` candidates. Scores are normalized per KB before the merge, and
+    only the merged top-k chunks are read, from the KB versions searched.
+
+    Args:
+        kb_ids: Custom knowledge base IDs
+        query: Search query
+        top_k: Number of results to return across all KBs
+
+    Returns:
+        Dictionary with results, sources and per-stage timing metadata; each
+        result's metadata names the KB it came from
+    """
+    start = time.perf_counter()
+    kb_ids = list(dict.fromkeys(kb_ids))
+    with ExitStack() as pins:
+        # Search and format each KB at one pinned version
+        snapshots = {kb_id: pins.enter_context(kb_manager.pin(kb_id)) for kb_id in kb_ids}
+        searches = {}
+        for kb_id in kb_ids:
+            if snapshots[kb_id].metadata.get("scoring_mode") == "hybrid":
+                depth = top_k * HYBRID_CANDIDATE_FACTOR
+                engines = ["lexical", "vector"]
+            else:
+                depth, engines = top_k, [None]
+            searches[kb_id] = [
+                _search_pool.submit(_timed_search, snapshots[kb_id], query, depth, engine)
+                for engine in engines
+            ]
+
+        merged: List[Tuple[float, int, int]] = []
+        search_ms = {}
+        for position, kb_id in enumerate(kb_ids):
+            rankings = [future.result() for future in searches[kb_id]]
+            search_ms[kb_id] = round(max(ms for _, ms in rankings), 3)
+            if len(rankings) > 1:
+                ranked = reciprocal_rank_fusion([r for r, _ in rankings])[:top_k]
+            else:
+                ranked = rankings[0][0]
+            merged.extend((score, position, item) for item, score in _normalize_scores(ranked))
+        merged.sort(key=lambda entry: entry[0], reverse=True)
+        merged = merged[:top_k]
+
+        format_start = time.perf_counter()
+        chunks = {}
+        for position, kb_id in enumerate(kb_ids):
+            selected = [(item, score) for score, p, item in merged if p == position]
+            if selected:
+                chunks[kb_id] = kb_manager.read_chunks(kb_id, selected, snapshots[kb_id])
+
+    results = []
+    sources = []
+    seen_urls = set()
+    for _, position, item in merged:
+        kb_id = kb_ids[position]
+        # Hits whose chunk was deleted since the search have no entry
+        chunk = chunks[kb_id].get(item)
+        if chunk is None:
+            continue
+        result = {"chunk": chunk["content"], "metadata": {**chunk["metadata"], "kb_id": kb_id}}
+        results.append(result)
+        filenames = [result["metadata"]["filename"], *result["metadata"].get("also_in", [])]
+        for filename in filenames:
+            url = f"local://{kb_id}/{filename}"
+            if url in seen_urls:
+                continue
+            sources.append({"id": len(sources) + 1, "title": filename, "url": url, "path": filename})
+            seen_urls.add(url)
+
+    return {
+        "results": results,
+        "sources": sources,
+        "metadata": {
+            "retrieval_mode": "federated",
+            "knowledge_bases": kb_ids,
+            "timings_ms": {
+                "search": search_ms,
+                "format": round((time.perf_counter() - format_start) * 1000, 3),
+                "total": round((time.perf_counter() - start) * 1000, 3),
+            },
+        },
+    }
 
 
 def route_knowledge_base_query(
@@ -10,7 +194,7 @@ def route_knowledge_base_query(
     kb_type: str = "cnb",
     repository: str = "cnb/docs",
     top_k: int = 5,
-    custom_kb_id: Optional[str] = None
+    custom_kb_id: Optional[Union[str, List[str]]] = None
 ) -> Dict[str, Any]:
     """Route query to appropriate knowledge base.
 
@@ -19,7 +203,8 @@ def route_knowledge_base_query(
         kb_type: Type of knowledge base - "cnb", "wikipedia", or "custom"
         repository: Repository name (for CNB)
         top_k: Number of results to return
-        custom_kb_id: Custom knowledge base ID (required when kb_type="custom")
+        custom_kb_id: Custom knowledge base ID, or a list of IDs to search
+            together (required when kb_type="custom")
 
     Returns:
         Dictionary with results and sources in standard format
@@ -35,11 +220,19 @@ def route_knowledge_base_query(
         return query_cnb_knowledge_base(query, repository=repository, top_k=top_k)
 
     elif kb_type == "custom":
-        if not custom_kb_id:
+        kb_ids = [custom_kb_id] if isinstance(custom_kb_id, str) else list(custom_kb_id or [])
+        if not kb_ids:
             print(f"⚠️ Custom KB ID not provided, falling back to Wikipedia...")
             return query_wikipedia(query, top_k=top_k)
 
+        if len(kb_ids) > 1:
+            print(f"📁 Routing to Custom KBs: {', '.join(kb_ids)}...")
+            return query_custom_kbs_federated(kb_ids, query, top_k=top_k)
+
+        custom_kb_id = kb_ids[0]
         print(f"📁 Routing to Custom KB: {custom_kb_id}...")
+        if kb_manager.get_scoring_mode(custom_kb_id) == "hybrid":
+            return query_custom_kb_hybrid(custom_kb_id, query, top_k=top_k)
         return kb_manager.query_knowledge_base(custom_kb_id, query, top_k=top_k)
 
     else:
@@ -0,0 +1,615 @@
+"""Segmented (LSM-style) index storage for custom knowledge bases.
+
+A KB's index is a sequence of immutable segments, each covering an ordered,
+disjoint range of chunk ordinals. Every upload publish flushes its new chunks
+as one small segment, queries fan out across segments using KB-wide BM25
+statistics, and a background merger combines runs of similar-sized segments,
+physically dropping deleted chunks. Ordinals never change, so deduplication
+references and tombstones stay valid across merges.
+"""
+import bisect
+import json
+import math
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from agent.kb_index import BM25Index, chunk_hash, load_array, np, save_array, tokenize
+
+
+class Segment:
+    """One immutable slice of a KB index.
+
+    Wraps a :class:`BM25Index` addressed by local positions, the KB-wide
+    ordinal of every position, and the deduplication references created by
+    the segment's documents.
+
+    Saved segments hold their ordinals in a memory-mapped array when numpy
+    is installed, like the index's postings and chunk tables.
+    """
+
+    FILENAME = "_segment.json"
+    ORDINALS_FILENAME = "_ordinals.npy"
+
+    def __init__(
+        self,
+        name: str,
+        index: Optional[BM25Index] = None,
+        ordinals: Optional[List[int]] = None,
+        references: Optional[List[List[Any]]] = None,
+    ):
+        """Wrap segment data.
+
+        Args:
+            name: Segment directory name
+            index: Index over the segment's chunks, by local position
+            ordinals: KB-wide ordinal of each local position, ascending
+            references: ``[ordinal, chunk_id]`` per duplicate chunk occurrence
+        """
+        self.name = name
+        self.index = index if index is not None else BM25Index()
+        self.ordinals = ordinals if ordinals is not None else []
+        self.references = references if references is not None else []
+
+    def __len__(self) -> int:
+        """Return the number of chunks stored in the segment."""
+        return len(self.ordinals)
+
+    def position(self, ordinal: int) -> Optional[int]:
+        """Return the local position of an ordinal, or None if not stored here."""
+        position = bisect.bisect_left(self.ordinals, ordinal)
+        if position < len(self.ordinals) and self.ordinals[position] == ordinal:
+            return position
+        return None
+
+    @property
+    def mapped(self) -> bool:
+        """Whether the index and ordinals are served from memory-mapped files."""
+        return self.index.mapped and not isinstance(self.ordinals, list)
+
+    def document_ordinals(self, doc_id: str) -> List[int]:
+        """Return the ordinals of the chunks a document first indexed."""
+        first, count = self.index.documents[doc_id]
+        return [int(ordinal) for ordinal in self.ordinals[first : first + count]]
+
+    def save(self, kb_dir: Path):
+        """Write the segment into its own directory under ``kb_dir``.
+
+        Postings, chunk tables and ordinals are written as memory-mappable
+        files when numpy is installed, and the segment switches to serving
+        them from the mappings.
+        """
+        segment_dir = kb_dir / self.name
+        segment_dir.mkdir(exist_ok=True)
+        mapped = self.index.write_postings(segment_dir)
+        data = {
+            "index": self.index.to_dict(postings=not mapped),
+            "references": self.references,
+        }
+        if mapped:
+            save_array(
+                segment_dir / self.ORDINALS_FILENAME, np.asarray(self.ordinals, dtype=np.int64)
+            )
+        else:
+            data["ordinals"] = self.ordinals
+        path = segment_dir / self.FILENAME
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        if mapped:
+            self.index.map_postings(segment_dir)
+            self.ordinals = load_array(segment_dir / self.ORDINALS_FILENAME)
+
+    @classmethod
+    def load(cls, kb_dir: Path, name: str) -> "Segment":
+        """Read a segment written by :meth:`save`, mapping its array files."""
+        with open(kb_dir / name / cls.FILENAME, encoding="utf-8") as f:
+            data = json.load(f)
+        index = BM25Index.from_dict(data["index"])
+        if "postings" not in data["index"]:
+            index.map_postings(kb_dir / name)
+        ordinals = data.get("ordinals")
+        if ordinals is None:
+            ordinals = load_array(kb_dir / name / cls.ORDINALS_FILENAME)
+        return cls(name, index, ordinals, data["references"])
+
+
+class CollectionStats:
+    """KB-wide BM25 statistics shared by every segment of one query."""
+
+    def __init__(self, segments: List[Segment], terms: List[str]):
+        """Sum chunk counts, lengths and document frequencies over segments.
+
+        Args:
+            segments: Segments searched by the query
+            terms: Distinct query terms
+        """
+        self.n_chunks = sum(len(segment.index) for segment in segments)
+        total_length = sum(segment.index.total_length for segment in segments)
+        self.avg_length = (total_length / self.n_chunks if self.n_chunks else 0) or 1.0
+        self.df = {
+            term: sum(len(segment.index.postings.get(term, ())) for segment in segments)
+            for term in terms
+        }
+
+
+def search_segments(
+    segments: List[Segment],
+    query: str,
+    top_k: int,
+    exclude: Optional[Dict[str, List[int]]] = None,
+) -> List[Tuple[int, float]]:
+    """Rank chunks of all segments with BM25 and merge their top-k.
+
+    Scores use KB-wide statistics, so the result equals a search over one
+    index holding every segment's chunks.
+
+    Args:
+        segments: Segments to search
+        query: Search query
+        top_k: Number of results to return
+        exclude: Local positions never returned, by segment name
+
+    Returns:
+        List of ``(ordinal, score)`` tuples, best first
+    """
+    stats = CollectionStats(segments, list(set(tokenize(query))))
+    ranked = []
+    exclude = exclude or {}
+    for segment in segments:
+        hits = segment.index.search(
+            query, top_k=top_k, stats=stats, exclude=exclude.get(segment.name)
+        )
+        for position, score in hits:
+            ranked.append((int(segment.ordinals[position]), score))
+    ranked.sort(key=lambda item: item[1], reverse=True)
+    return ranked[:top_k]
+
+
+class SegmentedIndex:
+    """Mutable view of a KB's segments, tombstones and in-progress segment.
+
+    New chunks go to an in-memory segment that :meth:`flush` seals. Deletes
+    are recorded per segment in the manifest: ``deleted`` holds tombstoned
+    ordinals and ``removed`` the deleted documents whose entries the segment
+    still carries.
+    """
+
+    MANIFEST_FILENAME = "_segments.json"
+
+    def __init__(
+        self,
+        segments: Optional[List[Segment]] = None,
+        entries: Optional[Dict[str, Dict[str, Set[Any]]]] = None,
+        next_ordinal: int = 0,
+        next_segment: int = 0,
+    ):
+        """Wrap loaded segments.
+
+        Args:
+            segments: Segments in ordinal order
+            entries: Per-segment ``{"deleted": ordinals, "removed": doc_ids}``
+            next_ordinal: Ordinal assigned to the next new chunk
+            next_segment: Number used to name the next segment
+        """
+        self.segments = segments or []
+        self.entries = entries or {}
+        self.next_ordinal = next_ordinal
+        self.next_segment = next_segment
+        self.memtable: Optional[Segment] = None
+        self._starts: Optional[List[int]] = None
+        self._references: Optional[Dict[int, List[str]]] = None
+        self._live_documents: Optional[Dict[str, Segment]] = None
+
+    # Loading and saving
+
+    @classmethod
+    def exists(cls, kb_dir: Path) -> bool:
+        """Check whether a KB directory holds a segment manifest."""
+        return (kb_dir / cls.MANIFEST_FILENAME).exists()
+
+    @classmethod
+    def load(
+        cls, kb_dir: Path, loaded: Optional[Dict[str, Segment]] = None
+    ) -> "SegmentedIndex":
+        """Read the manifest and its segments.
+
+        Args:
+            kb_dir: Knowledge base directory
+            loaded: Already loaded segments by name; segments are immutable,
+                so these are reused instead of re-read
+
+        Returns:
+            The KB's segmented index
+        """
+        with open(kb_dir / cls.MANIFEST_FILENAME, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        loaded = loaded or {}
+        segments, entries = [], {}
+        for entry in manifest["segments"]:
+            name = entry["name"]
+            segments.append(loaded.get(name) or Segment.load(kb_dir, name))
+            entries[name] = {"deleted": set(entry["deleted"]), "removed": set(entry["removed"])}
+        return cls(segments, entries, manifest["next_ordinal"], manifest["next_segment"])
+
+    def save(self, kb_dir: Path):
+        """Atomically write the manifest; sealed segments must already be saved."""
+        manifest = {
+            "next_ordinal": self.next_ordinal,
+            "next_segment": self.next_segment,
+            "segments": [
+                {
+                    "name": segment.name,
+                    "n_chunks": len(segment),
+                    "deleted": sorted(self._entry(segment)["deleted"]),
+                    "removed": sorted(self._entry(segment)["removed"]),
+                }
+                for segment in self.segments
+            ],
+        }
+        path = kb_dir / self.MANIFEST_FILENAME
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def new_segment_name(self) -> str:
+        """Reserve a name for a new segment."""
+        name = f"seg_{self.next_segment:06d}"
+        self.next_segment += 1
+        return name
+
+    # Lookups
+
+    def _entry(self, segment: Segment) -> Dict[str, Set[Any]]:
+        """Return a segment's delete bookkeeping, creating it if missing."""
+        return self.entries.setdefault(segment.name, {"deleted": set(), "removed": set()})
+
+    def _all_segments(self) -> List[Segment]:
+        """Return sealed segments followed by the in-progress one, if any."""
+        if self.memtable is None:
+            return self.segments
+        return [*self.segments, self.memtable]
+
+    def _invalidate(self):
+        """Drop lookup tables derived from the segment list."""
+        self._starts = None
+        self._references = None
+        self._live_documents = None
+
+    @property
+    def deleted(self) -> Set[int]:
+        """Return every tombstoned ordinal."""
+        deleted = set()
+        for segment in self._all_segments():
+            deleted |= self._entry(segment)["deleted"]
+        return deleted
+
+    def deleted_positions(self, segment: Segment) -> List[int]:
+        """Return the local positions of a segment's tombstoned chunks, ascending."""
+        return sorted(segment.position(ordinal) for ordinal in self._entry(segment)["deleted"])
+
+    @property
+    def live_count(self) -> int:
+        """Return the number of stored chunks that are not tombstoned."""
+        return sum(
+            len(segment) - len(self._entry(segment)["deleted"])
+            for segment in self._all_segments()
+        )
+
+    def segment_of(self, ordinal: int) -> Optional[Segment]:
+        """Return the segment storing an ordinal."""
+        segments = [segment for segment in self._all_segments() if len(segment)]
+        if self._starts is None or len(self._starts) != len(segments):
+            self._starts = [int(segment.ordinals[0]) for segment in segments]
+        i = bisect.bisect_right(self._starts, ordinal) - 1
+        if i < 0 or segments[i].position(ordinal) is None:
+            return None
+        return segments[i]
+
+    def chunk_id(self, ordinal: int) -> str:
+        """Return the ID of the chunk stored under an ordinal."""
+        segment = self.segment_of(ordinal)
+        return segment.index.chunk_ids[segment.position(ordinal)]
+
+    def live_documents(self) -> Dict[str, Segment]:
+        """Map every indexed, non-deleted document to its segment."""
+        if self._live_documents is None:
+            self._live_documents = {
+                doc_id: segment
+                for segment in self._all_segments()
+                for doc_id in segment.index.documents
+                if doc_id not in self._entry(segment)["removed"]
+            }
+        return self._live_documents
+
+    def has_document(self, doc_id: str) -> bool:
+        """Check whether a document is indexed and not deleted."""
+        return doc_id in self.live_documents()
+
+    def find_chunk(self, text: str) -> Optional[int]:
+        """Return the ordinal of a live chunk with identical text, if any."""
+        h = chunk_hash(text)
+        for segment in reversed(self._all_segments()):
+            position = segment.index.content_hashes.get(h)
+            if position is None:
+                continue
+            ordinal = int(segment.ordinals[position])
+            if ordinal not in self._entry(segment)["deleted"]:
+                return ordinal
+        return None
+
+    def references_of(self, ordinal: int) -> List[str]:
+        """Return the chunk IDs of live documents that duplicate a chunk."""
+        if self._references is None:
+            references: Dict[int, List[str]] = {}
+            for segment in self._all_segments():
+                removed = self._entry(segment)["removed"]
+                for ref_ordinal, chunk_id in segment.references:
+                    if chunk_id.rsplit("_", 1)[0] not in removed:
+                        references.setdefault(ref_ordinal, []).append(chunk_id)
+            self._references = references
+        return self._references.get(ordinal, [])
+
+    # Writing through the in-progress segment
+
+    def _writable(self) -> Segment:
+        """Return the in-progress segment, starting one if needed."""
+        if self.memtable is None:
+            self.memtable = Segment(self.new_segment_name())
+        return self.memtable
+
+    def checkpoint(self) -> Tuple[int, int]:
+        """Mark the in-progress segment's size before writing a document."""
+        memtable = self._writable()
+        return len(memtable), len(memtable.references)
+
+    def add_chunk(self, chunk_id: str, text: str) -> int:
+        """Index a new chunk and return its ordinal."""
+        memtable = self._writable()
+        memtable.index.add_chunk(chunk_id, text)
+        memtable.ordinals.append(self.next_ordinal)
+        self.next_ordinal += 1
+        self._starts = None
+        return memtable.ordinals[-1]
+
+    def add_reference(self, ordinal: int, chunk_id: str):
+        """Record that ``chunk_id`` has the same text as chunk ``ordinal``."""
+        self._writable().references.append([ordinal, chunk_id])
+        self._references = None
+
+    def end_document(self, doc_id: str, checkpoint: Tuple[int, int]):
+        """Register a fully written document's chunks."""
+        memtable = self._writable()
+        memtable.index.documents[doc_id] = [checkpoint[0], len(memtable) - checkpoint[0]]
+        self._live_documents = None
+
+    def rollback(self, checkpoint: Tuple[int, int]):
+        """Undo every addition made since :meth:`checkpoint`."""
+        memtable = self._writable()
+        n_chunks, n_references = checkpoint
+        memtable.index.truncate(n_chunks)
+        self.next_ordinal -= len(memtable) - n_chunks
+        del memtable.ordinals[n_chunks:]
+        del memtable.references[n_references:]
+        self._invalidate()
+
+    def flush(self, kb_dir: Path) -> Optional[Segment]:
+        """Seal and save the in-progress segment.
+
+        The manifest is not updated; call :meth:`save` once any side files
+        of the segment are written.
+
+        Returns:
+            The sealed segment, or None if nothing was written since the
+            last flush
+        """
+        memtable, self.memtable = self.memtable, None
+        if memtable is None:
+            return None
+        if not (len(memtable) or memtable.references or memtable.index.documents):
+            self.entries.pop(memtable.name, None)
+            return None
+        memtable.save(kb_dir)
+        self.segments.append(memtable)
+        self._invalidate()
+        return memtable
+
+    def delete_document(self, doc_id: str) -> List[int]:
+        """Delete a document, tombstoning chunks no live document still uses.
+
+        Args:
+            doc_id: Document identifier
+
+        Returns:
+            Ordinals of the newly tombstoned chunks
+        """
+        segment = self.live_documents()[doc_id]
+        prefix = f"{doc_id}_"
+        candidates = segment.document_ordinals(doc_id) + [
+            ordinal for ordinal, chunk_id in segment.references if chunk_id.startswith(prefix)
+        ]
+        self._entry(segment)["removed"].add(doc_id)
+        self._invalidate()
+
+        tombstoned = []
+        live = self.live_documents()
+        for ordinal in candidates:
+            owner = self.chunk_id(ordinal).rsplit("_", 1)[0]
+            if owner in live or self.references_of(ordinal):
+                continue
+            owner_segment = self.segment_of(ordinal)
+            if ordinal not in self._entry(owner_segment)["deleted"]:
+                self._entry(owner_segment)["deleted"].add(ordinal)
+                tombstoned.append(ordinal)
+        return tombstoned
+
+    def swap(self, name: str, segment: Segment):
+        """Replace a segment with a rewrite covering the same ordinals.
+
+        The rewrite takes over the replaced segment's delete bookkeeping.
+        """
+        position = next(i for i, s in enumerate(self.segments) if s.name == name)
+        self.segments[position] = segment
+        self.entries[segment.name] = self.entries.pop(
+            name, {"deleted": set(), "removed": set()}
+        )
+        self._invalidate()
+
+    # Merging
+
+    def plan_merge(self, merge_factor: int, deleted_ratio: float) -> Optional[List[str]]:
+        """Pick segments to merge next, or None if the layout is balanced.
+
+        A segment whose tombstoned share reaches ``deleted_ratio`` is
+        rewritten on its own. Otherwise the first run of ``merge_factor``
+        adjacent segments in the same size tier is merged, where tier ``t``
+        holds segments of ``merge_factor**t`` to ``merge_factor**(t + 1)``
+        chunks.
+
+        Args:
+            merge_factor: Number of same-tier segments merged at once
+            deleted_ratio: Tombstoned share that forces a rewrite
+
+        Returns:
+            Names of adjacent segments to merge
+        """
+        for segment in self.segments:
+            entry = self._entry(segment)
+            if entry["deleted"] and len(entry["deleted"]) >= deleted_ratio * len(segment):
+                return [segment.name]
+
+        run: List[Segment] = []
+        for segment in self.segments:
+            tier = int(math.log(max(len(segment), 1), merge_factor))
+            if run and int(math.log(max(len(run[0]), 1), merge_factor)) != tier:
+                run = []
+            run.append(segment)
+            if len(run) == merge_factor:
+                return [s.name for s in run]
+        return None
+
+    def merge(self, names: List[str], name: str) -> "SegmentMerge":
+        """Prepare merging adjacent segments into one.
+
+        Only snapshots the sources' delete bookkeeping; the merged segment is
+        built by :meth:`SegmentMerge.run`, which reads nothing mutable and may
+        run without holding the writer lock. Apply the result with
+        :meth:`replace`.
+
+        Args:
+            names: Adjacent segments to merge, in order
+            name: Name of the merged segment
+
+        Returns:
+            The pending merge
+        """
+        sources = [segment for segment in self.segments if segment.name in names]
+        snapshot = {
+            segment.name: {key: set(value) for key, value in self._entry(segment).items()}
+            for segment in sources
+        }
+        return SegmentMerge(names, name, sources, snapshot)
+
+    def replace(self, merge: "SegmentMerge"):
+        """Swap merged segments for their merge result.
+
+        Deletes recorded while the merge ran are carried over to the merged
+        segment.
+        """
+        positions = [i for i, s in enumerate(self.segments) if s.name in merge.names]
+        carried = {"deleted": set(), "removed": set()}
+        for name in merge.names:
+            for key in carried:
+                carried[key] |= self.entries.pop(name, {}).get(key, set()) - merge.snapshot[
+                    name
+                ][key]
+
+        self.segments[positions[0] : positions[-1] + 1] = [merge.segment]
+        self.entries[merge.segment.name] = carried
+        self._invalidate()
+
+
+class SegmentMerge:
+    """A merge prepared by :meth:`SegmentedIndex.merge`, not yet applied."""
+
+    def __init__(
+        self,
+        names: List[str],
+        name: str,
+        sources: List[Segment],
+        snapshot: Dict[str, Dict[str, Set[Any]]],
+    ):
+        """Bundle the inputs of a merge.
+
+        Args:
+            names: Names of the merged segments
+            name: Name of the merged segment
+            sources: The merged segments, in order
+            snapshot: Delete bookkeeping of the sources the merge applies
+        """
+        self.names = names
+        self.sources = sources
+        self.snapshot = snapshot
+        self.segment = Segment(name, BM25Index(k1=sources[0].index.k1, b=sources[0].index.b))
+        # Kept local positions of each source segment, in order
+        self.selections: List[Tuple[Segment, List[int]]] = []
+
+    def run(self) -> Segment:
+        """Build the merged segment, dropping deleted chunks and documents."""
+        merged = self.segment
+        for segment in self.sources:
+            deleted = self.snapshot[segment.name]["deleted"]
+            removed = self.snapshot[segment.name]["removed"]
+            index = segment.index
+            base = len(merged)
+            # Plain ints; mapped ordinals are slow to index one by one
+            ordinals = (
+                segment.ordinals
+                if isinstance(segment.ordinals, list)
+                else segment.ordinals.tolist()
+            )
+
+            # live_before[p]: live positions below p, i.e. new offset of p
+            live_before = [0]
+            for ordinal in ordinals:
+                live_before.append(live_before[-1] + (ordinal not in deleted))
+            live = [p for p, ordinal in enumerate(ordinals) if ordinal not in deleted]
+            self.selections.append((segment, live))
+
+            for p in live:
+                merged.index.chunk_ids.append(index.chunk_ids[p])
+                merged.index.chunk_lengths.append(int(index.chunk_lengths[p]))
+                merged.ordinals.append(ordinals[p])
+            for term, postings in index.postings.items():
+                kept = [
+                    [base + live_before[p], tf]
+                    for p, tf in postings
+                    if ordinals[p] not in deleted
+                ]
+                if kept:
+                    merged.index.postings.setdefault(term, []).extend(kept)
+            for h, p in index.content_hashes.items():
+                if ordinals[p] not in deleted:
+                    merged.index.content_hashes[h] = base + live_before[p]
+            for doc_id, (first, count) in index.documents.items():
+                if doc_id not in removed:
+                    merged.index.documents[doc_id] = [base + live_before[first], count]
+            merged.references.extend(
+                [ordinal, chunk_id]
+                for ordinal, chunk_id in segment.references
+                if chunk_id.rsplit("_", 1)[0] not in removed
+            )
+
+        merged.index.total_length = sum(merged.index.chunk_lengths)
+        return merged
+
+    def dropped_documents(self) -> Set[str]:
+        """Return deleted documents whose chunks the merge dropped entirely."""
+        kept_owners = {chunk_id.rsplit("_", 1)[0] for chunk_id in self.segment.index.chunk_ids}
+        removed = set()
+        for entry in self.snapshot.values():
+            removed |= entry["removed"]
+        return removed - kept_owners
@@ -0,0 +1,265 @@
+"""SQLite FTS5 storage backend for custom knowledge bases.
+
+Each KB is one SQLite database holding its documents and chunks, with an
+external-content FTS5 table kept in sync by triggers. FTS5 indexes the
+``terms`` column, the chunk text run through the KB analyzer, so CJK text
+is searchable by character bigrams just like in the native backend.
+The database runs in WAL mode, so queries on per-thread connections proceed
+while an upload is writing, and ranking uses FTS5's built-in ``bm25()``.
+"""
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from agent.kb_analyzer import analyze
+from agent.kb_index import tokenize
+
+# Bumped when the schema or the analyzer behind the terms column changes
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    uploaded_at TEXT NOT NULL,
+    chunk_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL REFERENCES documents(doc_id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    terms TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_doc ON chunks(doc_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    terms, content='chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 0'
+);
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts(rowid, terms) VALUES (new.id, new.terms);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, terms) VALUES ('delete', old.id, old.terms);
+END;
+"""
+
+# Chunks inserted per executemany call while streaming a document
+_INSERT_BATCH = 256
+
+
+def fts_query(query: str) -> str:
+    """Turn free text into an FTS5 query matching any of its terms.
+
+    Terms are quoted, so FTS5 operators and punctuation in user queries are
+    treated as plain text.
+    """
+    return " OR ".join(f'"{term}"' for term in dict.fromkeys(tokenize(query)))
+
+
+class SqliteKnowledgeBase:
+    """Chunks and FTS5 index of one KB in a SQLite database."""
+
+    FILENAME = "kb.sqlite"
+
+    def __init__(self, path: Path):
+        """Open (and if needed create) a KB database.
+
+        Args:
+            path: Database file
+        """
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._upgrade(conn)
+
+    def _upgrade(self, conn: sqlite3.Connection):
+        """Create the schema, re-analyzing chunks stored by an older version.
+
+        Every step is idempotent, so an upgrade interrupted part way is
+        simply redone on the next open.
+        """
+        with self._write_lock:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(chunks)")]
+            stale = bool(columns)
+            if stale:
+                with conn:
+                    if "terms" not in columns:
+                        conn.execute(
+                            "ALTER TABLE chunks ADD COLUMN terms TEXT NOT NULL DEFAULT ''"
+                        )
+                    rows = conn.execute("SELECT id, content FROM chunks").fetchall()
+                    conn.executemany(
+                        "UPDATE chunks SET terms = ? WHERE id = ?",
+                        [(" ".join(analyze(content)), rowid) for rowid, content in rows],
+                    )
+                    conn.execute("DROP TRIGGER IF EXISTS chunks_ai")
+                    conn.execute("DROP TRIGGER IF EXISTS chunks_ad")
+                    conn.execute("DROP TABLE IF EXISTS chunks_fts")
+            conn.executescript(_SCHEMA)
+            with conn:
+                if stale:
+                    conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def add_document(
+        self, doc_id: str, filename: str, uploaded_at: str, chunks: Iterable[str]
+    ) -> int:
+        """Store and index a document's chunks in one transaction.
+
+        Chunks are inserted in batches as they are produced. If the chunk
+        iterator raises, nothing of the document is kept.
+
+        Args:
+            doc_id: Document identifier
+            filename: Original filename
+            uploaded_at: ISO upload timestamp
+            chunks: Chunk texts in order
+
+        Returns:
+            Number of chunks stored
+        """
+        conn = self._connection()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT INTO documents (doc_id, filename, uploaded_at, chunk_count) "
+                "VALUES (?, ?, ?, 0)",
+                (doc_id, filename, uploaded_at),
+            )
+            count = 0
+            batch: List[Tuple[str, int, str, str]] = []
+            for chunk in chunks:
+                batch.append((doc_id, count, chunk, " ".join(analyze(chunk))))
+                count += 1
+                if len(batch) >= _INSERT_BATCH:
+                    conn.executemany(
+                        "INSERT INTO chunks (doc_id, chunk_index, content, terms) VALUES (?, ?, ?, ?)",
+                        batch,
+                    )
+                    batch.clear()
+            if batch:
+                conn.executemany(
+                    "INSERT INTO chunks (doc_id, chunk_index, content, terms) VALUES (?, ?, ?, ?)",
+                    batch,
+                )
+            conn.execute(
+                "UPDATE documents SET chunk_count = ? WHERE doc_id = ?", (count, doc_id)
+            )
+        return count
+
+    def delete_document(self, doc_id: str):
+        """Remove a document and its chunks from the table and the FTS index."""
+        conn = self._connection()
+        with self._write_lock, conn:
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    def chunk_count(self) -> int:
+        """Return the number of stored chunks."""
+        return self._connection().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """Rank chunks with FTS5 ``bm25()``.
+
+        Args:
+            query: Search query
+            top_k: Number of results to return
+
+        Returns:
+            List of ``(chunk_rowid, score)`` tuples, best first, with higher
+            scores better
+        """
+        match = fts_query(query)
+        if not match or top_k <= 0:
+            return []
+        rows = self._connection().execute(
+            "SELECT rowid, bm25(chunks_fts) FROM chunks_fts "
+            "WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+            (match, top_k),
+        )
+        # bm25() is lower-is-better; flip it to match the other engines
+        return [(rowid, -score) for rowid, score in rows]
+
+    def get_chunks(self, rowids: List[int]) -> List[Dict[str, Any]]:
+        """Load chunks with their citation metadata.
+
+        Args:
+            rowids: Chunk row IDs returned by :meth:`search`
+
+        Returns:
+            Chunks in the same order as ``rowids``, in the shape the native
+            backend returns; rows deleted since the search are left out
+        """
+        by_rowid = self.chunks_by_rowid(rowids)
+        return [by_rowid[rowid] for rowid in rowids if rowid in by_rowid]
+
+    def chunks_by_rowid(self, rowids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Load chunks with their citation metadata, keyed by row ID.
+
+        Args:
+            rowids: Chunk row IDs returned by :meth:`search`
+
+        Returns:
+            Chunks by row ID; rows deleted since the search have no entry
+        """
+        if not rowids:
+            return {}
+        placeholders = ",".join("?" * len(rowids))
+        rows = self._connection().execute(
+            "SELECT c.id, c.doc_id, c.chunk_index, c.content, d.filename, d.chunk_count "
+            "FROM chunks c JOIN documents d ON d.doc_id = c.doc_id "
+            f"WHERE c.id IN ({placeholders})",
+            rowids,
+        )
+        return {
+            rowid: {
+                "id": f"{doc_id}_{chunk_index}",
+                "content": content,
+                "metadata": {
+                    "filename": filename,
+                    "chunk_index": chunk_index,
+                    "total_chunks": total,
+                },
+            }
+            for rowid, doc_id, chunk_index, content, filename, total in rows
+        }
+
+    def optimize(self):
+        """Merge the FTS5 index b-trees and checkpoint the WAL."""
+        conn = self._connection()
+        with self._write_lock, conn:
+            conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('optimize')")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def backup(self, path: Path):
+        """Write a consistent copy of the database to ``path``."""
+        target = sqlite3.connect(path)
+        try:
+            self._connection().backup(target)
+        finally:
+            target.close()
+
+    def close(self):
+        """Close every thread's connection."""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
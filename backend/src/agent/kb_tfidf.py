@@ -0,0 +1,163 @@
+"""Vectorized TF-IDF scoring for custom knowledge bases."""
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from agent.kb_index import BM25Index, MappedPostings, load_array, save_array, tokenize
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TfidfMatrix:
+    """Term-major CSR matrix of L2-normalized TF-IDF chunk weights.
+
+    Row ``i`` holds the weights of vocabulary term ``i`` across chunks, so
+    scoring a query is a sparse matrix-vector product over just the query's
+    rows followed by an ``argpartition`` for the top-k.
+
+    Each array is saved as its own ``.npy`` file and loaded memory-mapped,
+    so every process serving the KB shares one copy in the page cache.
+    """
+
+    # Written last, so its presence marks a complete matrix
+    FILENAME = "_tfidf_data.npy"
+    # Single compressed file written by earlier versions; rebuilt on load
+    LEGACY_FILENAME = "_tfidf.npz"
+    ARRAYS = ("vocab", "idf", "indptr", "indices", "n_chunks", "data")
+
+    def __init__(self, vocab, idf, indptr, indices, data, n_chunks: int):
+        """Wrap prebuilt CSR arrays.
+
+        Args:
+            vocab: Sorted array of vocabulary terms
+            idf: Inverse document frequency per term
+            indptr: CSR row pointers, one row per term
+            indices: Chunk ordinal of each stored weight
+            data: Stored TF-IDF weights
+            n_chunks: Number of chunks (matrix columns)
+        """
+        self.vocab = vocab
+        self.idf = idf
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.n_chunks = n_chunks
+
+    @property
+    def nbytes(self) -> int:
+        """Return the heap memory held by the matrix arrays; mapped ones count zero."""
+        return sum(
+            a.nbytes
+            for a in (self.vocab, self.idf, self.indptr, self.indices, self.data)
+            if not isinstance(a, np.memmap)
+        )
+
+    @classmethod
+    def from_bm25_index(cls, bm25_index: BM25Index) -> "TfidfMatrix":
+        """Build the matrix from the postings of a BM25 index.
+
+        Args:
+            bm25_index: Index whose postings provide term frequencies
+
+        Returns:
+            The TF-IDF matrix for the same chunk ordinals
+        """
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+
+        n_chunks = len(bm25_index)
+        if isinstance(bm25_index.postings, MappedPostings):
+            # Mapped postings are already sorted by term with CSR offsets
+            terms = list(bm25_index.postings)
+            indptr = np.array(bm25_index.postings.offsets, dtype=np.int64)
+            lengths = np.diff(indptr)
+            pairs = np.array(bm25_index.postings.pairs, dtype=np.int64).reshape(-1, 2)
+        else:
+            terms = sorted(bm25_index.postings)
+            lengths = [len(bm25_index.postings[term]) for term in terms]
+            indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=indptr[1:])
+            pairs = np.array(
+                [pair for term in terms for pair in bm25_index.postings[term]],
+                dtype=np.int64,
+            ).reshape(-1, 2)
+        indices = pairs[:, 0].astype(np.int32)
+
+        df = np.asarray(lengths, dtype=np.float32)
+        idf = (np.log((1 + n_chunks) / (1 + df)) + 1).astype(np.float32)
+        data = (1 + np.log(pairs[:, 1].astype(np.float32))) * np.repeat(idf, lengths)
+
+        # L2-normalize each chunk (column) so long chunks don't dominate
+        norms = np.sqrt(np.bincount(indices, weights=data * data, minlength=n_chunks))
+        norms[norms == 0] = 1.0
+        data = (data / norms[indices]).astype(np.float32)
+
+        return cls(np.array(terms, dtype=str), idf, indptr, indices, data, n_chunks)
+
+    def search(
+        self, query: str, top_k: int = 5, exclude: Optional[List[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """Rank chunks by cosine similarity to the query.
+
+        Args:
+            query: Search query
+            top_k: Number of results to return
+            exclude: Positions never returned, such as tombstoned chunks
+
+        Returns:
+            List of ``(ordinal, score)`` tuples, best first
+        """
+        if self.n_chunks == 0 or len(self.vocab) == 0 or top_k <= 0:
+            return []
+
+        terms = np.array(sorted(set(tokenize(query))), dtype=str)
+        rows = np.searchsorted(self.vocab, terms)
+        found = rows < len(self.vocab)
+        found[found] = self.vocab[rows[found]] == terms[found]
+        rows = rows[found]
+        if len(rows) == 0:
+            return []
+
+        # Sparse mat-vec: gather the query's rows and sum weights per chunk
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        spans = [np.arange(s, e) for s, e in zip(starts, ends)]
+        positions = np.concatenate(spans)
+        weights = self.data[positions] * np.repeat(self.idf[rows], ends - starts)
+        scores = np.bincount(
+            self.indices[positions], weights=weights, minlength=self.n_chunks
+        )
+        if exclude:
+            scores[exclude] = 0.0
+
+        k = min(top_k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ordinal), float(scores[ordinal])) for ordinal in top]
+
+    def save(self, directory: Path):
+        """Write the matrix arrays as ``_tfidf_<name>.npy`` files in a directory."""
+        for name in self.ARRAYS:
+            value = np.int64(self.n_chunks) if name == "n_chunks" else getattr(self, name)
+            save_array(directory / f"_tfidf_{name}.npy", value)
+
+    @classmethod
+    def load(cls, directory: Path) -> "TfidfMatrix":
+        """Map a matrix previously written by :meth:`save`."""
+        if np is None:
+            raise ImportError("numpy not installed. Install with: pip install numpy")
+
+        arrays = {
+            name: load_array(directory / f"_tfidf_{name}.npy") for name in cls.ARRAYS
+        }
+        return cls(
+            arrays["vocab"],
+            arrays["idf"],
+            arrays["indptr"],
+            arrays["indices"],
+            arrays["data"],
+            int(arrays["n_chunks"]),
+        )
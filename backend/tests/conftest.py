@@ -1,4 +1,9 @@
 """Pytest configuration and shared fixtures for testing."""
+import json
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 from unittest.mock import Mock, MagicMock
 from langchain_core.messages import HumanMessage, AIMessage
@@ -91,3 +96,41 @@ def mock_cnb_response():
             }
         ]
     }
+
+
+def fake_embedding(text, dims=32):
+    """Embed text as a hashed bag of words."""
+    vector = [0.0] * dims
+    for word in text.lower().split():
+        vector[zlib.crc32(word.encode()) % dims] += 1.0
+    return vector
+
+
+@pytest.fixture
+def embedding_server():
+    """Run a local stand-in for the Ollama /api/embed endpoint."""
+    embedded_texts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            embedded_texts.extend(body["input"])
+            payload = json.dumps(
+                {"embeddings": [fake_embedding(t) for t in body["input"]]}
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.embedded_texts = embedded_texts
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
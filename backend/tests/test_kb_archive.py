@@ -0,0 +1,124 @@
+"""Tests for KB export/import archives."""
+import io
+import json
+import shutil
+import tarfile
+
+import pytest
+
+from agent.kb_archive import TRAILER_NAME, read_archive
+from agent.kb_manager import KnowledgeBaseManager
+from agent.kb_segments import SegmentedIndex
+
+
+def make_file(filename, text):
+    """Create an upload-like file object."""
+    file = io.BytesIO(text.encode("utf-8"))
+    file.filename = filename
+    return file
+
+
+def upload(manager, kb_id):
+    """Fill a KB with a few documents, one deleted."""
+    manager.create_knowledge_base(kb_id, "Docs KB")
+    result = manager.upload_documents(
+        kb_id,
+        [
+            make_file("pools.md", "Runner pools scale with queued jobs."),
+            make_file("cache.md", "The build cache is keyed by lockfile hash."),
+            make_file("old.md", "Legacy runners are retired."),
+        ],
+    )
+    manager.delete_document(kb_id, result["processed_documents"][2]["doc_id"])
+    manager.compactor.join(timeout=10)
+
+
+class TestArchiveRoundTrip:
+    """Test suite for replicating KBs through archives."""
+
+    @pytest.mark.parametrize("backend", ["native", "sqlite"])
+    def test_import_serves_same_results(self, tmp_path, backend):
+        """Test that an imported KB answers queries like the exported one."""
+        source = KnowledgeBaseManager(storage_dir=str(tmp_path / "a"), storage_backend=backend)
+        upload(source, "custom_docs")
+        archive = tmp_path / "custom_docs.kbz"
+
+        stats = source.export_knowledge_base("custom_docs", archive)
+
+        replica = KnowledgeBaseManager(storage_dir=str(tmp_path / "b"))
+        kb_metadata = replica.import_knowledge_base(archive)
+        assert stats["bytes"] == archive.stat().st_size and stats["files"] > 0
+        assert kb_metadata["document_count"] == 2
+        assert replica.list_knowledge_bases()[0]["storage_backend"] == backend
+        for query in ("runner pools", "cache lockfile", "legacy"):
+            assert replica.query_knowledge_base("custom_docs", query) == (
+                source.query_knowledge_base("custom_docs", query)
+            )
+
+    def test_segments_are_mapped_not_rebuilt(self, tmp_path):
+        """Test that imported segments keep their postings files and names."""
+        source = KnowledgeBaseManager(storage_dir=str(tmp_path / "a"))
+        upload(source, "custom_docs")
+        source.export_knowledge_base("custom_docs", tmp_path / "kb.kbz")
+
+        replica = KnowledgeBaseManager(storage_dir=str(tmp_path / "b"))
+        replica.import_knowledge_base(tmp_path / "kb.kbz", kb_id="custom_copy")
+
+        exported = SegmentedIndex.load(tmp_path / "a" / "custom_docs")
+        imported = SegmentedIndex.load(tmp_path / "b" / "custom_copy")
+        assert [s.name for s in imported.segments] == [s.name for s in exported.segments]
+        assert all(segment.index.mapped for segment in imported.segments)
+        with pytest.raises(ValueError):
+            replica.import_knowledge_base(tmp_path / "kb.kbz", kb_id="custom_copy")
+
+    def test_older_format_is_upgraded_before_export(self, tmp_path):
+        """Test that a KB not yet split into segments is exported as segments."""
+        source = KnowledgeBaseManager(storage_dir=str(tmp_path / "a"))
+        upload(source, "custom_docs")
+        kb_dir = tmp_path / "a" / "custom_docs"
+        for path in kb_dir.glob("seg_*"):
+            shutil.rmtree(path)
+        (kb_dir / SegmentedIndex.MANIFEST_FILENAME).unlink()
+
+        source.export_knowledge_base("custom_docs", tmp_path / "kb.kbz")
+
+        replica = KnowledgeBaseManager(storage_dir=str(tmp_path / "b"))
+        replica.import_knowledge_base(tmp_path / "kb.kbz")
+        result = replica.query_knowledge_base("custom_docs", "runner pools")
+        assert result["results"][0]["metadata"]["filename"] == "pools.md"
+
+
+class TestArchiveVerification:
+    """Test suite for rejecting damaged archives."""
+
+    def write_tar(self, path, files, checksums):
+        """Write a gzip tar archive with a hand-made trailer."""
+        trailer = json.dumps(
+            {"format": 1, "metadata": {"id": "custom_bad"}, "files": checksums}
+        ).encode()
+        with tarfile.open(path, "w:gz") as tar:
+            for name, data in [*files.items(), (TRAILER_NAME, trailer)]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+    def test_checksum_mismatch_imports_nothing(self, tmp_path):
+        """Test that a file not matching the trailer fails the whole import."""
+        archive = tmp_path / "bad.kbz"
+        self.write_tar(archive, {"a.chunks": b"tampered"}, {"a.chunks": "0" * 64})
+        manager = KnowledgeBaseManager(storage_dir=str(tmp_path / "kbs"))
+
+        with pytest.raises(ValueError, match="checksum"):
+            manager.import_knowledge_base(archive)
+
+        assert manager.list_knowledge_bases() == []
+        assert list((tmp_path / "kbs").iterdir()) == []
+
+    def test_rejects_paths_outside_the_kb(self, tmp_path):
+        """Test that members escaping the KB directory are refused."""
+        archive = tmp_path / "evil.kbz"
+        self.write_tar(archive, {"../escape.txt": b"x"}, {})
+
+        with open(archive, "rb") as f, pytest.raises(ValueError, match="Unsafe"):
+            read_archive(f, tmp_path / "out")
+        assert not (tmp_path / "escape.txt").exists()
@@ -0,0 +1,77 @@
+"""Tests for bulk directory ingestion."""
+import pytest
+
+from agent.kb_ingest import IngestManifest, ingest_directory, main
+from agent.kb_manager import KnowledgeBaseManager
+
+
+@pytest.fixture
+def docs(tmp_path):
+    """Create a small documentation tree."""
+    root = tmp_path / "docs"
+    (root / "guide").mkdir(parents=True)
+    (root / ".git").mkdir()
+    (root / "index.md").write_text("runner pools and caching")
+    (root / "guide" / "deploy.txt").write_text("deploy pipelines to staging")
+    (root / "guide" / "copy.txt").write_text("deploy pipelines to staging")
+    (root / "logo.png").write_bytes(b"\x89PNG")
+    (root / ".git" / "HEAD.txt").write_text("ref: main")
+    return root
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """Create a KB manager backed by a temporary directory."""
+    kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path / "kbs"))
+    kb_manager.create_knowledge_base("custom_docs", "Docs KB")
+    return kb_manager
+
+
+class TestIngestDirectory:
+    """Test suite for directory ingestion with a resumable manifest."""
+
+    def test_ingests_matching_files_under_relative_names(self, manager, docs):
+        """Test that supported, non-hidden files are ingested and recorded."""
+        stats = ingest_directory(manager, "custom_docs", docs, batch_size=2)
+
+        assert (stats["ingested"], stats["duplicates"], stats["errors"]) == (2, 1, 0)
+        assert stats["bytes"] > 0 and stats["files_per_sec"] > 0
+        filenames = {
+            doc["filename"]
+            for doc in manager.index["knowledge_bases"]["custom_docs"]["documents"].values()
+        }
+        assert filenames == {"index.md", "guide/copy.txt"}
+        manifest = IngestManifest(manager.storage_dir / "custom_docs" / IngestManifest.FILENAME)
+        assert set(manifest.entries) == {"index.md", "guide/copy.txt", "guide/deploy.txt"}
+
+    def test_rerun_resumes_and_picks_up_changes(self, manager, docs):
+        """Test that recorded files are skipped and changed files re-read."""
+        ingest_directory(manager, "custom_docs", docs)
+        manifest_path = manager.storage_dir / "custom_docs" / IngestManifest.FILENAME
+        with open(manifest_path, "a", encoding="utf-8") as f:
+            f.write('{"path": "torn')
+        (docs / "index.md").write_text("runner pools, caching and autoscaling")
+
+        stats = ingest_directory(manager, "custom_docs", docs)
+
+        assert (stats["resumed"], stats["ingested"]) == (2, 1)
+        result = manager.query_knowledge_base("custom_docs", "autoscaling")
+        assert result["results"][0]["metadata"]["filename"] == "index.md"
+
+    def test_cli_creates_kb_and_reports_throughput(self, tmp_path, docs, capsys):
+        """Test the command-line entry point."""
+        main(["custom_cli", str(docs), "--storage-dir", str(tmp_path / "cli"), "--create", "CLI"])
+
+        output = capsys.readouterr().out
+        assert "2 ingested, 1 duplicates" in output
+        assert "files/sec" in output and "MB/sec" in output
+
+    def test_cli_sync_mirrors_directory(self, tmp_path, docs, capsys):
+        """Test that --sync deletes documents of removed files."""
+        storage = str(tmp_path / "cli")
+        main(["custom_cli", str(docs), "--storage-dir", storage, "--create", "CLI"])
+        (docs / "index.md").unlink()
+
+        main(["custom_cli", str(docs), "--storage-dir", storage, "--sync"])
+
+        assert "0 added, 0 updated, 1 removed" in capsys.readouterr().out
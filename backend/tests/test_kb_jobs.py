@@ -0,0 +1,83 @@
+"""Tests for background knowledge base ingestion jobs."""
+import queue
+
+import pytest
+
+from agent.kb_jobs import IngestionJobQueue
+from agent.kb_manager import KnowledgeBaseManager
+from tests.test_kb_manager import make_file
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """Create a KB manager backed by a temporary directory."""
+    kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path))
+    kb_manager.create_knowledge_base("custom_jobs", "Jobs KB")
+    return kb_manager
+
+
+class TestIngestionJobQueue:
+    """Test suite for the background ingestion queue."""
+
+    def test_job_reports_per_file_progress(self, manager):
+        """Test that a finished job reports every file, chunks and throughput."""
+        jobs = IngestionJobQueue(manager, publish_interval=0)
+        spooled, errors = manager.spool_uploads(
+            [make_file("a.txt", "first document"), make_file("b.txt", "second document")]
+        )
+
+        job = jobs.submit("custom_jobs", spooled, errors)
+        jobs.join()
+        status = jobs.get(job.id).to_dict()
+
+        assert status["status"] == "completed"
+        assert status["files_done"] == 2
+        assert [f["status"] for f in status["files"]] == ["success", "success"]
+        assert status["chunks"] == 2
+        assert set(status["throughput"]) == {"files_per_sec", "mb_per_sec", "chunks_per_sec"}
+        result = manager.query_knowledge_base("custom_jobs", "second")
+        assert result["results"][0]["chunk"] == "second document"
+
+    def test_incremental_publish_makes_documents_queryable(self, manager):
+        """Test that finished documents are visible before the job completes."""
+        seen = []
+
+        def check_visible(doc_index, status):
+            if doc_index == 1 and status["status"] == "processing":
+                seen.extend(manager.query_knowledge_base("custom_jobs", "first")["results"])
+
+        spooled, _ = manager.spool_uploads(
+            [make_file("a.txt", "first document"), make_file("b.txt", "second document")]
+        )
+        manager.ingest_spooled("custom_jobs", spooled, on_progress=check_visible, publish_interval=0)
+
+        assert seen and seen[0]["chunk"] == "first document"
+
+    def test_full_queue_rejects_jobs(self, manager):
+        """Test that submissions beyond the bound raise queue.Full."""
+        jobs = IngestionJobQueue(manager, max_queued=1)
+        jobs._ensure_worker = lambda: None  # keep the job queued
+
+        jobs.submit("custom_jobs", [], [])
+        with pytest.raises(queue.Full):
+            jobs.submit("custom_jobs", [], [])
+
+    def test_unknown_job_raises(self, manager):
+        """Test that polling an unknown job raises ValueError."""
+        with pytest.raises(ValueError):
+            IngestionJobQueue(manager).get("missing")
+
+    def test_other_workers_report_the_job(self, manager, tmp_path):
+        """Test that a worker process sharing the storage reports another's job."""
+        jobs = IngestionJobQueue(manager, publish_interval=0)
+        spooled, errors = manager.spool_uploads([make_file("a.txt", "first document")])
+
+        job = jobs.submit("custom_jobs", spooled, errors)
+        jobs.join()
+
+        other = IngestionJobQueue(KnowledgeBaseManager(storage_dir=str(tmp_path)))
+        status = other.status(job.id)
+        assert status["status"] == "completed"
+        assert [f["status"] for f in status["files"]] == ["success"]
+        with pytest.raises(ValueError):
+            other.status("../index")
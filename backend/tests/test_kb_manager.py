@@ -0,0 +1,1264 @@
+"""Tests for custom knowledge base management."""
+import io
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from agent.configuration import Configuration
+from agent.kb_manager import DICTIONARY_FILENAME, KnowledgeBaseManager
+from agent.kb_analyzer import ANALYZER, analyze
+from agent.kb_index import BM25Index, MappedPostings, MappedStrings
+from agent.kb_segments import Segment, SegmentMerge, SegmentedIndex
+from agent.kb_sqlite import SqliteKnowledgeBase
+from agent.kb_cache import KBCache, QueryCache
+from agent.kb_chunker import TokenChunker, count_words, get_token_counter
+from agent.kb_chunks import BLOCK_SIZE, ChunkStore, ChunkStoreWriter, train_dictionary
+from agent.kb_tfidf import TfidfMatrix
+from agent.kb_embeddings import VectorStore, normalize
+from agent.kb_ivf import IVFIndex
+from agent.kb_extract import ExtractionPipeline
+
+
+def make_file(filename, text):
+    """Create an upload-like file object."""
+    file = io.BytesIO(text.encode("utf-8"))
+    file.filename = filename
+    return file
+
+
+def index_document(index, doc_id, chunks):
+    """Index a document's chunks the way ingestion does, deduplicating repeats."""
+    first_ordinal = len(index)
+    for i, chunk in enumerate(chunks):
+        ordinal = index.find_chunk(chunk)
+        if ordinal is None:
+            index.add_chunk(f"{doc_id}_{i}", chunk)
+        else:
+            index.add_reference(ordinal, f"{doc_id}_{i}")
+    index.documents[doc_id] = [first_ordinal, len(index) - first_ordinal]
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """Create a KB manager backed by a temporary directory."""
+    kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path))
+    kb_manager.create_knowledge_base("custom_test", "Test KB")
+    return kb_manager
+
+
+class TestBM25Index:
+    """Test suite for the BM25 inverted index."""
+
+    def test_rare_terms_rank_higher(self):
+        """Test that chunks matching rarer query terms score higher."""
+        index = BM25Index()
+        index_document(index, "a", ["the cat sat on the mat"])
+        index_document(index, "b", ["the dog chased the cat"])
+        index_document(index, "c", ["the bird sang"])
+
+        ranked = index.search("dog cat", top_k=3)
+
+        assert [index.chunk_ids[o] for o, _ in ranked] == ["b_0", "a_0"]
+
+    def test_save_and_load_roundtrip(self, tmp_path):
+        """Test that a legacy JSON index returns identical rankings."""
+        index = BM25Index()
+        index_document(index, "a", ["alpha beta", "beta gamma"])
+        path = tmp_path / BM25Index.FILENAME
+        path.write_text(json.dumps(index.to_dict()), encoding="utf-8")
+
+        loaded = BM25Index.load(path)
+
+        assert loaded.search("beta", top_k=5) == index.search("beta", top_k=5)
+        assert loaded.has_document("a")
+
+
+class TestQueryKnowledgeBase:
+    """Test suite for querying custom knowledge bases."""
+
+    def test_query_returns_matching_chunks(self, manager):
+        """Test that queries return matching chunks with sources."""
+        manager.upload_documents(
+            "custom_test",
+            [
+                make_file("cats.txt", "Cats are small carnivorous mammals."),
+                make_file("rust.md", "Rust is a systems programming language."),
+            ],
+        )
+
+        result = manager.query_knowledge_base("custom_test", "rust language")
+
+        assert len(result["results"]) == 1
+        assert "systems programming" in result["results"][0]["chunk"]
+        assert result["sources"][0]["title"] == "rust.md"
+
+    def test_index_written_on_upload(self, manager, tmp_path):
+        """Test that uploads persist the inverted index next to the chunks."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "hello world")])
+
+        assert SegmentedIndex.exists(tmp_path / "custom_test")
+
+    def test_reupload_does_not_duplicate_results(self, manager):
+        """Test that uploading the same document twice indexes it once."""
+        for _ in range(2):
+            manager.upload_documents("custom_test", [make_file("a.txt", "hello world")])
+
+        result = manager.query_knowledge_base("custom_test", "hello", top_k=5)
+
+        assert len(result["results"]) == 1
+
+    def test_unknown_kb_raises(self, manager):
+        """Test that querying a missing knowledge base raises ValueError."""
+        with pytest.raises(ValueError):
+            manager.query_knowledge_base("custom_missing", "anything")
+
+
+class TestKBCache:
+    """Test suite for the loaded-KB cache."""
+
+    def test_version_mismatch_misses(self):
+        """Test that a lookup with a different version stamp misses."""
+        cache = KBCache(max_bytes=100)
+        cache.put("kb", 1, "loaded", size=10)
+
+        assert cache.get("kb", 1) == "loaded"
+        assert cache.get("kb", 2) is None
+
+    def test_evicts_least_recently_used(self):
+        """Test that cold KBs are evicted once the budget is exceeded."""
+        cache = KBCache(max_bytes=100)
+        cache.put("a", 1, "A", size=40)
+        cache.put("b", 1, "B", size=40)
+        cache.get("a", 1)
+        cache.put("c", 1, "C", size=40)
+
+        assert "a" in cache and "c" in cache
+        assert "b" not in cache
+        assert cache.current_bytes == 80
+
+
+class TestQueryCache:
+    """Test suite for the query result cache."""
+
+    def test_lru_and_ttl(self):
+        """Test LRU eviction, expiry and hit/miss counters."""
+        cache = QueryCache(max_entries=2, ttl_seconds=60)
+        cache.put(("kb", "a"), [1])
+        cache.put(("kb", "b"), [2])
+        cache.get(("kb", "a"))
+        cache.put(("kb", "c"), [3])
+
+        assert cache.get(("kb", "b")) is None
+        assert cache.get(("kb", "a")) == [1]
+        with patch("agent.kb_cache.time.monotonic", return_value=time.monotonic() + 61):
+            assert cache.get(("kb", "c")) is None
+        assert (cache.hits, cache.misses) == (2, 2)
+
+    def test_manager_reuses_results_until_kb_changes(self, manager):
+        """Test that repeated queries hit and uploads invalidate the KB's results."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha notes")])
+
+        first = manager.query_knowledge_base("custom_test", "Alpha  notes")
+        with patch.object(manager, "_search", side_effect=AssertionError):
+            assert manager.query_knowledge_base("custom_test", "alpha notes") == first
+
+        manager.upload_documents("custom_test", [make_file("b.txt", "alpha alpha")])
+        result = manager.query_knowledge_base("custom_test", "alpha notes")
+
+        assert len(result["results"]) == 2
+        assert manager.query_cache_stats()["hits"] == 1
+
+
+class TestLoadedKnowledgeBaseCache:
+    """Test suite for KB caching inside the manager."""
+
+    def test_warm_search_does_not_read_chunk_files(self, manager, tmp_path):
+        """Test that a cached KB is scored without touching chunk stores."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "hello world")])
+        manager.query_knowledge_base("custom_test", "hello")
+
+        for doc_file in (tmp_path / "custom_test").glob("*.chunks"):
+            doc_file.unlink()
+
+        assert len(manager.search_chunks("custom_test", "hello")) == 1
+
+    def test_upload_bumps_version(self, manager):
+        """Test that uploads invalidate the cached KB."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "hello world")])
+        manager.query_knowledge_base("custom_test", "hello")
+        manager.upload_documents("custom_test", [make_file("b.txt", "hello again")])
+
+        result = manager.query_knowledge_base("custom_test", "hello")
+
+        assert manager.index["knowledge_bases"]["custom_test"]["version"] == 2
+        assert len(result["results"]) == 2
+
+
+class TestTfidfScoring:
+    """Test suite for the vectorized TF-IDF engine."""
+
+    def test_matches_expected_ranking(self):
+        """Test that the sparse product ranks the best-matching chunk first."""
+        index = BM25Index()
+        index_document(index, "a", ["apple banana", "banana banana cherry", "durian"])
+        matrix = TfidfMatrix.from_bm25_index(index)
+
+        ranked = matrix.search("banana cherry", top_k=5)
+
+        assert [o for o, _ in ranked] == [1, 0]
+        assert matrix.search("unknownterm") == []
+
+    def test_tfidf_knowledge_base(self, tmp_path):
+        """Test that a KB created in tfidf mode persists and uses the matrix."""
+        kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path))
+        kb_manager.create_knowledge_base("custom_tfidf", "TF-IDF KB", scoring_mode="tfidf")
+        kb_manager.upload_documents(
+            "custom_tfidf",
+            [make_file("a.txt", "vector search"), make_file("b.txt", "keyword search")],
+        )
+
+        result = kb_manager.query_knowledge_base("custom_tfidf", "vector search")
+
+        assert list((tmp_path / "custom_tfidf").glob(f"seg_*/{TfidfMatrix.FILENAME}"))
+        assert result["results"][0]["chunk"] == "vector search"
+        assert len(result["results"]) == 2
+
+    def test_unknown_scoring_mode_rejected(self, manager):
+        """Test that unknown scoring modes raise ValueError."""
+        with pytest.raises(ValueError):
+            manager.create_knowledge_base("custom_bad", "Bad", scoring_mode="magic")
+
+
+class TestVectorScoring:
+    """Test suite for dense-vector retrieval via Ollama embeddings."""
+
+    @pytest.fixture
+    def vector_manager(self, tmp_path, embedding_server):
+        """Create a KB manager whose embeddings come from the stand-in server."""
+        config = Configuration(ollama_base_url=embedding_server.base_url)
+        kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path), config=config)
+        kb_manager.create_knowledge_base("custom_vec", "Vector KB", scoring_mode="vector")
+        return kb_manager
+
+    def test_vector_query_ranks_by_similarity(self, vector_manager, tmp_path):
+        """Test that vector KBs store a matrix and rank by cosine similarity."""
+        vector_manager.upload_documents(
+            "custom_vec",
+            [
+                make_file("a.txt", "graph neural networks"),
+                make_file("b.txt", "cooking pasta recipes"),
+            ],
+        )
+
+        result = vector_manager.query_knowledge_base("custom_vec", "pasta recipes", top_k=1)
+
+        assert list((tmp_path / "custom_vec").glob("seg_*/_embeddings.npy"))
+        assert result["results"][0]["chunk"] == "cooking pasta recipes"
+
+    def test_reupload_is_not_reembedded(self, vector_manager, embedding_server):
+        """Test that known chunk content is served from the embedding cache."""
+        vector_manager.create_knowledge_base("custom_vec2", "Vector KB 2", scoring_mode="vector")
+        vector_manager.upload_documents("custom_vec", [make_file("a.txt", "shared text")])
+        vector_manager.upload_documents("custom_vec2", [make_file("a.txt", "shared text")])
+
+        assert embedding_server.embedded_texts == ["shared text"]
+
+    def test_other_embedding_model_is_rejected(self, vector_manager, tmp_path, embedding_server):
+        """Test that a KB is not searched or extended with another model's vectors."""
+        vector_manager.upload_documents("custom_vec", [make_file("a.txt", "graph networks")])
+        config = Configuration(
+            ollama_base_url=embedding_server.base_url, embedding_model="other-embed"
+        )
+        switched = KnowledgeBaseManager(storage_dir=str(tmp_path), config=config)
+
+        assert switched.published["custom_vec"]["embedding_dim"] > 0
+        with pytest.raises(ValueError, match="embedded with"):
+            switched.query_knowledge_base("custom_vec", "graph")
+        with pytest.raises(ValueError, match="embedded with"):
+            switched.upload_documents("custom_vec", [make_file("b.txt", "more text")])
+
+
+class TestIVFIndex:
+    """Test suite for the IVF approximate nearest-neighbour index."""
+
+    @pytest.fixture
+    def vectors(self):
+        """Create normalized random vectors."""
+        rng = np.random.default_rng(42)
+        return normalize(rng.normal(size=(2000, 16)).astype(np.float32))
+
+    def test_full_probe_matches_brute_force(self, vectors):
+        """Test that probing every list returns the exact top-k."""
+        index = IVFIndex.build(vectors, nlist=16)
+        index.nprobe = 16
+        query = vectors[7]
+
+        assert index.search(vectors, query, top_k=5) == VectorStore.search(
+            vectors, query, top_k=5
+        )
+
+    def test_ivf_knowledge_base(self, tmp_path, embedding_server):
+        """Test that an ivf-mode KB writes lists and answers queries."""
+        config = Configuration(ollama_base_url=embedding_server.base_url, kb_ivf_nprobe=64)
+        kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path), config=config)
+        kb_manager.create_knowledge_base("custom_ivf", "IVF KB", scoring_mode="ivf")
+        kb_manager.upload_documents(
+            "custom_ivf",
+            [make_file(f"{i}.txt", f"topic{i} words") for i in range(20)],
+        )
+
+        result = kb_manager.query_knowledge_base("custom_ivf", "topic3 words", top_k=1)
+
+        assert list((tmp_path / "custom_ivf").glob(f"seg_*/{IVFIndex.LISTS_FILENAME}"))
+        assert result["results"][0]["chunk"] == "topic3 words"
+
+
+class TestStreamingIngestion:
+    """Test suite for spooled, streaming document ingestion."""
+
+    def test_chunking_is_independent_of_piece_boundaries(self, manager):
+        """Test that streamed pieces chunk exactly like the whole text."""
+        text = " ".join(f"Sentence number {i} ends here." for i in range(400))
+        pieces = [text[i : i + 37] for i in range(0, len(text), 37)]
+
+        streamed = list(manager._iter_chunks(pieces, chunk_size=50, overlap=5))
+
+        assert streamed == manager._chunk_text(text, chunk_size=50, overlap=5)
+        assert len(streamed) > 1
+
+    def test_reads_underlying_file_of_uploads(self, manager):
+        """Test that FastAPI-style uploads are read through their sync file."""
+        upload = SimpleNamespace(filename="doc.md", file=io.BytesIO(b"spooled upload text"))
+
+        result = manager.upload_documents("custom_test", [upload])
+
+        assert result["processed_documents"][0]["status"] == "success"
+        query = manager.query_knowledge_base("custom_test", "spooled")
+        assert query["results"][0]["metadata"]["total_chunks"] == 1
+
+    def test_failed_document_is_rolled_back(self, manager, tmp_path):
+        """Test that a failure mid-document leaves no chunks or postings behind."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "kept text")])
+
+        def failing_chunks(text_stream):
+            yield "lost text"
+            raise RuntimeError("boom")
+
+        with patch.object(manager, "_iter_chunks", side_effect=failing_chunks):
+            result = manager.upload_documents("custom_test", [make_file("b.txt", "lost text")])
+
+        assert result["processed_documents"][0]["status"] == "error"
+        assert manager.query_knowledge_base("custom_test", "lost")["results"] == []
+        assert not list((tmp_path / "custom_test").glob("*.tmp"))
+        assert not list((tmp_path / "_spool").iterdir())
+
+
+class TestTokenChunker:
+    """Test suite for token-sized chunking."""
+
+    def test_chunks_fit_token_budget(self):
+        """Test that chunks stay within budget, cutting overlong sentences."""
+        chunker = TokenChunker(chunk_tokens=20, overlap_tokens=4, count_tokens=count_words)
+        text = "short one. " + " ".join(f"w{i}" for i in range(50)) + ". tail end."
+
+        chunks = list(chunker.chunks([text]))
+
+        assert all(count_words(chunk) <= 20 for chunk in chunks)
+        assert chunks[0] == "short one"
+        assert chunks[-1].endswith("tail end.")
+
+    def test_overlap_repeats_trailing_tokens(self):
+        """Test that each chunk starts with the previous chunk's last tokens."""
+        chunker = TokenChunker(chunk_tokens=10, overlap_tokens=3, count_tokens=count_words)
+        text = " ".join(f"Sentence {i} has five words." for i in range(10))
+
+        chunks = [chunk.split() for chunk in chunker.chunks([text])]
+
+        for previous, current in zip(chunks, chunks[1:]):
+            assert current[:3] == previous[-3:]
+
+    def test_text_without_whitespace_is_cut(self, monkeypatch):
+        """Test that a stream with no whitespace is cut at a fixed length."""
+        monkeypatch.setattr("agent.kb_chunker.MAX_PENDING_SENTENCE_CHARS", 100)
+        chunker = TokenChunker(chunk_tokens=2, overlap_tokens=0, count_tokens=count_words)
+        pieces = ["x" * 40 for _ in range(50)]
+
+        chunks = list(chunker.chunks(pieces))
+
+        assert all(len(word) <= 100 for chunk in chunks for word in chunk.split())
+        assert "".join(chunk.replace(" ", "") for chunk in chunks) == "".join(pieces)
+
+    def test_unknown_tokenizer_raises(self):
+        """Test that an unknown tokenizer setting is rejected."""
+        with pytest.raises(ValueError):
+            get_token_counter("sentencepiece")
+
+
+def slow_pages(delay, pages):
+    """Return pages after a delay, simulating a slow extraction task."""
+    time.sleep(delay)
+    return pages
+
+
+class TestParallelExtraction:
+    """Test suite for pooled document extraction."""
+
+    def test_results_reassembled_in_order(self, tmp_path):
+        """Test that out-of-order task completion still yields ordered text."""
+        tasks = {
+            "a.pdf": [(slow_pages, (0.2, ["a1 "])), (slow_pages, (0.0, ["a2 "]))],
+            "b.pdf": [(slow_pages, (0.0, ["b1 "]))],
+        }
+        documents = [(tmp_path / name, ".pdf") for name in tasks]
+
+        with patch("agent.kb_extract.plan_tasks", side_effect=lambda p, e: tasks[p.name]):
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                pipeline = ExtractionPipeline(documents, pool, max_in_flight=3)
+                texts = ["".join(pipeline.iter_text(i)) for i in range(2)]
+
+        assert texts == ["a1 a2 ", "b1 "]
+
+    def test_docx_upload_through_pool(self, manager):
+        """Test that DOCX uploads are extracted via the pool and indexed."""
+        docx = pytest.importorskip("docx")
+        buffer = io.BytesIO()
+        document = docx.Document()
+        document.add_paragraph("Quarterly revenue grew strongly.")
+        document.save(buffer)
+        buffer.seek(0)
+        buffer.filename = "report.docx"
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            with patch.object(manager, "_get_extract_pool", return_value=pool):
+                manager.upload_documents("custom_test", [buffer])
+
+        result = manager.query_knowledge_base("custom_test", "revenue")
+        assert "Quarterly revenue grew strongly" in result["results"][0]["chunk"]
+
+
+class TestDeduplication:
+    """Test suite for content-addressed document and chunk deduplication."""
+
+    def test_known_document_is_skipped_before_extraction(self, manager):
+        """Test that re-uploaded content is skipped without being chunked."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "hello world")])
+
+        with patch.object(manager, "_iter_chunks") as iter_chunks:
+            result = manager.upload_documents("custom_test", [make_file("copy.txt", "hello world")])
+
+        iter_chunks.assert_not_called()
+        assert result["processed_documents"][0]["status"] == "skipped"
+        assert result["processed_documents"][0]["duplicate_of"] == "a.txt"
+
+    def test_shared_chunk_is_indexed_once(self, manager, tmp_path):
+        """Test that identical chunk text is stored once and cites every document."""
+        manager.upload_documents(
+            "custom_test",
+            [
+                make_file("a.txt", "Licensed under the Apache License."),
+                make_file("b.txt", "Licensed  under the Apache License."),
+            ],
+        )
+
+        result = manager.query_knowledge_base("custom_test", "apache license", top_k=5)
+
+        assert len(result["results"]) == 1
+        assert result["results"][0]["metadata"]["also_in"] == ["b.txt"]
+        assert [s["title"] for s in result["sources"]] == ["a.txt", "b.txt"]
+        assert manager.list_knowledge_bases()[0]["chunk_count"] == 1
+
+    def test_deleted_document_uploaded_again_keeps_text(self, manager):
+        """Test that re-uploading a deleted document keeps the chunks others share."""
+        text = "Licensed under the Apache License."
+        result = manager.upload_documents(
+            "custom_test", [make_file("a.txt", text), make_file("b.txt", text.replace(" ", "  ", 1))]
+        )
+        manager.delete_document("custom_test", result["processed_documents"][0]["doc_id"])
+
+        manager.upload_documents("custom_test", [make_file("a.txt", text)])
+
+        hits = manager.query_knowledge_base("custom_test", "apache license")["results"]
+        assert [hit["chunk"] for hit in hits] == [text]
+        assert hits[0]["metadata"]["filename"] == "a.txt"
+
+    def test_truncate_drops_references(self):
+        """Test that rolling back the index also drops the references it added."""
+        index = BM25Index()
+        index_document(index, "a", ["shared text"])
+        index_document(index, "b", ["shared text", "own text"])
+
+        index.truncate(1, n_references=0)
+
+        assert index.references == []
+        assert index.find_chunk("own text") is None
+        assert index.has_document("a") and not index.has_document("b")
+
+
+class TestDocumentDeletion:
+    """Test suite for document deletes, replacement and compaction."""
+
+    @pytest.fixture
+    def manager(self, tmp_path, embedding_server):
+        """Create a vector KB manager that never compacts on its own."""
+        config = Configuration(
+            ollama_base_url=embedding_server.base_url, kb_compaction_ratio=2.0
+        )
+        kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path), config=config)
+        kb_manager.create_knowledge_base("custom_test", "Test KB", scoring_mode="vector")
+        return kb_manager
+
+    def upload(self, manager, *files):
+        """Upload files and return their document IDs by filename."""
+        result = manager.upload_documents("custom_test", list(files))
+        return {doc["filename"]: doc["doc_id"] for doc in result["processed_documents"]}
+
+    def test_delete_is_immediate_and_compaction_reclaims(self, manager, tmp_path):
+        """Test that deleted chunks vanish at once and are dropped by compaction."""
+        doc_ids = self.upload(
+            manager, make_file("a.txt", "alpha notes"), make_file("b.txt", "beta notes")
+        )
+
+        manager.delete_document("custom_test", doc_ids["a.txt"])
+
+        for engine in ("lexical", "vector"):
+            result = manager.query_knowledge_base("custom_test", "alpha notes", engine=engine)
+            assert [r["chunk"] for r in result["results"]] == ["beta notes"]
+        assert (tmp_path / "custom_test" / f"{doc_ids['a.txt']}.chunks").exists()
+
+        manager.compact_knowledge_base("custom_test")
+
+        index = SegmentedIndex.load(tmp_path / "custom_test")
+        [segment] = index.segments
+        assert list(segment.index.chunk_ids) == [f"{doc_ids['b.txt']}_0"] and not index.deleted
+        assert len(VectorStore.load(tmp_path / "custom_test" / segment.name / VectorStore.FILENAME)) == 1
+        assert not (tmp_path / "custom_test" / f"{doc_ids['a.txt']}.chunks").exists()
+        result = manager.query_knowledge_base("custom_test", "beta", engine="vector")
+        assert result["results"][0]["chunk"] == "beta notes"
+
+    def test_scorers_mask_tombstones(self, manager):
+        """Test that tombstoned chunks are masked inside the scorers, not over-fetched."""
+        doc_ids = self.upload(
+            manager,
+            *[make_file(f"{i}.txt", f"alpha alpha report {i}") for i in range(5)],
+            make_file("live.txt", "alpha report live"),
+        )
+        manager.delete_documents("custom_test", [doc_ids[f"{i}.txt"] for i in range(5)])
+        loaded = manager._get_loaded_kb("custom_test")
+        [segment] = loaded.segments
+
+        assert len(loaded.excluded[segment.segment.name]) == 5
+        with patch.object(BM25Index, "search", wraps=segment.segment.index.search) as search:
+            assert [o for o, _ in loaded.lexical_search("alpha", top_k=1)] == [5]
+        assert search.call_args.kwargs["top_k"] == 1
+        for engine in ("lexical", "vector"):
+            result = manager.query_knowledge_base("custom_test", "alpha", top_k=3, engine=engine)
+            assert [r["chunk"] for r in result["results"]] == ["alpha report live"]
+
+    def test_shared_chunk_survives_owner_deletion(self, manager):
+        """Test that a deduplicated chunk stays searchable via its other documents."""
+        doc_ids = self.upload(
+            manager,
+            make_file("a.txt", "Licensed under the Apache License."),
+            make_file("b.txt", "Licensed  under the Apache License."),
+        )
+
+        manager.delete_document("custom_test", doc_ids["a.txt"])
+        before = manager.query_knowledge_base("custom_test", "apache")
+        manager.compact_knowledge_base("custom_test")
+        after = manager.query_knowledge_base("custom_test", "apache")
+
+        for result in (before, after):
+            assert result["results"][0]["metadata"]["filename"] == "b.txt"
+            assert [s["title"] for s in result["sources"]] == ["b.txt"]
+
+    def test_replace_swaps_documents(self, manager):
+        """Test that ingesting with ``replaces`` removes the old document."""
+        doc_ids = self.upload(manager, make_file("a.txt", "stale release notes"))
+        spooled, _ = manager.spool_uploads([make_file("a.txt", "fresh release notes")])
+
+        manager.ingest_spooled("custom_test", spooled, replaces=doc_ids["a.txt"])
+
+        result = manager.query_knowledge_base("custom_test", "release notes", top_k=5)
+        assert [r["chunk"] for r in result["results"]] == ["fresh release notes"]
+        assert doc_ids["a.txt"] not in manager.index["knowledge_bases"]["custom_test"]["documents"]
+
+    def test_threshold_schedules_background_compaction(self, manager, tmp_path):
+        """Test that passing the tombstone ratio compacts the KB in the background."""
+        manager.config.kb_compaction_ratio = 0.5
+        doc_ids = self.upload(manager, make_file("a.txt", "alpha"), make_file("b.txt", "beta"))
+
+        manager.delete_document("custom_test", doc_ids["a.txt"])
+
+        assert manager.compactor.join(timeout=10)
+        index = SegmentedIndex.load(tmp_path / "custom_test")
+        assert [len(segment) for segment in index.segments] == [1]
+
+    def test_unknown_document_raises(self, manager):
+        """Test that deleting a missing document raises ValueError."""
+        with pytest.raises(ValueError):
+            manager.delete_document("custom_test", "missing")
+
+
+class TestDirectorySync:
+    """Test suite for syncing a KB with a source directory."""
+
+    @pytest.fixture
+    def docs(self, tmp_path):
+        """Create a small source tree."""
+        root = tmp_path / "docs"
+        (root / "guide").mkdir(parents=True)
+        (root / "index.md").write_text("runner pools and caching")
+        (root / "guide" / "deploy.txt").write_text("deploy pipelines to staging")
+        (root / "guide" / "old.txt").write_text("legacy notes")
+        return root
+
+    def filenames(self, manager):
+        """Return the filenames of the KB's documents."""
+        documents = manager.index["knowledge_bases"]["custom_test"]["documents"]
+        return sorted(doc["filename"] for doc in documents.values())
+
+    def test_second_sync_reads_nothing(self, manager, docs):
+        """Test that unchanged files are recognized by size and mtime alone."""
+        first = manager.sync_directory("custom_test", docs)
+
+        with patch.object(manager, "_file_hash", side_effect=AssertionError), patch.object(
+            manager, "spool_uploads", side_effect=AssertionError
+        ):
+            second = manager.sync_directory("custom_test", docs)
+
+        assert first["added"] == 3
+        assert (second["added"], second["updated"], second["removed"]) == (0, 0, 0)
+        assert second["unchanged"] == 3
+
+    def test_applies_changes_only(self, manager, docs):
+        """Test that edits, touches, renames and removals are synced."""
+        manager.upload_documents("custom_test", [make_file("upload.txt", "uploaded by hand")])
+        manager.sync_directory("custom_test", docs)
+        (docs / "index.md").write_text("runner pools, caching and autoscaling")
+        stat = (docs / "guide" / "deploy.txt").stat()
+        os.utime(docs / "guide" / "deploy.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        (docs / "guide" / "old.txt").rename(docs / "guide" / "archive.txt")
+
+        result = manager.sync_directory("custom_test", docs)
+
+        assert (result["added"], result["updated"], result["removed"]) == (1, 1, 1)
+        assert result["unchanged"] == 1
+        assert self.filenames(manager) == [
+            "guide/archive.txt",
+            "guide/deploy.txt",
+            "index.md",
+            "upload.txt",
+        ]
+        hits = manager.query_knowledge_base("custom_test", "caching")["results"]
+        assert [hit["chunk"] for hit in hits] == ["runner pools, caching and autoscaling"]
+        legacy = manager.query_knowledge_base("custom_test", "legacy")["results"]
+        assert legacy[0]["metadata"]["filename"] == "guide/archive.txt"
+
+    def test_duplicate_files_stay_tracked(self, manager, docs):
+        """Test that a file edited into a copy of another is not read again."""
+        manager.sync_directory("custom_test", docs)
+        (docs / "guide" / "old.txt").write_text("deploy pipelines to staging")
+
+        first = manager.sync_directory("custom_test", docs)
+        with patch.object(manager, "_file_hash", side_effect=AssertionError), patch.object(
+            manager, "spool_uploads", side_effect=AssertionError
+        ):
+            second = manager.sync_directory("custom_test", docs)
+
+        assert (first["duplicates"], first["removed"]) == (1, 0)
+        assert self.filenames(manager) == ["guide/deploy.txt", "index.md"]
+        assert second["unchanged"] == 3
+
+        (docs / "guide" / "deploy.txt").unlink()
+        third = manager.sync_directory("custom_test", docs)
+
+        assert (third["added"], third["removed"]) == (1, 1)
+        assert self.filenames(manager) == ["guide/old.txt", "index.md"]
+
+
+class TestSegments:
+    """Test suite for segmented KB indexes and background merges."""
+
+    def upload_each(self, manager, texts):
+        """Upload every text as its own document, flushing one segment each."""
+        for i, text in enumerate(texts):
+            manager.upload_documents("custom_test", [make_file(f"doc{i}.txt", text)])
+
+    def test_fan_out_matches_single_index(self, manager, tmp_path):
+        """Test that BM25 over several segments scores like one index."""
+        texts = ["alpha beta", "beta gamma delta", "alpha alpha gamma", "delta epsilon"]
+        self.upload_each(manager, texts)
+
+        segmented = SegmentedIndex.load(tmp_path / "custom_test")
+        single = BM25Index()
+        for i, text in enumerate(texts):
+            single.add_chunk(str(i), text)
+
+        assert len(segmented.segments) == len(texts)
+        ranked = manager.search_chunks("custom_test", "alpha gamma", top_k=4)
+        expected = single.search("alpha gamma", top_k=4)
+        assert [o for o, _ in ranked] == [o for o, _ in expected]
+        assert [s for _, s in ranked] == pytest.approx([s for _, s in expected])
+
+    def test_merge_keeps_results(self, manager, tmp_path):
+        """Test that a size-tiered merge combines segments without changing results."""
+        self.upload_each(manager, ["alpha beta", "beta gamma"])
+        assert len(SegmentedIndex.load(tmp_path / "custom_test").segments) == 2
+        before = manager.query_knowledge_base("custom_test", "beta")
+
+        manager.config.kb_merge_factor = 2
+        manager.merge_segments("custom_test")
+
+        assert len(SegmentedIndex.load(tmp_path / "custom_test").segments) == 1
+        assert manager.query_knowledge_base("custom_test", "beta") == before
+
+    def test_merge_of_deleted_kb_is_dropped(self, manager, tmp_path):
+        """Test that deleting a KB while its segments merge ends the merge quietly."""
+        self.upload_each(manager, ["alpha beta", "beta gamma"])
+        names = [s.name for s in SegmentedIndex.load(tmp_path / "custom_test").segments]
+        run = SegmentMerge.run
+
+        def delete_then_run(merge):
+            manager.delete_knowledge_base("custom_test")
+            run(merge)
+
+        with patch.object(SegmentMerge, "run", delete_then_run):
+            manager._merge("custom_test", names)
+
+        assert "custom_test" not in manager.published
+        assert not (tmp_path / "custom_test").exists()
+
+    def test_overlapping_merge_is_discarded(self, manager, tmp_path):
+        """Test that a merge whose segments another merge replaced is dropped."""
+        self.upload_each(manager, ["alpha beta", "beta gamma"])
+        kb_dir = tmp_path / "custom_test"
+        names = [s.name for s in SegmentedIndex.load(kb_dir).segments]
+        run = SegmentMerge.run
+
+        def merge_meanwhile(merge):
+            with patch.object(SegmentMerge, "run", run):
+                assert manager._merge("custom_test", names)
+            run(merge)
+
+        with patch.object(SegmentMerge, "run", merge_meanwhile):
+            assert not manager._merge("custom_test", names)
+
+        segments = SegmentedIndex.load(kb_dir).segments
+        assert [p.name for p in kb_dir.glob("seg_*")] == [s.name for s in segments]
+        assert len(manager.query_knowledge_base("custom_test", "beta")["results"]) == 2
+
+    def test_legacy_index_is_migrated(self, manager, tmp_path):
+        """Test that a KB stored as a single index becomes one segment."""
+        self.upload_each(manager, ["alpha beta"])
+        kb_dir = tmp_path / "custom_test"
+        for path in kb_dir.glob("seg_*"):
+            shutil.rmtree(path)
+        (kb_dir / SegmentedIndex.MANIFEST_FILENAME).unlink()
+
+        reloaded = KnowledgeBaseManager(storage_dir=str(tmp_path))
+        reloaded.upgrade_knowledge_bases()
+        result = reloaded.query_knowledge_base("custom_test", "alpha")
+
+        assert result["results"][0]["chunk"] == "alpha beta"
+        assert [len(s) for s in SegmentedIndex.load(kb_dir).segments] == [1]
+
+
+class TestSnapshotIsolation:
+    """Test suite for queries pinned to a published KB version."""
+
+    def test_pinned_version_survives_compaction(self, manager, tmp_path):
+        """Test that files a merge replaces stay until the pinning query ends."""
+        manager.config.kb_compaction_ratio = 2.0
+        result = manager.upload_documents(
+            "custom_test", [make_file("a.txt", "alpha notes"), make_file("b.txt", "beta notes")]
+        )
+        doc_id = result["processed_documents"][0]["doc_id"]
+        chunk_file = tmp_path / "custom_test" / f"{doc_id}.chunks"
+
+        with manager.pin("custom_test") as snapshot:
+            ranked = manager.search_chunks("custom_test", "alpha", snapshot=snapshot)
+            manager.delete_document("custom_test", doc_id)
+            manager.compact_knowledge_base("custom_test")
+
+            pinned = manager.format_results("custom_test", ranked, snapshot)
+            assert [r["chunk"] for r in pinned["results"]] == ["alpha notes"]
+            assert chunk_file.exists()
+
+        assert not chunk_file.exists()
+        assert manager.query_knowledge_base("custom_test", "alpha")["results"] == []
+
+    def test_recreated_kb_keeps_its_files(self, manager, tmp_path):
+        """Test that files retired before a KB's deletion never match a new KB's files."""
+        manager.upload_documents(
+            "custom_test", [make_file("a.txt", "alpha notes"), make_file("b.txt", "beta notes")]
+        )
+
+        with manager.pin("custom_test"):
+            manager.compact_knowledge_base("custom_test")
+            manager.delete_knowledge_base("custom_test")
+            manager.create_knowledge_base("custom_test", "Test KB")
+            manager.upload_documents(
+                "custom_test",
+                [make_file("a.txt", "alpha notes"), make_file("b.txt", "beta notes")],
+            )
+
+        assert len(manager.query_knowledge_base("custom_test", "alpha")["results"]) == 1
+
+    def test_stale_load_is_not_cached_as_pinned_version(self, manager):
+        """Test that a pinned version missing from the cache is not filled with newer data."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha")])
+
+        with manager.pin("custom_test") as snapshot:
+            manager._kb_cache.invalidate("custom_test")
+            manager.upload_documents("custom_test", [make_file("b.txt", "beta")])
+
+            assert snapshot.loaded.n_chunks == 2
+            assert manager._kb_cache.get("custom_test", snapshot.version) is None
+
+    def test_slow_extraction_does_not_block_writers(self, manager, monkeypatch):
+        """Test that other KBs are created while a document is still being chunked."""
+        started, release = threading.Event(), threading.Event()
+
+        def slow_chunks(text_stream):
+            text = "".join(text_stream)
+            started.set()
+            release.wait(5)
+            yield text
+
+        monkeypatch.setattr(manager, "_iter_chunks", slow_chunks)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            upload = pool.submit(
+                manager.upload_documents, "custom_test", [make_file("a.txt", "slow notes")]
+            )
+            assert started.wait(5)
+            begin = time.monotonic()
+            manager.create_knowledge_base("custom_other", "Other KB")
+            assert time.monotonic() - begin < 1
+            release.set()
+            upload.result()
+
+        assert manager.query_knowledge_base("custom_test", "slow")["results"]
+
+    def test_pin_ignores_later_publishes(self, manager):
+        """Test that a pinned version keeps its metadata while uploads publish."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha")])
+
+        with manager.pin("custom_test") as snapshot:
+            manager.upload_documents("custom_test", [make_file("b.txt", "beta")])
+
+            assert snapshot.version == 1 and len(snapshot.metadata["documents"]) == 1
+            assert manager.list_knowledge_bases()[0]["document_count"] == 2
+
+    def test_queries_run_during_uploads(self, manager, tmp_path):
+        """Test that queries concurrent with uploads never fail or see torn state."""
+        errors = []
+
+        def query_until(done):
+            while not done():
+                try:
+                    result = manager.query_knowledge_base("custom_test", "shared topic", top_k=50)
+                    assert all(r["chunk"].startswith("shared topic") for r in result["results"])
+                except Exception as e:
+                    errors.append(e)
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            uploads = pool.submit(
+                lambda: [
+                    manager.upload_documents(
+                        "custom_test", [make_file(f"doc{i}.txt", f"shared topic number {i}")]
+                    )
+                    for i in range(20)
+                ]
+            )
+            readers = [pool.submit(query_until, uploads.done) for _ in range(2)]
+            uploads.result()
+            for reader in readers:
+                reader.result()
+
+        assert errors == []
+        result = manager.query_knowledge_base("custom_test", "shared topic", top_k=50)
+        assert len(result["results"]) == 20
+        manager.compactor.join(timeout=10)
+        with open(tmp_path / "index.json", encoding="utf-8") as f:
+            assert len(json.load(f)["knowledge_bases"]["custom_test"]["documents"]) == 20
+        assert not (tmp_path / "index.json.tmp").exists()
+
+
+class TestMappedPostings:
+    """Test suite for sealed segments served from memory-mapped postings."""
+
+    def test_sealed_segment_maps_postings(self, manager, tmp_path):
+        """Test that flushed segments store postings outside the segment JSON."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "beta alpha. 数据库 beta")])
+        (segment_dir,) = (tmp_path / "custom_test").glob("seg_*")
+
+        data = json.loads((segment_dir / Segment.FILENAME).read_text(encoding="utf-8"))
+        postings = MappedPostings(segment_dir)
+
+        assert "postings" not in data["index"]
+        assert list(postings) == sorted(postings)
+        assert postings.get("beta").tolist() == [[0, 2]]
+        assert "数据" in postings and "gamma" not in postings
+        assert manager.query_knowledge_base("custom_test", "alpha")["results"]
+
+    def test_inline_postings_are_converted(self, manager, tmp_path):
+        """Test that segments saved with JSON postings get mapped files on upgrade."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha beta")])
+        (segment_dir,) = (tmp_path / "custom_test").glob("seg_*")
+        segment = Segment.load(tmp_path / "custom_test", segment_dir.name)
+        segment.index.postings = dict(segment.index.postings.items())
+        segment.index.chunk_lengths = segment.index.chunk_lengths.tolist()
+        data = {
+            "index": segment.index.to_dict(),
+            "ordinals": segment.ordinals.tolist(),
+            "references": [],
+        }
+        (segment_dir / Segment.FILENAME).write_text(json.dumps(data), encoding="utf-8")
+        (segment_dir / MappedPostings.PAIRS_FILENAME).unlink()
+
+        reloaded = KnowledgeBaseManager(storage_dir=str(tmp_path))
+        reloaded.upgrade_knowledge_bases()
+        result = reloaded.query_knowledge_base("custom_test", "beta")
+
+        assert result["results"][0]["chunk"] == "alpha beta"
+        assert (segment_dir / MappedPostings.PAIRS_FILENAME).exists()
+        assert Segment.load(tmp_path / "custom_test", segment_dir.name).index.mapped
+
+    def test_sealed_segment_maps_chunk_tables(self, manager, tmp_path):
+        """Test that chunk IDs, hashes and ordinals are mapped, not held per process."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha beta")])
+        manager.upload_documents("custom_test", [make_file("b.txt", "gamma delta")])
+        kb_dir = tmp_path / "custom_test"
+
+        index = SegmentedIndex.load(kb_dir)
+        data = json.loads((kb_dir / index.segments[0].name / Segment.FILENAME).read_text())
+
+        assert "chunk_ids" not in data["index"] and "ordinals" not in data
+        assert all(isinstance(s.index.chunk_ids, MappedStrings) for s in index.segments)
+        assert all(segment.mapped for segment in index.segments)
+        assert index.find_chunk("gamma delta") == 1
+        assert index.chunk_id(1).endswith("_0")
+        assert manager.query_knowledge_base("custom_test", "gamma")["results"]
+
+    def test_other_process_publishes_are_seen(self, manager, tmp_path):
+        """Test that a worker sharing the storage directory sees another's uploads."""
+        worker = KnowledgeBaseManager(storage_dir=str(tmp_path))
+        assert worker.query_knowledge_base("custom_test", "alpha")["results"] == []
+
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha beta")])
+
+        assert worker.published["custom_test"]["document_count"] == 1
+        assert worker.query_knowledge_base("custom_test", "alpha")["results"]
+
+    def test_writers_in_other_processes_keep_each_others_kbs(self, manager, tmp_path):
+        """Test that a writer reloads metadata another process published meanwhile."""
+        worker = KnowledgeBaseManager(storage_dir=str(tmp_path))
+        worker.create_knowledge_base("custom_other", "Other KB")
+
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha beta")])
+        worker.upload_documents("custom_other", [make_file("b.txt", "gamma delta")])
+
+        counts = {
+            kb["id"]: kb["document_count"]
+            for kb in KnowledgeBaseManager(storage_dir=str(tmp_path)).list_knowledge_bases()
+        }
+        assert counts == {"custom_test": 1, "custom_other": 1}
+
+    def test_pins_of_other_processes_keep_retired_files(self, manager, tmp_path):
+        """Test that a merge keeps segments a query in another process still reads."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha beta")])
+        manager.upload_documents("custom_test", [make_file("b.txt", "alpha gamma")])
+        kb_dir = tmp_path / "custom_test"
+        merged = list(kb_dir.glob("seg_*"))
+        reader = KnowledgeBaseManager(storage_dir=str(tmp_path))
+
+        with reader.pin("custom_test") as snapshot:
+            ranked = reader.search_chunks("custom_test", "alpha", 5, None, snapshot)
+            manager.compact_knowledge_base("custom_test")
+            assert all(path.exists() for path in merged)
+            result = reader.format_results("custom_test", ranked, snapshot)
+
+        assert len(result["results"]) == 2
+        with manager.pin("custom_test"):
+            pass
+        assert not any(path.exists() for path in merged)
+
+    def test_lazy_start_and_warm_up(self, manager, tmp_path):
+        """Test that construction reads nothing and warm-up preloads listed KBs."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha beta")])
+        config = Configuration(kb_warm_kb_ids="custom_test, custom_missing")
+
+        started = KnowledgeBaseManager(storage_dir=str(tmp_path), config=config)
+        assert started._index is None
+
+        started.warm_up()
+        assert "custom_test" in started._kb_cache
+
+
+class TestChunkStore:
+    """Test suite for binary chunk stores."""
+
+    @pytest.mark.parametrize("compress", [True, False])
+    def test_round_trip(self, tmp_path, compress):
+        """Test that chunks and references are read back by index."""
+        path = tmp_path / "doc.chunks"
+        writer = ChunkStoreWriter(
+            path, "doc", "notes.txt", "2024-01-01T00:00:00", compress=compress
+        )
+        writer.add("first chunk")
+        writer.add_reference("other_3")
+        writer.add("dritter Abschnitt ü")
+        writer.close()
+
+        with ChunkStore(path) as store:
+            assert len(store) == 3
+            assert store.text(2) == "dritter Abschnitt ü"
+            assert store.text(0) == "first chunk"
+            assert store.references() == {1: "other_3"}
+            assert store.metadata["filename"] == "notes.txt"
+
+    def test_blocks_decompress_with_trained_dictionary(self, tmp_path):
+        """Test that dictionary-compressed blocks are read independently."""
+        pytest.importorskip("zstandard")
+        texts = [f"Step {i}: configure the runner cache for pipeline job {i}." for i in range(1000)]
+        assert sum(len(t) for t in texts) > 2 * BLOCK_SIZE
+        dictionary = train_dictionary(texts)
+        assert dictionary is not None
+
+        path = tmp_path / "doc.chunks"
+        writer = ChunkStoreWriter(path, "doc", "a.txt", "", dictionary=dictionary)
+        for text in texts:
+            writer.add(text)
+        writer.close()
+
+        assert path.stat().st_size < sum(len(t) for t in texts) / 3
+        with ChunkStore(path, dictionary) as store:
+            assert store.text(999) == texts[999]
+            assert store.text(0) == texts[0]
+        with pytest.raises(ValueError), ChunkStore(path) as store:
+            store.text(0)
+
+    def test_dictionary_trained_elsewhere_is_found(self, manager, tmp_path):
+        """Test that a missing dictionary is looked up again instead of cached."""
+        assert manager._chunk_dictionary("custom_test") is None
+
+        (tmp_path / "custom_test" / DICTIONARY_FILENAME).write_bytes(b"trained")
+
+        assert manager._chunk_dictionary("custom_test") == b"trained"
+
+    def test_json_chunk_files_are_converted(self, manager, tmp_path):
+        """Test that KBs with JSON chunk files are converted on upgrade."""
+        kb_dir = tmp_path / "custom_test"
+        chunks = [
+            {"id": "abc_0", "content": "legacy text", "metadata": {"filename": "old.txt"}}
+        ]
+        with open(kb_dir / "abc.json", "w", encoding="utf-8") as f:
+            json.dump({"document_id": "abc", "filename": "old.txt", "chunks": chunks}, f)
+        kb_metadata = manager.index["knowledge_bases"]["custom_test"]
+        kb_metadata["documents"]["abc"] = {"filename": "old.txt", "chunk_count": 1}
+        del kb_metadata["chunk_format"]
+        manager._save_index()
+
+        manager.upgrade_knowledge_bases()
+        result = manager.query_knowledge_base("custom_test", "legacy")
+
+        assert result["results"][0]["chunk"] == "legacy text"
+        assert result["results"][0]["metadata"]["total_chunks"] == 1
+        assert (kb_dir / "abc.chunks").exists() and not (kb_dir / "abc.json").exists()
+
+
+class TestSqliteBackend:
+    """Test suite for KBs stored in SQLite FTS5 databases."""
+
+    @pytest.fixture
+    def manager(self, tmp_path):
+        """Create a KB manager whose new KBs use the SQLite backend."""
+        kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path), storage_backend="sqlite")
+        kb_manager.create_knowledge_base("custom_test", "Test KB")
+        return kb_manager
+
+    def test_query_returns_standard_shape(self, manager):
+        """Test that FTS5 bm25() results use the native results/sources shape."""
+        manager.upload_documents(
+            "custom_test",
+            [
+                make_file("a.txt", "Pipelines run on docker runners."),
+                make_file("b.txt", "Caching speeds up docker builds (a lot)."),
+            ],
+        )
+
+        result = manager.query_knowledge_base("custom_test", 'docker "caching" OR')
+
+        assert result["results"][0]["metadata"] == {
+            "filename": "b.txt",
+            "chunk_index": 0,
+            "total_chunks": 1,
+        }
+        assert [s["title"] for s in result["sources"]] == ["b.txt", "a.txt"]
+        assert manager.list_knowledge_bases()[0]["storage_backend"] == "sqlite"
+
+    def test_first_query_does_not_wait_for_writers(self, manager, tmp_path):
+        """Test that opening a database for a query skips the writer lock."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha notes")])
+        reader = KnowledgeBaseManager(storage_dir=str(tmp_path))
+        assert "custom_test" in reader.published
+        held, release = threading.Event(), threading.Event()
+
+        def hold_writer_lock():
+            with reader._write_lock:
+                held.set()
+                release.wait(10)
+
+        writer = threading.Thread(target=hold_writer_lock)
+        writer.start()
+        held.wait(10)
+        try:
+            with ThreadPoolExecutor(1) as pool:
+                query = pool.submit(reader.query_knowledge_base, "custom_test", "alpha")
+                assert len(query.result(timeout=5)["results"]) == 1
+        finally:
+            release.set()
+            writer.join()
+
+    def test_delete_document(self, manager):
+        """Test that deleted documents leave the FTS index."""
+        result = manager.upload_documents("custom_test", [make_file("a.txt", "alpha notes")])
+
+        manager.delete_document("custom_test", result["processed_documents"][0]["doc_id"])
+
+        assert manager.query_knowledge_base("custom_test", "alpha")["results"] == []
+        assert manager.index["knowledge_bases"]["custom_test"]["chunk_count"] == 0
+
+    def test_rejects_vector_scoring(self, manager):
+        """Test that the SQLite backend only offers BM25 scoring."""
+        with pytest.raises(ValueError):
+            manager.create_knowledge_base("custom_vec", "Vector KB", scoring_mode="vector")
+
+
+class TestAnalyzer:
+    """Test suite for the analyzer shared by indexing and querying."""
+
+    def test_terms(self):
+        """Test NFKC folding, case folding and CJK bigrams."""
+        assert analyze("ＢＵＩＬＤ Straße") == ["build", "strasse"]
+        assert analyze("向量数据库 v2") == ["向量", "量数", "数据", "据库", "v2"]
+        assert analyze("a 字 b") == ["a", "字", "b"]
+
+    def test_chinese_query(self, manager):
+        """Test that Chinese queries only match documents sharing their bigrams."""
+        manager.upload_documents(
+            "custom_test",
+            [
+                make_file("db.txt", "如何配置向量数据库的索引。"),
+                make_file("net.txt", "如何配置网络代理服务器。"),
+            ],
+        )
+
+        result = manager.query_knowledge_base("custom_test", "向量数据库")
+
+        assert [r["metadata"]["filename"] for r in result["results"]] == ["db.txt"]
+
+    def test_stale_segments_are_reindexed(self, manager, tmp_path):
+        """Test that segments built with older analyzer rules are rebuilt on upgrade."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "数据库 ＢＵＩＬＤ notes")])
+        kb_dir = tmp_path / "custom_test"
+        (stale,) = kb_dir.glob("seg_*")
+        path = stale / Segment.FILENAME
+        data = json.loads(path.read_text(encoding="utf-8"))
+        segment = Segment.load(kb_dir, stale.name)
+        segment.index.chunk_lengths = segment.index.chunk_lengths.tolist()
+        data["index"] = segment.index.to_dict()
+        data["ordinals"] = segment.ordinals.tolist()
+        del data["index"]["analyzer"]
+        data["index"]["postings"] = {}
+        path.write_text(json.dumps(data), encoding="utf-8")
+
+        reloaded = KnowledgeBaseManager(storage_dir=str(tmp_path))
+        reloaded.upgrade_knowledge_bases()
+        result = reloaded.query_knowledge_base("custom_test", "build 数据")
+
+        assert result["results"][0]["metadata"]["filename"] == "a.txt"
+        assert not stale.exists()
+        segments = SegmentedIndex.load(kb_dir).segments
+        assert [s.index.analyzer for s in segments] == [ANALYZER]
+
+    def test_queries_do_not_upgrade_segments(self, manager, tmp_path):
+        """Test that outdated segments are read as they are without the writer lock."""
+        manager.upload_documents("custom_test", [make_file("a.txt", "alpha beta")])
+        (segment_dir,) = (tmp_path / "custom_test").glob("seg_*")
+        segment = Segment.load(tmp_path / "custom_test", segment_dir.name)
+        segment.index.postings = dict(segment.index.postings.items())
+        segment.index.chunk_lengths = segment.index.chunk_lengths.tolist()
+        data = {
+            "index": segment.index.to_dict(),
+            "ordinals": segment.ordinals.tolist(),
+            "references": [],
+        }
+        (segment_dir / Segment.FILENAME).write_text(json.dumps(data), encoding="utf-8")
+        (segment_dir / MappedPostings.PAIRS_FILENAME).unlink()
+        reloaded = KnowledgeBaseManager(storage_dir=str(tmp_path))
+        assert "custom_test" in reloaded.published
+        held, release = threading.Event(), threading.Event()
+
+        def hold_writer_lock():
+            with reloaded._write_lock:
+                held.set()
+                release.wait(10)
+
+        writer = threading.Thread(target=hold_writer_lock)
+        writer.start()
+        held.wait(10)
+        try:
+            with ThreadPoolExecutor(1) as pool:
+                query = pool.submit(reloaded.query_knowledge_base, "custom_test", "beta")
+                result = query.result(timeout=5)
+        finally:
+            release.set()
+            writer.join()
+
+        assert result["results"][0]["chunk"] == "alpha beta"
+        assert not (segment_dir / MappedPostings.PAIRS_FILENAME).exists()
+
+    def test_sqlite_chinese_query(self, tmp_path):
+        """Test that the SQLite backend indexes analyzed terms."""
+        kb = SqliteKnowledgeBase(tmp_path / SqliteKnowledgeBase.FILENAME)
+        kb.add_document("db", "db.txt", "now", ["如何配置向量数据库的索引。"])
+        kb.add_document("net", "net.txt", "now", ["如何配置网络代理服务器。"])
+
+        ranked = kb.search("向量数据库", top_k=5)
+
+        assert [c["id"] for c in kb.get_chunks([rowid for rowid, _ in ranked])] == ["db_0"]
+        kb.close()
+
+    def test_sqlite_upgrade(self, tmp_path):
+        """Test that databases indexing raw chunk text are re-analyzed on open."""
+        path = tmp_path / SqliteKnowledgeBase.FILENAME
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            """
+            CREATE TABLE documents (doc_id TEXT PRIMARY KEY, filename TEXT NOT NULL,
+                uploaded_at TEXT NOT NULL, chunk_count INTEGER NOT NULL);
+            CREATE TABLE chunks (id INTEGER PRIMARY KEY, doc_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL, content TEXT NOT NULL);
+            CREATE VIRTUAL TABLE chunks_fts USING fts5(
+                content, content='chunks', content_rowid='id', tokenize='unicode61');
+            INSERT INTO documents VALUES ('db', 'db.txt', 'now', 1);
+            INSERT INTO chunks VALUES (1, 'db', 0, '如何配置向量数据库');
+            INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild');
+            """
+        )
+        conn.close()
+
+        kb = SqliteKnowledgeBase(path)
+
+        assert [rowid for rowid, _ in kb.search("数据库")] == [1]
+        kb.close()
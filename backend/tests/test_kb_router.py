@@ -0,0 +1,140 @@
+"""Tests for knowledge base routing."""
+from unittest.mock import patch
+
+import pytest
+
+from agent.configuration import Configuration
+from agent.kb_manager import KnowledgeBaseManager
+from agent.kb_router import reciprocal_rank_fusion, route_knowledge_base_query
+from tests.test_kb_manager import make_file
+
+
+class TestReciprocalRankFusion:
+    """Test suite for reciprocal-rank fusion."""
+
+    def test_items_ranked_by_both_lists_win(self):
+        """Test that an item ranked well by both engines is fused first."""
+        lexical = [(1, 9.0), (2, 5.0), (3, 1.0)]
+        vector = [(2, 0.9), (4, 0.8), (1, 0.1)]
+
+        fused = reciprocal_rank_fusion([lexical, vector])
+
+        assert [item for item, _ in fused][:2] == [2, 1]
+        assert {item for item, _ in fused} == {1, 2, 3, 4}
+
+
+class TestHybridRouting:
+    """Test suite for hybrid custom KB queries."""
+
+    @pytest.fixture
+    def hybrid_manager(self, tmp_path, embedding_server):
+        """Create a hybrid KB served by the stand-in embedding server."""
+        config = Configuration(ollama_base_url=embedding_server.base_url)
+        kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path), config=config)
+        kb_manager.create_knowledge_base("custom_hybrid", "Hybrid KB", scoring_mode="hybrid")
+        kb_manager.upload_documents(
+            "custom_hybrid",
+            [
+                make_file("a.txt", "kubernetes pod scheduling"),
+                make_file("b.txt", "baking sourdough bread"),
+            ],
+        )
+        with patch("agent.kb_router.kb_manager", kb_manager):
+            yield kb_manager
+
+    def test_hybrid_query_reports_stage_timings(self, hybrid_manager):
+        """Test that hybrid KBs fuse both engines and report latencies."""
+        result = route_knowledge_base_query(
+            "sourdough bread", kb_type="custom", custom_kb_id="custom_hybrid", top_k=1
+        )
+
+        assert result["results"][0]["chunk"] == "baking sourdough bread"
+        timings = result["metadata"]["timings_ms"]
+        assert set(timings) == {"lexical", "vector", "fusion", "total"}
+        assert result["metadata"]["retrieval_mode"] == "hybrid"
+
+    def test_non_hybrid_kb_uses_single_engine(self, hybrid_manager):
+        """Test that other scoring modes keep the plain result shape."""
+        hybrid_manager.create_knowledge_base("custom_plain", "Plain KB")
+        hybrid_manager.upload_documents("custom_plain", [make_file("a.txt", "plain text")])
+
+        result = route_knowledge_base_query(
+            "plain", kb_type="custom", custom_kb_id="custom_plain"
+        )
+
+        assert "metadata" not in result
+        assert result["results"][0]["chunk"] == "plain text"
+
+
+class TestFederatedRouting:
+    """Test suite for queries across several custom KBs."""
+
+    @pytest.fixture
+    def manager(self, tmp_path):
+        """Create two BM25 KBs of very different sizes."""
+        kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path))
+        kb_manager.create_knowledge_base("custom_ops", "Ops KB")
+        kb_manager.create_knowledge_base("custom_dev", "Dev KB")
+        kb_manager.upload_documents(
+            "custom_ops",
+            [make_file(f"ops{i}.txt", f"runner pool {i} capacity") for i in range(5)]
+            + [make_file("deploy.txt", "deploy pipelines to staging")],
+        )
+        kb_manager.upload_documents("custom_dev", [make_file("dev.txt", "deploy previews")])
+        with patch("agent.kb_router.kb_manager", kb_manager):
+            yield kb_manager
+
+    def test_merges_top_hits_of_every_kb(self, manager):
+        """Test that each KB's best hit competes on a normalized score."""
+        result = route_knowledge_base_query(
+            "deploy", kb_type="custom", custom_kb_id=["custom_ops", "custom_dev"], top_k=2
+        )
+
+        assert {r["metadata"]["kb_id"] for r in result["results"]} == {"custom_ops", "custom_dev"}
+        assert [s["url"] for s in result["sources"]] == [
+            f"local://{r['metadata']['kb_id']}/{r['metadata']['filename']}"
+            for r in result["results"]
+        ]
+        assert result["metadata"]["retrieval_mode"] == "federated"
+        assert set(result["metadata"]["timings_ms"]["search"]) == {"custom_ops", "custom_dev"}
+
+    def test_single_item_list_uses_plain_query(self, manager):
+        """Test that a one-KB list keeps the single-KB result shape."""
+        result = route_knowledge_base_query(
+            "previews", kb_type="custom", custom_kb_id=["custom_dev"]
+        )
+
+        assert "metadata" not in result
+        assert result["results"][0]["chunk"] == "deploy previews"
+
+    def test_deleted_hit_does_not_shift_later_results(self, tmp_path):
+        """Test that a chunk deleted after the search leaves other hits paired."""
+        kb_manager = KnowledgeBaseManager(storage_dir=str(tmp_path), storage_backend="sqlite")
+        kb_manager.create_knowledge_base("custom_a", "A KB")
+        kb_manager.create_knowledge_base("custom_b", "B KB")
+        uploaded = kb_manager.upload_documents(
+            "custom_a",
+            [make_file("gone.txt", "deploy deploy deploy"), make_file("kept.txt", "deploy once more")],
+        )
+        kb_manager.upload_documents("custom_b", [make_file("other.txt", "deploy elsewhere")])
+        gone = uploaded["processed_documents"][0]["doc_id"]
+        search = kb_manager.search_chunks
+
+        def search_then_delete(kb_id, *args):
+            ranked = search(kb_id, *args)
+            if kb_id == "custom_a" and gone in kb_manager.published[kb_id]["documents"]:
+                kb_manager.delete_document(kb_id, gone)
+            return ranked
+
+        with patch("agent.kb_router.kb_manager", kb_manager), patch.object(
+            kb_manager, "search_chunks", side_effect=search_then_delete
+        ):
+            result = route_knowledge_base_query(
+                "deploy", kb_type="custom", custom_kb_id=["custom_a", "custom_b"], top_k=3
+            )
+
+        # The deleted hit ranked first; the other hits keep their own places
+        assert [(r["chunk"], r["metadata"]["filename"]) for r in result["results"]] == [
+            ("deploy elsewhere", "other.txt"),
+            ("deploy once more", "kept.txt"),
+        ]
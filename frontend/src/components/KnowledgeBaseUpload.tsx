@@ -6,10 +6,47 @@ interface KnowledgeBaseUploadProps {
   onUploadComplete: (kbId: string, kbName: string) => void;  // Fix 2: Updated signature
 }
 
+// Per-file entry of an ingestion job, as reported by the jobs endpoint
+interface JobFile {
+  filename: string;
+  status: string;
+  error?: string;
+}
+
+interface IngestionJob {
+  status: "queued" | "running" | "completed" | "failed";
+  error: string | null;
+  files_total: number;
+  files_done: number;
+  files: JobFile[];
+}
+
+const JOB_POLL_INTERVAL_MS = 1000;
+
+// Uploads are ingested in the background; poll the job until it finishes
+async function waitForJob(
+  jobId: string,
+  onProgress: (job: IngestionJob) => void
+): Promise<IngestionJob> {
+  for (;;) {
+    const response = await fetch(`http://localhost:2024/api/knowledge-base/jobs/${jobId}`);
+    if (!response.ok) {
+      throw new Error(`Checking upload progress failed: ${response.statusText}`);
+    }
+    const job: IngestionJob = await response.json();
+    onProgress(job);
+    if (job.status === "completed" || job.status === "failed") {
+      return job;
+    }
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+}
+
 export function KnowledgeBaseUpload({ onUploadComplete }: KnowledgeBaseUploadProps) {
   const [uploading, setUploading] = useState(false);
   const [progress, setProgress] = useState(0);
   const [error, setError] = useState<string | null>(null);
+  const [fileErrors, setFileErrors] = useState<JobFile[]>([]);
   const [selectedFiles, setSelectedFiles] = useState<File[]>([]);
   const fileInputRef = useRef<HTMLInputElement>(null);
 
@@ -18,6 +55,7 @@ export function KnowledgeBaseUpload({ onUploadComplete }: KnowledgeBaseUploadPro
       const files = Array.from(e.target.files);
       setSelectedFiles(files);
       setError(null);
+      setFileErrors([]);
     }
   };
 
@@ -30,6 +68,7 @@ export function KnowledgeBaseUpload({ onUploadComplete }: KnowledgeBaseUploadPro
     setUploading(true);
     setProgress(0);
     setError(null);
+    setFileErrors([]);
 
     const formData = new FormData();
     selectedFiles.forEach((file) => {
@@ -47,7 +86,19 @@ export function KnowledgeBaseUpload({ onUploadComplete }: KnowledgeBaseUploadPro
       }
 
       const result = await response.json();
-      setProgress(100);
+      const job = await waitForJob(result.job_id, (update) => {
+        if (update.files_total > 0) {
+          setProgress(Math.round((update.files_done / update.files_total) * 100));
+        }
+      });
+      const failed = job.files.filter((file) => file.status === "error");
+      setFileErrors(failed);
+      if (job.status === "failed") {
+        throw new Error(`Processing failed: ${job.error ?? "unknown error"}`);
+      }
+      if (failed.length === job.files.length) {
+        throw new Error("None of the files could be processed");
+      }
 
       // Notify parent component with both ID and name (Fix 2)
       onUploadComplete(result.kb_id, result.kb_name || result.kb_id);
@@ -153,6 +204,20 @@ export function KnowledgeBaseUpload({ onUploadComplete }: KnowledgeBaseUploadPro
           <p className="text-sm text-red-600 dark:text-red-400">{error}</p>
         </div>
       )}
+
+      {/* Per-file Errors */}
+      {fileErrors.length > 0 && (
+        <div className="p-3 space-y-1 bg-red-50 dark:bg-red-950/30 border border-red-200 dark:border-red-900 rounded-md">
+          <p className="text-sm font-medium text-red-600 dark:text-red-400">
+            {fileErrors.length} file(s) could not be processed:
+          </p>
+          {fileErrors.map((file, index) => (
+            <p key={index} className="text-sm text-red-600 dark:text-red-400">
+              {file.filename}: {file.error ?? "unknown error"}
+            </p>
+          ))}
+        </div>
+      )}
     </Card>
   );
 }